@@ -1,42 +1,70 @@
-import json
+import csv
 import random
 import re
 import asyncio
 import subprocess, datetime
 import os
 import html
+import time
+import functools
+import tempfile
 from pathlib import Path
 
+import numpy as np
 from dotenv import load_dotenv
 from rapidfuzz import fuzz, process
 
 from telegram import (
     Update,
     InlineKeyboardMarkup, InlineKeyboardButton,
+    InlineQueryResultArticle, InputTextMessageContent,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove,
     constants,
 )
 from telegram.ext import (
     ApplicationBuilder,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ConversationHandler,
+    InlineQueryHandler,
+    TypeHandler,
     ContextTypes,
     filters,
 )
 
-# ---------- Общие константы ----------
-
-BACK_RE = r"^(?:🔙\s*)?Назад$"
-
 # === библиотека предметов ===
-from item_catalog import init_catalogs, enrich_item, render_item_card, MAGIC, NONMAGIC
+from item_catalog import (
+    init_catalogs, enrich_item, render_item_card, get_item, search_items, complete_names,
+    MAGIC, NONMAGIC,
+)
+from inventory_model import Inventory, referenced_texts, resolve_ref
+import bulk_import
+import history
+import catalog_columns
+import catalog_facets
+import item_catalog
+import campaigns
+import dice
+import export
+import idempotency
+import inventory_cache
+import menu_router
+import metrics
+import paging
+import party_stats
+import profiling
+import storage_codec
 
 load_dotenv(dotenv_path=Path(__file__).with_name('.env'), override=True)
 TOKEN = os.getenv("BOT_TOKEN")
-DATA_FILE = Path("inventory_data.json")
+DATA_FILE = Path(os.getenv("DATA_FILE", "inventory_data.json"))
+STATE_DB = Path(os.getenv("STATE_DB", "conversation_state.sqlite3"))   # состояние разговоров (переживает рестарт)
+STATE_TTL = float(os.getenv("STATE_TTL_DAYS", "7")) * 24 * 3600
+HISTORY_DB = Path(os.getenv("HISTORY_DB", "inventory_history.sqlite3"))   # /history и /undo
+HISTORY_KEEP = int(os.getenv("HISTORY_KEEP", str(history.KEEP)))         # изменений на игрока
 DATA_DIR = (Path(__file__).parent / "data").resolve()
 
 # --------- Таблицы и данные ---------
@@ -113,30 +141,156 @@ PLAYERS = {
 PLAYER_WITH_SIMULATION = "Найт"
 
 
+# --------- Кампании ---------
+
+CAMPAIGNS_FILE = Path(os.getenv("CAMPAIGNS_FILE", "campaigns.json"))
+CAMPAIGNS_DIR = Path(os.getenv("CAMPAIGNS_DIR", "campaigns"))        # шарды кампаний
+SHARD_IDLE = float(os.getenv("SHARD_IDLE_MINUTES", "30")) * 60
+STORAGE_CODEC = os.getenv("STORAGE_CODEC", "json")     # json | json-pretty | msgpack, см. storage_codec.py
+
+
+def load_campaigns() -> campaigns.Registry:
+    """Реестр кампаний; основная собрана из констант выше и хранится в DATA_FILE."""
+    main = campaigns.Campaign(
+        campaigns.DEFAULT_CAMPAIGN, "Основная", MASTER_ID, dict(PLAYERS),
+        PLAYER_WITH_SIMULATION, campaigns.Shard(lambda: DATA_FILE, STORAGE_CODEC),
+    )
+    return campaigns.Registry(CAMPAIGNS_FILE, CAMPAIGNS_DIR, main, STORAGE_CODEC)
+
+
+CAMPAIGNS = load_campaigns()
+
+
+def _camp(update, context) -> campaigns.Campaign:
+    """Текущая кампания пользователя (выбранная через /campaign или единственная)."""
+    return CAMPAIGNS.for_user(update.effective_user.id, context.user_data.get("campaign"))
+
+
+def _is_master(update, context) -> bool:
+    return _camp(update, context).is_master(update.effective_user.id)
+
+
+async def evict_idle_shards():
+    """В цикле событий, как и обработчики: шарды, кеш и сводки меняются без гонок с ними."""
+    for cid in CAMPAIGNS.evict_idle(SHARD_IDLE):
+        INVENTORY_CACHE.drop_campaign(cid)
+        PARTY.pop(cid, None)
+        print(f"💤 Кампания {cid} выгружена из памяти")
+
+
 # --------- Хранилище инвентаря ---------
 
-def _load_all():
-    if DATA_FILE.exists():
-        return json.loads(DATA_FILE.read_text(encoding="utf-8"))
-    return {}
+# разобранные инвентари недавно активных игроков, см. inventory_cache.py
+INVENTORY_CACHE = inventory_cache.InventoryCache(int(os.getenv("INVENTORY_CACHE_MB", "8")) * 1024 * 1024)
+
 
+def _load_all(camp: campaigns.Campaign | None = None):
+    return (camp or CAMPAIGNS.default).shard.load()
 
-def _save_all(data):
-    DATA_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
 
+def _save_all(data, camp: campaigns.Campaign | None = None):
+    (camp or CAMPAIGNS.default).shard.save(data)
 
-def get_inventory(user_id: int):
-    data = _load_all()
-    inv = data.get(str(user_id), {})
-    for cat in ITEMS.keys():
-        inv.setdefault(cat, [])
-    return inv
 
+def get_inventory(user_id: int, camp: campaigns.Campaign | None = None):
+    return get_inventory_with_version(user_id, camp)[0]
 
-def save_inventory(user_id: int, inv: dict):
-    data = _load_all()
-    data[str(user_id)] = inv
-    _save_all(data)
+
+def get_inventory_with_version(user_id: int, camp: campaigns.Campaign | None = None):
+    """
+    Инвентарь и его версия: счётчик растёт при каждой записи.
+    camp — кампания; по умолчанию та, где состоит user_id.
+    """
+    camp = camp or CAMPAIGNS.for_user(user_id)
+    data = _load_all(camp)
+    version = data.get("_versions", {}).get(str(user_id), 0)
+    key = (camp.cid, user_id)
+    inv = INVENTORY_CACHE.get(key, camp.shard.generation, version)
+    if inv is None:
+        inv = Inventory.from_json(data.get(str(user_id)), ITEMS.keys(), data.get("_texts"))
+        inv.version = version
+        INVENTORY_CACHE.put(key, camp.shard.generation, inv)
+    return inv, version
+
+
+async def save_inventory(user_id: int, inv: Inventory, camp: campaigns.Campaign | None = None,
+                   restored: int | None = None):
+    """restored — номер состояния из истории, если это откат (/undo)."""
+    camp = camp or CAMPAIGNS.for_user(user_id)
+    # под блокировкой шард перечитывается, если его успел записать другой процесс
+    async with camp.shard.alock():
+        data = _load_all(camp)
+        texts = data.setdefault("_texts", {})
+        old = data.get(str(user_id))
+        versions = data.setdefault("_versions", {})
+        # инвентарь читали не с последней версии (его записал другой процесс или
+        # другой обработчик) — правки переносятся на свежую, чтобы не затереть чужие;
+        # откат же и должен вернуть состояние целиком
+        stale = inv.version != versions.get(str(user_id), 0)
+        if stale and restored is None:
+            inv.rebase(Inventory.from_json(old, ITEMS.keys(), texts))
+        before = history.plain(old, texts, ITEMS.keys())    # до чистки таблицы описаний
+        data[str(user_id)] = new = inv.to_json(texts)
+        if old and referenced_texts(old) - referenced_texts(new):
+            _prune_texts(data)
+        versions[str(user_id)] = inv.version = versions.get(str(user_id), 0) + 1
+        _save_all(data, camp)
+        after = inv.to_json()
+        summary = f"↩️ откат к №{restored}: {history.describe(before, after)}" if restored is not None else None
+        # инвентарь уже записан: сбой журнала не должен оставить кэш и сводку партии старыми
+        try:
+            get_history().record(camp.cid, user_id, before, after, summary, restored)
+        except Exception as e:
+            print(f"⚠️ History error: {e}")
+    INVENTORY_CACHE.put((camp.cid, user_id), camp.shard.generation, inv)
+    _update_party(camp, user_id, inv, stale)
+
+
+_HISTORY: history.History | None = None
+
+
+def get_history() -> history.History:
+    """База истории открывается при первой записи (по текущему HISTORY_DB)."""
+    global _HISTORY
+    if _HISTORY is None or _HISTORY.path != HISTORY_DB:
+        _HISTORY = history.History(HISTORY_DB, keep=HISTORY_KEEP)
+    return _HISTORY
+
+
+# --------- Сводка партии ---------
+
+# кампания -> итоги; считаются при первом /party и дальше правятся на каждой записи
+PARTY: dict[str, party_stats.PartyStats] = {}
+
+
+def party_for(camp: campaigns.Campaign) -> party_stats.PartyStats:
+    data = _load_all(camp)
+    stats = PARTY.get(camp.cid)
+    if stats is None or stats.generation != camp.shard.generation:
+        stats = PARTY[camp.cid] = party_stats.PartyStats.build(data, camp.shard.generation, ITEMS.keys())
+    return stats
+
+
+def _update_party(camp: campaigns.Campaign, user_id: int, inv: Inventory, stale: bool):
+    stats = PARTY.get(camp.cid)
+    if stats is not None and stats.generation == camp.shard.generation:
+        if stale:
+            stats.replace(user_id, party_stats.Totals.of(inv))
+        else:
+            stats.apply(user_id, inv.changes)
+    inv.changes.clear()
+    inv.ops.clear()
+
+
+def _prune_texts(data: dict):
+    """Убирает из общей таблицы описания, на которые больше никто не ссылается."""
+    used = set()
+    for key, obj in data.items():
+        if not key.startswith("_") and isinstance(obj, dict):
+            used |= referenced_texts(obj)
+    texts = data["_texts"]
+    for tid in texts.keys() - used:
+        del texts[tid]
 
 
 # --------- Механика выпадения ---------
@@ -154,28 +308,39 @@ def _random_item(category: str) -> str:
     return random.choice(ITEMS[category])
 
 
+D20 = dice.parse("к20")
+D100 = dice.parse("к100")
+
+
 def _magic_rarity():
-    r = random.randint(1, 100)
+    r = D100.total()
     for threshold, rarity in RARITY_TABLE:
         if r <= threshold:
             return rarity, r
     return "обычный", r
 
 
-def _lose_item(inv: dict):
+def _lose_item(inv: Inventory):
+    if not inv.count():
+        return None, None, None
     while True:
-        r = random.randint(1, 20)
+        r = D20.total()
         cat = _choose_category_by_d20(r)
-        if inv[cat]:
-            lost = random.choice(inv[cat])
-            inv[cat].remove(lost)
+        if inv.count(cat):
+            # каждый предмет стопки теряется с равной вероятностью
+            entries = inv.entries(cat)
+            lost = random.choices(entries, weights=[e.qty for e in entries])[0]
+            inv.remove(cat, lost.eid)
             return cat, lost, r
 
 
-def _find_item(inv: dict):
-    r = random.randint(1, 20)
+def _find_item(inv: Inventory):
+    """Возвращает (категория, Entry, d20, пометка о редкости для магии)."""
+    r = D20.total()
     cat = _choose_category_by_d20(r)
-    found = _random_item(cat)
+    name = _random_item(cat)
+    ref = resolve_ref(name, cat)
+    note = ""
 
     if cat == "Магический предмет":
         rarity_label, r100 = _magic_rarity()
@@ -189,39 +354,21 @@ def _find_item(inv: dict):
         pool = [i for i in MAGIC if i.get("rarity") == base_rarity and i.get("tier") == tier]
         if pool:
             chosen = random.choice(pool)
-            found = chosen["name"]
-            full_info = enrich_item({"name": found, "category": cat})
-            desc = full_info.get("description", "")
-            if desc:
-                found += f" — {desc[:600].strip()}…"
+            name, ref = chosen["name"], chosen["id"]
         else:
-            found = f"Не найдено ({base_rarity}, {tier})"
-        found = f"{found} ({rarity_label}, d100={r100})"
+            name, ref = f"Не найдено ({base_rarity}, {tier})", None
+        note = f"({rarity_label}, d100={r100})"
 
-    inv[cat].append(found)
-    return cat, found, r
+    elif ref:
+        name = get_item(ref)["name"]
 
+    found = inv.add(cat, ref=ref, name=name)
+    return cat, found, r, note
 
-# --------- Хелперы отображения / формата ---------
-
-def parse_item_entry(entry):
-    """Возвращает (name, desc|None) из строки/словаря."""
-    if isinstance(entry, dict):
-        return (
-            entry.get("name", "").strip(),
-            (entry.get("description") or entry.get("desc"))
-        )
-
-    s = str(entry)
-    if "—" in s:
-        nm, ds = s.split("—", 1)
-        return nm.strip().lstrip("⭐ ").strip(), ds.strip()
-    return s.strip().lstrip("⭐ ").strip(), None
 
+# --------- Хелперы отображения / формата ---------
 
-def make_custom_string(name: str, desc: str | None):
-    desc = (desc or "— пользовательское описание —").strip()
-    return f"⭐ {name.strip()} — {desc}"
+CUSTOM_DESC = "— пользовательское описание —"
 
 
 def normalize_text(s: str) -> str:
@@ -230,49 +377,81 @@ def normalize_text(s: str) -> str:
 
 # ---------- Ролевые клавиатуры и возврат ----------
 
+# все кнопки reply-клавиатур регистрируются в MENU: обработчик по тексту
+# выбирается поиском в словаре, а не перебором Regex-фильтров
+MENU = menu_router.MenuRouter()
+
+BTN_ADD = MENU.button("➕ Добавить предмет", "add")
+BTN_REMOVE = MENU.button("➖ Удалить предмет", "remove")
+BTN_INVENTORY = MENU.button("📦 Инвентарь", "inventory")
+BTN_CATEGORIES = MENU.button("📚 Категории", "categories")
+BTN_SIMULATE = MENU.button("🎲 Симулировать день", "simulate")
+BTN_MASTER = MENU.button("📜 Мастер-инвентарь", "master")
+BTN_PARTY = MENU.button("📊 Сводка партии", "party")
+BTN_BACK = MENU.button("🔙 Назад", "back")
+MENU.button("Назад", "back")
+
+# категории для просмотра: «⚔ Оружие» -> «Оружие»
+INVENTORY_MENU = MENU.buttons([
+    ["⚔ Оружие", "🛡 Доспехи"],
+    ["🧳 Снаряжение", "🧰 Инструменты"],
+    ["📚 Наборы снаряжения", "👕 Одежда"],
+    ["✨ Магический предмет"],
+    ["📜 Весь инвентарь", BTN_BACK],
+], "inventory_category", strip_icon=True)
+
+
+@MENU.resolver
+def _roster_name(message, text):
+    """Имя игрока из кампании, где отправитель мастер (состав меняется без правки кода)."""
+    if message.from_user and text in CAMPAIGNS.mastered_names(message.from_user.id):
+        return "player"
+    return None
+
+
 def _kb_master_root():
-    return ReplyKeyboardMarkup([["📜 Мастер-инвентарь"]], resize_keyboard=True)
+    return ReplyKeyboardMarkup([[BTN_MASTER], [BTN_PARTY]], resize_keyboard=True)
 
 
 def _kb_player_base(with_sim=False):
     rows = [
-        ["➕ Добавить предмет", "➖ Удалить предмет"],
-        ["📦 Инвентарь"],
-        ["📚 Категории"],
+        [BTN_ADD, BTN_REMOVE],
+        [BTN_INVENTORY],
+        [BTN_CATEGORIES],
     ]
     if with_sim:
-        rows[1].append("🎲 Симулировать день")
+        rows[1].append(BTN_SIMULATE)
     return ReplyKeyboardMarkup(rows, resize_keyboard=True)
 
 
 def _kb_guest():
-    return ReplyKeyboardMarkup([["📚 Категории"]], resize_keyboard=True)
+    return ReplyKeyboardMarkup([[BTN_CATEGORIES]], resize_keyboard=True)
 
 
 def home_kb(update, context):
     """Корректное меню по роли и выбранному игроку (для мастера)."""
     uid = update.effective_user.id
-    if uid == MASTER_ID:
+    camp = _camp(update, context)
+    if camp.is_master(uid):
         target_name = context.user_data.get("target_name")
         if not target_name:
             return _kb_master_root()
-        return _kb_player_base(with_sim=(target_name == PLAYER_WITH_SIMULATION))
-    for name, pid in PLAYERS.items():
-        if uid == pid:
-            return _kb_player_base(with_sim=(name == PLAYER_WITH_SIMULATION))
+        return _kb_player_base(with_sim=(target_name == camp.sim_player))
+    name = camp.player_name(uid)
+    if name:
+        return _kb_player_base(with_sim=(name == camp.sim_player))
     return _kb_guest()
 
 
 async def master_inventory_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Только мастер может это вызывать
-    if update.effective_user.id != MASTER_ID:
+    if not _is_master(update, context):
         await update.message.reply_text("🚫 Эта команда только для мастера.")
         return
 
     # подчистим временный контекст, чтобы ничего не залипло
     for k in (
-        "inv_cat", "inv_page", "inv_items",
-        "remove_cat", "page", "items",
+        "inv_cat", "remove_cat",
         "add_cat", "pending_item", "pending_desc",
         "raw_name", "pending",
         "target_id", "target_name",  # выходим из режима конкретного игрока
@@ -280,7 +459,7 @@ async def master_inventory_cmd(update: Update, context: ContextTypes.DEFAULT_TYP
         context.user_data.pop(k, None)
 
     # тот же самый выбор игрока, что и в show_master_inventory
-    keyboard = [[name] for name in PLAYERS.keys()] + [["🔙 Назад"]]
+    keyboard = [[name] for name in _camp(update, context).players] + [[BTN_BACK]]
     await update.message.reply_text(
         "🎩 Выбери игрока:",
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True),
@@ -297,11 +476,7 @@ async def end_and_main_menu(
     # чистим только временные ключи, НЕ трогаем target_id/target_name
     for k in (
         "inv_cat",
-        "inv_page",
-        "inv_items",
         "remove_cat",
-        "page",
-        "items",
         "add_cat",
         "pending_item",
         "pending_desc",
@@ -332,7 +507,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("/inventory, /add, /remove, /simulate, /categories")
+    await update.message.reply_text("/inventory, /add, /remove, /simulate, /categories, /search, /browse, /catalog, /history, /undo, /roll, /campaign")
 
 
 async def categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -347,6 +522,7 @@ async def categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     await update.message.reply_text(
         "📚 Категории:\n" + "\n".join(f"• {c}" for c in order)
+        + "\n\nКаталог с фильтрами по редкости, тиру и источнику: /browse"
     )
 
 
@@ -354,7 +530,7 @@ async def categories(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_inventory(update, context):
     uid = context.user_data.get("target_id", update.effective_user.id)
-    inv = get_inventory(uid)
+    inv = get_inventory(uid, _camp(update, context))
 
     def esc(s): return html.escape(str(s)) if s else ""
 
@@ -365,11 +541,8 @@ async def show_inventory(update, context):
             blocks.append("<i>пусто</i>")
             continue
         for i, entry in enumerate(lst, 1):
-            name, desc = parse_item_entry(entry)
-            if not desc:
-                lib = enrich_item({"name": name, "category": cat}) or {}
-                desc = (lib.get("description") or "").strip() or None
-            blocks.append(f"{i}. {esc(name)}")
+            desc = entry.description
+            blocks.append(f"{i}. {esc(entry.label())}")
             if desc:
                 short = desc if len(desc) <= 1000 else (desc[:1000] + "…")
                 blocks.append(f"<i>{esc(short)}</i>")
@@ -386,30 +559,23 @@ async def show_inventory(update, context):
 
 
 async def show_inventory_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    keyboard = [
-        ["⚔ Оружие", "🛡 Доспехи"],
-        ["🧳 Снаряжение", "🧰 Инструменты"],
-        ["📚 Наборы снаряжения", "👕 Одежда"],
-        ["✨ Магический предмет"],
-        ["📜 Весь инвентарь", "🔙 Назад"],
-    ]
     await update.message.reply_text(
         "📦 Выбери категорию для просмотра:",
-        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True),
+        reply_markup=ReplyKeyboardMarkup(INVENTORY_MENU, resize_keyboard=True),
     )
     return STATE_INVENTORY_CATEGORY
 
 
 async def show_inventory_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = update.message.text.strip()
-    if "назад" in cat.lower():
+    if MENU.action(update.message.text) == "back":
         return await end_and_main_menu(update, context)
+    cat = MENU.value(update.message.text)
 
     uid = context.user_data.get("target_id", update.effective_user.id)
-    inv = get_inventory(uid)
+    inv = get_inventory(uid, _camp(update, context))
 
     if "Весь инвентарь" in cat:
-        all_items = [f"[{c}] {i}" for c, lst in inv.items() for i in lst if lst]
+        all_items = [f"[{c}] {e.label()}" for c, lst in inv.items() for e in lst]
         if not all_items:
             await update.message.reply_text("📭 Инвентарь пуст.")
             return STATE_INVENTORY_CATEGORY
@@ -419,49 +585,217 @@ async def show_inventory_list(update: Update, context: ContextTypes.DEFAULT_TYPE
         return STATE_INVENTORY_CATEGORY
 
     cat_clean = cat
-    for prefix in ["⚔ ", "🛡 ", "🧳 ", "🧰 ", "📚 ", "👕 ", "✨ ", "📜 "]:
-        cat_clean = cat_clean.replace(prefix, "")
-    cat_clean = cat_clean.strip()
-
-    items = inv.get(cat_clean, [])
+    items = inv.entries(cat_clean)
     if not items:
         await update.message.reply_text(f"📭 В категории {cat_clean} нет предметов.")
         return STATE_INVENTORY_CATEGORY
 
+    # в состоянии разговора — только категория; версия и страница едут в кнопках
     context.user_data["inv_cat"] = cat_clean
-    context.user_data["inv_page"] = 0
-    context.user_data["inv_items"] = items
-    await send_inventory_page(update, context)
+    await _send_page(update, _cached_page(_inventory_page, _camp(update, context), uid, cat_clean, 0, inv))
     return STATE_INVENTORY_CATEGORY
 
 
-async def send_inventory_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# --------- Страницы списков ---------
+
+PAGE_CACHE = paging.PageCache()
+
+
+def inventory_version(uid: int, camp: campaigns.Campaign) -> int:
+    """Текущая версия инвентаря без его разбора: шард уже в памяти."""
+    return _load_all(camp).get("_versions", {}).get(str(uid), 0)
+
+
+def _inventory_page(cat: str, items, ver: int, page: int):
+    start = page * paging.PER_PAGE
+    buttons = [
+        [InlineKeyboardButton(f"{i}. {e.label(40)}", callback_data=paging.encode("inv_", ver, page, e.eid))]
+        for i, e in enumerate(items[start:start + paging.PER_PAGE], start=start + 1)
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=paging.encode("inv_pg_", ver, page - 1)))
+    if start + paging.PER_PAGE < len(items):
+        nav.append(InlineKeyboardButton("➡️", callback_data=paging.encode("inv_pg_", ver, page + 1)))
+    if nav:
+        buttons.append(nav)
+    text = (
+        f"{cat} — страница {page+1}/{paging.page_count(len(items))}\n"
+        f"Выбери предмет для просмотра:"
+    )
+    return text, InlineKeyboardMarkup(buttons), None
+
+
+def _remove_page(cat: str, items, ver: int, page: int):
+    start = page * paging.PER_PAGE
+    buttons = [
+        [InlineKeyboardButton(f"{i}. {e.label(35)}", callback_data=paging.encode("rm_", ver, page, e.eid))]
+        for i, e in enumerate(items[start:start + paging.PER_PAGE], start=start + 1)
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=paging.encode("pg_", ver, page - 1)))
+    if start + paging.PER_PAGE < len(items):
+        nav.append(InlineKeyboardButton("➡️", callback_data=paging.encode("pg_", ver, page + 1)))
+    if nav:
+        buttons.append(nav)
+    else:
+        buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="pg_exit")])
+    text = (
+        f"🗑️ *{cat}* — страница {page+1}/{paging.page_count(len(items))}\n"
+        f"Выбери предмет для удаления:"
+    )
+    return text, InlineKeyboardMarkup(buttons), "Markdown"
+
+
+def _cached_page(build, camp, uid: int, cat: str, page: int, inv: Inventory | None = None):
+    """
+    Страница списка (текст, клавиатура, parse_mode) для текущей версии инвентаря.
+    Если она уже строилась — инвентарь даже не разбирается.
+    """
+    ver = inv.version if inv is not None else inventory_version(uid, camp)
+    key = (build.__name__, camp.cid, camp.shard.generation, uid, cat, ver, page)
+    cached = PAGE_CACHE.get(key)
+    if cached is not None:
+        return cached
+    if inv is None:
+        inv = get_inventory(uid, camp)
+    items = inv.entries(cat)
+    out = build(cat, items, inv.version, min(max(0, page), paging.page_count(len(items)) - 1))
+    PAGE_CACHE.put(key, out)
+    return out
+
+
+async def _send_page(update: Update, page):
+    text, markup, parse_mode = page
+    if update.message:
+        await update.message.reply_text(text, reply_markup=markup, parse_mode=parse_mode)
+    else:
+        await update.callback_query.edit_message_text(text, reply_markup=markup, parse_mode=parse_mode)
+
+
+async def on_inventory_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if "inv_cat" not in context.user_data or q.data == "inv_exit":
+        await q.answer()
+        return await end_and_main_menu(update, context)
+
+    camp = _camp(update, context)
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    ver, page = paging.decode(q.data, "inv_pg_", 2) or (-1, 0)
+    # версия с кнопки не совпала — листаем уже новый список
+    await q.answer(None if ver == inventory_version(uid, camp) else "🔄 Инвентарь изменился — список обновлён.")
+    await _send_page(update, _cached_page(_inventory_page, camp, uid, context.user_data["inv_cat"], page))
+    return STATE_INVENTORY_CATEGORY
+
+
+async def on_inventory_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if "inv_cat" not in context.user_data:
+        await q.answer()
+        return await end_and_main_menu(update, context)
+
     cat = context.user_data["inv_cat"]
-    page = context.user_data.get("inv_page", 0)
-    items = context.user_data["inv_items"]
+    camp = _camp(update, context)
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    _, page, eid = paging.decode(q.data, "inv_", 3) or (-1, 0, -1)
+    inv = get_inventory(uid, camp)
+    # запись ищется по id, так что и кнопка от старой версии списка покажет тот же предмет
+    entry = inv.get(cat, eid)
+    if entry is None:
+        await q.answer("⚠️ Этого предмета уже нет — список обновлён.")
+        await _send_page(update, _cached_page(_inventory_page, camp, uid, cat, page, inv))
+        return STATE_INVENTORY_CATEGORY
+
+    await q.answer()
+    item = entry.item
+    full = dict(item) if item else {"name": entry.title, "category": cat}
+    if entry.desc and not full.get("description"):
+        full["description"] = entry.desc
+
+    text = render_item_card(full)
+    if entry.qty > 1:
+        text += f"\n\nКоличество: {entry.qty}"
+
+    CHUNK = 3500
+    for i in range(0, len(text), CHUNK):
+        last = i + CHUNK >= len(text)
+        await q.message.reply_text(
+            text[i:i + CHUNK],
+            parse_mode=constants.ParseMode.MARKDOWN,
+            disable_web_page_preview=True,
+            reply_markup=_card_markup(item) if last else None,
+        )
+
+    return await end_and_main_menu(update, context)
+
+
+# --------- Поиск по описаниям ---------
+
+SEARCH_LIMIT = 50
+
+
+def _catalog_card(item: dict) -> str:
+    full = dict(item)
+    full.setdefault("category", "Магический предмет")
+    return render_item_card(full)
+
+
+def _card_markup(item: dict | None) -> InlineKeyboardMarkup | None:
+    """Кнопки атаки под карточкой оружия (если урон известен каталогу)."""
+    if not item or item.get("id") not in item_catalog.DAMAGE:
+        return None
+    iid = item["id"]
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("⚔️ Атака", callback_data=f"atk_n_{iid}"),
+        InlineKeyboardButton("Преим.", callback_data=f"atk_a_{iid}"),
+        InlineKeyboardButton("Помеха", callback_data=f"atk_d_{iid}"),
+    ]])
+
+
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = " ".join(context.args or []).strip()
+    if not query:
+        await update.message.reply_text(
+            "Используй: /search <что делает предмет>\nНапример: /search дышать под водой"
+        )
+        return
+    # в состоянии — только запрос и страница, выдачу пересчитываем (это миллисекунды)
+    context.user_data["search_q"] = query
+    context.user_data["search_page"] = 0
+    await send_search_page(update, context)
+
+
+async def send_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = context.user_data["search_q"]
+    items = search_items(query, SEARCH_LIMIT)
+    if not items:
+        await update.effective_message.reply_text(f"🔎 По запросу «{query}» ничего не найдено.")
+        return
 
     per_page = 10
+    last_page = max(0, (len(items) - 1) // per_page)
+    page = min(max(0, context.user_data.get("search_page", 0)), last_page)
+    context.user_data["search_page"] = page
     start, end = page * per_page, page * per_page + per_page
     page_items = items[start:end]
 
     buttons = []
-    for i, entry in enumerate(page_items, start=start + 1):
-        name, _ = parse_item_entry(entry)
-        buttons.append(
-            [InlineKeyboardButton(f"{i}. {name[:40]}", callback_data=f"inv_{i-1}")]
-        )
+    for i, it in enumerate(page_items, start=start + 1):
+        name = it["name"].split(" / ")[0]
+        buttons.append([InlineKeyboardButton(f"{i}. {name[:40]}", callback_data=f"sr_{it['id']}")])
 
     nav = []
     if page > 0:
-        nav.append(InlineKeyboardButton("⬅️", callback_data="inv_prev"))
+        nav.append(InlineKeyboardButton("⬅️", callback_data="sr_prev"))
     if end < len(items):
-        nav.append(InlineKeyboardButton("➡️", callback_data="inv_next"))
+        nav.append(InlineKeyboardButton("➡️", callback_data="sr_next"))
     if nav:
         buttons.append(nav)
 
     markup = InlineKeyboardMarkup(buttons)
     text = (
-        f"{cat} — страница {page+1}/{max(1, (len(items)-1)//per_page+1)}\n"
+        f"🔎 «{query}» — страница {page+1}/{last_page+1}\n"
         f"Выбери предмет для просмотра:"
     )
     if update.message:
@@ -470,54 +804,259 @@ async def send_inventory_page(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.callback_query.edit_message_text(text, reply_markup=markup)
 
 
-async def on_inventory_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def on_search_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    if q.data == "inv_prev":
-        context.user_data["inv_page"] -= 1
-    elif q.data == "inv_next":
-        context.user_data["inv_page"] += 1
-    elif q.data == "inv_exit":
-        return await end_and_main_menu(update, context)
+    if "search_q" not in context.user_data:
+        await q.edit_message_text("⌛ Поиск устарел — повтори /search.")
+        return
 
-    await send_inventory_page(update, context)
-    return STATE_INVENTORY_CATEGORY
+    if q.data in ("sr_prev", "sr_next"):
+        context.user_data["search_page"] += -1 if q.data == "sr_prev" else 1
+        await send_search_page(update, context)
+        return
 
+    item = get_item(q.data.replace("sr_", "", 1))
+    if not item:
+        await q.message.reply_text("❌ Предмет не найден в каталоге.")
+        return
+    await q.message.reply_text(
+        _catalog_card(item),
+        parse_mode=constants.ParseMode.MARKDOWN,
+        disable_web_page_preview=True,
+        reply_markup=_card_markup(item),
+    )
 
-async def on_inventory_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+# --------- Просмотр каталога по фасетам ---------
+
+BROWSE_PER_PAGE = 8
+
+
+def _browse_state(context) -> dict:
+    return context.user_data.setdefault("browse", {"sel": {}, "page": 0})
+
+
+def _browse_view(state: dict):
+    """Страница результатов: предметы, листание и кнопки фасетов."""
+    idx = item_catalog.FACETS
+    sel = state["sel"]
+    mask = idx.mask(sel)
+    total = mask.bit_count()
+    pages = max(1, (total + BROWSE_PER_PAGE - 1) // BROWSE_PER_PAGE)
+    page = state["page"] = min(max(0, state["page"]), pages - 1)
+
+    buttons = [
+        [InlineKeyboardButton(it["name"].split(" / ")[0][:40], callback_data=f"br_i_{it['id']}")]
+        for it in idx.page(mask, page, BROWSE_PER_PAGE)
+    ]
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"br_p_{page - 1}"))
+    if page + 1 < pages:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"br_p_{page + 1}"))
+    if nav:
+        buttons.append(nav)
+    facet_row = []
+    for code, (field, title) in catalog_facets.FACETS.items():
+        mark = " ✅" if field in sel else ""
+        facet_row.append(InlineKeyboardButton(title + mark, callback_data=f"br_f_{code}"))
+    buttons += [facet_row[:3], facet_row[3:]]
+
+    filters_line = " · ".join(
+        f"{title}: {sel[field]}" for field, title in catalog_facets.FACETS.values() if field in sel
+    ) or "нет"
+    text = (
+        f"🧭 Каталог: {total} предм. — страница {page + 1}/{pages}\n"
+        f"Фильтры: {filters_line}"
+    )
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def _browse_facet_view(state: dict, code: str):
+    """Значения одного фасета со счётчиками при остальных фильтрах."""
+    field, title = catalog_facets.FACETS[code]
+    idx = item_catalog.FACETS
+    buttons = [
+        [InlineKeyboardButton(
+            ("✅ " if state["sel"].get(field) == v else "") + f"{v[:40]} ({n})",
+            callback_data=f"br_v_{code}_{idx.values[field].index(v)}",
+        )]
+        for v, n in idx.counts(field, state["sel"])
+    ]
+    buttons.append([
+        InlineKeyboardButton("✖ Любая", callback_data=f"br_x_{code}"),
+        InlineKeyboardButton("🔙 К списку", callback_data="br_p_0"),
+    ])
+    return f"🧭 {title}: выбери значение", InlineKeyboardMarkup(buttons)
+
+
+async def browse_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if item_catalog.FACETS is None:
+        await update.message.reply_text("📚 Каталог не загружен.")
+        return
+    context.user_data["browse"] = {"sel": {}, "page": 0}
+    text, markup = _browse_view(context.user_data["browse"])
+    await update.message.reply_text(text, reply_markup=markup)
+
+
+async def on_browse_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    idx = item_catalog.FACETS
+    state = _browse_state(context)
+    kind, _, arg = q.data[len("br_"):].partition("_")
+
+    if kind == "i":
+        await q.answer()
+        item = get_item(arg)
+        if item:
+            await q.message.reply_text(
+                _catalog_card(item),
+                parse_mode=constants.ParseMode.MARKDOWN,
+                disable_web_page_preview=True,
+                reply_markup=_card_markup(item),
+            )
+        return
+    if kind == "f" and arg in catalog_facets.FACETS:
+        await q.answer()
+        text, markup = _browse_facet_view(state, arg)
+        await q.edit_message_text(text, reply_markup=markup)
+        return
+
+    if kind == "p" and arg.isdigit():
+        state["page"] = int(arg)
+    elif kind == "x" and arg in catalog_facets.FACETS:
+        state["sel"].pop(catalog_facets.FACETS[arg][0], None)
+        state["page"] = 0
+    elif kind == "v":
+        code, _, n = arg.partition("_")
+        field = catalog_facets.FACETS.get(code, (None,))[0]
+        values = idx.values.get(field, []) if field else []
+        if not n.isdigit() or int(n) >= len(values):
+            await q.answer("⚠️ Каталог обновился — открой /browse заново.")
+            return
+        state["sel"][field] = values[int(n)]
+        state["page"] = 0
     await q.answer()
+    text, markup = _browse_view(state)
+    await q.edit_message_text(text, reply_markup=markup)
 
-    items = context.user_data.get("inv_items", [])
-    idx = int(q.data.replace("inv_", ""))
 
-    if idx < 0 or idx >= len(items):
-        await q.answer("Ошибка!")
-        return STATE_INVENTORY_CATEGORY
+# --------- Запрос к каталогу по весу и цене ---------
 
-    entry = items[idx]
-    cat = context.user_data["inv_cat"]
-    name, user_desc = parse_item_entry(entry)
+CATALOG_QUERY_LIMIT = 20
 
-    full = enrich_item({"name": name, "category": cat}) or {
-        "name": name,
-        "category": cat,
-    }
 
-    if user_desc and not full.get("description"):
-        full["description"] = user_desc
+def _fmt_lb(lb: float) -> str:
+    return f"{round(lb, 2):g} фнт."
 
-    text = render_item_card(full)
 
-    CHUNK = 3500
-    for i in range(0, len(text), CHUNK):
-        await q.message.reply_text(
-            text[i:i + CHUNK],
-            parse_mode=constants.ParseMode.MARKDOWN,
-            disable_web_page_preview=True,
+def _fmt_cp(cp: float) -> str:
+    return f"{round(cp / catalog_columns.GP_CP, 2):g} зм".replace(".", ",")
+
+
+async def catalog_query_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/catalog [категория] [вес<N] [цена<N] [сорт:вес|-вес|цена] [мой]"""
+    cols = item_catalog.COLUMNS
+    text = " ".join(context.args or [])
+    if cols is None or not text.strip():
+        await update.message.reply_text(
+            "Используй: /catalog [категория] [вес<2] [цена<=10зм] [сорт:вес | сорт:-цена] [мой]\n"
+            "Например: /catalog оружие вес<3 сорт:вес (вес — в фнт., можно вес<1кг)\n"
+            "«мой» — только предметы из твоего инвентаря, с общим весом."
+        )
+        return
+    q = catalog_columns.parse_query(text, cols.categories)
+    if q["category"] and q["category"] not in cols.categories:
+        await update.message.reply_text(
+            f"❌ Нет категории «{q['category']}». Есть: {', '.join(cols.categories)}"
         )
+        return
 
-    return await end_and_main_menu(update, context)
+    rows, header = None, ""
+    if q["mine"]:
+        # «мой» — всегда свой инвентарь, даже если мастер выбирал игрока в «Мастер-инвентаре»
+        inv = get_inventory(update.effective_user.id, _camp(update, context))
+        stacks = [(e.ref, e.qty) for _, lst in inv.items() for e in lst]
+        refs = [r for r, _ in stacks if r]
+        rows = cols.rows_of(refs)
+        lb, unknown = cols.total_weight([r for r, _ in stacks], [n for _, n in stacks])
+        header = f"🎒 Общий вес инвентаря: {_fmt_lb(lb)}" + (f" (+{unknown} предм. без веса)" if unknown else "") + "\n\n"
+
+    found = cols.select(q["category"], q["weight"], q["cost"], rows=rows, sort=q["sort"], desc=q["desc"])
+    if not len(found):
+        await update.message.reply_text(header + "🔎 Ничего не найдено.")
+        return
+    lines = []
+    for i in found[:CATALOG_QUERY_LIMIT]:
+        it = cols.items[i]
+        extra = [
+            _fmt_lb(cols.weight_lb[i]) if not np.isnan(cols.weight_lb[i]) else None,
+            _fmt_cp(cols.cost_cp[i]) if not np.isnan(cols.cost_cp[i]) else None,
+        ]
+        extra = ", ".join(x for x in extra if x)
+        lines.append(f"• {it['name'].split(' / ')[0]}" + (f" — {extra}" if extra else ""))
+    more = f"\n… и ещё {len(found) - CATALOG_QUERY_LIMIT}" if len(found) > CATALOG_QUERY_LIMIT else ""
+    await update.message.reply_text(header + f"🔎 Найдено: {len(found)}\n" + "\n".join(lines) + more)
+
+
+# --------- Автодополнение (inline-режим) ---------
+
+def _inventory_category(item: dict) -> str:
+    """Категория инвентаря для предмета каталога."""
+    cat = catalog_columns.inventory_category(item)
+    return cat if cat in ITEMS else catalog_columns.MAGIC_CATEGORY
+
+
+@functools.lru_cache(maxsize=4096)
+def _inline_articles(prefix: str) -> tuple:
+    """Готовые результаты на префикс; сбрасывается при перезагрузке каталогов."""
+    out = []
+    for it in complete_names(prefix):
+        title = it["name"].split(" / ")[0]
+        desc = re.sub(r"\s+", " ", it.get("description") or "").strip()
+        out.append(
+            InlineQueryResultArticle(
+                id=it["id"],
+                title=title,
+                description=f"[{_inventory_category(it)}] {desc[:100]}",
+                input_message_content=InputTextMessageContent(
+                    _catalog_card(it),
+                    parse_mode=constants.ParseMode.MARKDOWN,
+                    disable_web_page_preview=True,
+                ),
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("➕ В инвентарь", callback_data=f"qa_{it['id']}")]]
+                ),
+            )
+        )
+    return tuple(out)
+
+
+async def inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.inline_query
+    await q.answer(
+        _inline_articles(q.query.strip().lower()), cache_time=300, is_personal=False
+    )
+
+
+async def on_inline_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка «В инвентарь» под карточкой, отправленной через inline-режим."""
+    q = update.callback_query
+    item = get_item(q.data.replace("qa_", "", 1))
+    if not item:
+        await q.answer("❌ Предмет не найден в каталоге.", show_alert=True)
+        return
+    if _is_master(update, context) and "target_id" not in context.user_data:
+        await q.answer("⚠️ Сначала выбери игрока в «Мастер-инвентарь».", show_alert=True)
+        return
+
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    cat = _inventory_category(item)
+    inv = get_inventory(uid, _camp(update, context))
+    entry = inv.add(cat, ref=item["id"], name=item["name"])
+    await save_inventory(uid, inv, _camp(update, context))
+    await q.answer(f"✅ Добавлено в {cat}: {entry.label(60)}")
 
 
 # --------- Удаление ---------
@@ -532,7 +1071,7 @@ def get_category_keyboard():
         "Оружие",
         "Магический предмет",
     ]
-    rows = [[c] for c in cats] + [["🔙 Назад"]]
+    rows = [[c] for c in cats] + [[BTN_BACK]]
     return ReplyKeyboardMarkup(rows, resize_keyboard=True)
 
 
@@ -546,7 +1085,7 @@ async def remove_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_remove_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cat = update.message.text.strip()
-    if "назад" in cat.lower():
+    if MENU.action(cat) == "back":
         return await end_and_main_menu(update, context)
 
     valid_cats = list(ITEMS.keys())
@@ -555,8 +1094,8 @@ async def show_remove_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return STATE_REMOVE_CATEGORY
 
     uid = context.user_data.get("target_id", update.effective_user.id)
-    inv = get_inventory(uid)
-    items = inv.get(cat.capitalize(), [])
+    inv = get_inventory(uid, _camp(update, context))
+    items = inv.entries(cat.capitalize())
     if not items:
         await update.message.reply_text(
             f"📭 В категории {cat} ничего нет. Выбери другую:",
@@ -565,90 +1104,53 @@ async def show_remove_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return STATE_REMOVE_CATEGORY
 
     context.user_data["remove_cat"] = cat.capitalize()
-    context.user_data["page"] = 0
-    context.user_data["items"] = items
-    await send_remove_page(update, context)
+    await _send_page(update, _cached_page(_remove_page, _camp(update, context), uid, cat.capitalize(), 0, inv))
     return STATE_REMOVE_CATEGORY
 
 
-async def send_remove_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    cat = context.user_data["remove_cat"]
-    page = context.user_data.get("page", 0)
-    items = context.user_data["items"]
-
-    per_page = 10
-    start = page * per_page
-    end = start + per_page
-    page_items = items[start:end]
-
-    buttons = []
-    for i, entry in enumerate(page_items, start=start + 1):
-        name, _ = parse_item_entry(entry)
-        buttons.append(
-            [InlineKeyboardButton(f"{i}. {name[:35]}", callback_data=f"rm_{i-1}")]
-        )
-
-    nav = []
-    if page > 0:
-        nav.append(InlineKeyboardButton("⬅️", callback_data="pg_prev"))
-    if end < len(items):
-        nav.append(InlineKeyboardButton("➡️", callback_data="pg_next"))
-    if nav:
-        buttons.append(nav)
-    else:
-        buttons.append([InlineKeyboardButton("🔙 Назад", callback_data="pg_exit")])
-
-    markup = InlineKeyboardMarkup(buttons)
-    text = (
-        f"🗑️ *{cat}* — страница {page+1}/{(len(items)-1)//per_page+1}\n"
-        f"Выбери предмет для удаления:"
-    )
-    if update.message:
-        await update.message.reply_text(text, reply_markup=markup, parse_mode="Markdown")
-    else:
-        await update.callback_query.edit_message_text(
-            text, reply_markup=markup, parse_mode="Markdown"
-        )
-
-
 async def on_remove_nav(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
-    if q.data == "pg_prev":
-        context.user_data["page"] -= 1
-        await send_remove_page(update, context)
-        return STATE_REMOVE_CATEGORY
-    elif q.data == "pg_next":
-        context.user_data["page"] += 1
-        await send_remove_page(update, context)
-        return STATE_REMOVE_CATEGORY
-    elif q.data == "pg_exit":
+    if "remove_cat" not in context.user_data or q.data == "pg_exit":
+        await q.answer()
         return await end_and_main_menu(update, context)
+
+    camp = _camp(update, context)
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    ver, page = paging.decode(q.data, "pg_", 2) or (-1, 0)
+    await q.answer(None if ver == inventory_version(uid, camp) else "🔄 Инвентарь изменился — список обновлён.")
+    await _send_page(update, _cached_page(_remove_page, camp, uid, context.user_data["remove_cat"], page))
     return STATE_REMOVE_CATEGORY
 
 
 async def on_remove_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    await q.answer()
+    cat = context.user_data.get("remove_cat")
+    if not cat:
+        await q.answer()
+        return await end_and_main_menu(update, context)
 
-    cat = context.user_data["remove_cat"]
-    items = context.user_data["items"]
-    idx = int(q.data.replace("rm_", ""))
-    if idx < 0 or idx >= len(items):
-        await q.answer("Ошибка!")
+    camp = _camp(update, context)
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    _, page, eid = paging.decode(q.data, "rm_", 3) or (-1, 0, -1)
+    inv = get_inventory(uid, camp)
+    # кнопка несёт id записи, а не позицию: изменения в инвентаре
+    # не могут подменить удаляемый предмет
+    entry = inv.remove(cat, eid)
+    if entry is None:
+        await q.answer("⚠️ Этого предмета уже нет — список обновлён.")
+        await _send_page(update, _cached_page(_remove_page, camp, uid, cat, page, inv))
         return STATE_REMOVE_CATEGORY
 
-    uid = context.user_data.get("target_id", update.effective_user.id)
-    inv = get_inventory(uid)
-    item = items[idx]
-    inv[cat].remove(item)
-    save_inventory(uid, inv)
+    await q.answer()
+    await save_inventory(uid, inv, camp)
 
+    left = f" (осталось {entry.qty})" if entry.qty else ""
     await notify_master(
-        context.bot, update.effective_user.first_name, f"удалил предмет: [{cat}] {item}"
+        context.bot, update.effective_user.first_name, f"удалил предмет: [{cat}] {entry.title}{left}",
+        camp.master_id,
     )
 
-    await q.edit_message_text(f"❌ Удалено: [{cat}] {item}")
+    await q.edit_message_text(f"❌ Удалено: [{cat}] {entry.title}{left}")
     await asyncio.sleep(0.1)
     return await end_and_main_menu(update, context)
 
@@ -659,7 +1161,7 @@ async def ask_simulation_days(update: Update, context: ContextTypes.DEFAULT_TYPE
     keyboard = [
         ["1", "3", "5"],
         ["7", "10", "📝 Другое"],
-        ["🔙 Назад"],
+        [BTN_BACK],
     ]
     await update.message.reply_text(
         "⏳ На сколько дней симулировать приключение?",
@@ -670,7 +1172,7 @@ async def ask_simulation_days(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def handle_simulation_days(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
-    if "назад" in text.lower():
+    if MENU.action(text) == "back":
         return await end_and_main_menu(update, context)
 
     if text == "📝 Другое":
@@ -689,7 +1191,7 @@ async def handle_simulation_days(update: Update, context: ContextTypes.DEFAULT_T
 
 async def simulate_days(update, context):
     uid = context.user_data.get("target_id", update.effective_user.id)
-    inv = get_inventory(uid)
+    inv = get_inventory(uid, _camp(update, context))
     if not context.args:
         await update.message.reply_text("Используй: /simulate <число>")
         return
@@ -697,24 +1199,23 @@ async def simulate_days(update, context):
     days = max(1, int(context.args[0]))
     out = []
     for d in range(1, days + 1):
-        lost_cat, lost_entry, r1 = _lose_item(inv)
-        found_cat, found_entry, r2 = _find_item(inv)
-
-        ln, _ = parse_item_entry(lost_entry)
-        fn, _ = parse_item_entry(found_entry)
-
-        lost_full = enrich_item({"name": ln, "category": lost_cat}) if ln else None
-        found_full = enrich_item({"name": fn, "category": found_cat}) if fn else None
+        lost_cat, lost, r1 = _lose_item(inv)
+        found_cat, found, r2, note = _find_item(inv)
 
+        lost_line = (
+            f"  Потерял ({r1}) [{lost_cat}] — {lost.title}\n"
+            f"  {lost.description or ''}\n"
+            if lost else "  Терять нечего.\n"
+        )
+        found_title = f"{found.title} {note}".rstrip()
         out.append(
             f"\n📅 *День {d}:*\n"
-            f"  Потерял ({r1}) [{lost_cat}] — {(lost_full or {'name': ln}).get('name')}\n"
-            f"  {(lost_full or {}).get('description','')}\n"
-            f"  Нашёл  ({r2}) [{found_cat}] — {(found_full or {'name': fn}).get('name')}\n"
-            f"  {(found_full or {}).get('description','')}"
+            f"{lost_line}"
+            f"  Нашёл  ({r2}) [{found_cat}] — {found_title}\n"
+            f"  {found.description or ''}"
         )
 
-    save_inventory(uid, inv)
+    await save_inventory(uid, inv, _camp(update, context))
     await update.message.reply_text(
         "\n".join(out), parse_mode=constants.ParseMode.MARKDOWN
     )
@@ -725,7 +1226,7 @@ async def simulate_days(update, context):
 
 async def add_item_start(update, context):
     if (
-        update.effective_user.id == MASTER_ID
+        _is_master(update, context)
         and "target_id" not in context.user_data
     ):
         await update.message.reply_text(
@@ -739,7 +1240,7 @@ async def add_item_start(update, context):
         ["Наборы снаряжения", "Инструменты"],
         ["Доспехи", "Оружие"],
         ["Магический предмет"],
-        ["🔙 Назад"],
+        [BTN_BACK],
     ]
     await update.message.reply_text(
         "Выбери категорию:",
@@ -750,7 +1251,7 @@ async def add_item_start(update, context):
 
 async def add_item_category(update, context):
     cat = update.message.text.strip()
-    if cat.lower() == "назад" or cat == "🔙 Назад":
+    if MENU.action(cat) == "back":
         return await end_and_main_menu(update, context)
 
     if cat not in ITEMS:
@@ -817,13 +1318,17 @@ def find_closest_item(name: str, category: str | None = None):
 
     best = process.extractOne(query, names, scorer=fuzz.WRatio)
     if not best:
+        metrics.FUZZY_TOTAL.inc(outcome="empty")
         return None
 
     best_name, score, _ = best
+    metrics.FUZZY_SCORE.observe(score)
 
     # порог более строгий, чтобы отсеять случайные совпадения
     if score < 75:
+        metrics.FUZZY_TOTAL.inc(outcome="rejected")
         return None
+    metrics.FUZZY_TOTAL.inc(outcome="accepted")
 
     # ищем реальный элемент точно по имени
     for it in base:
@@ -836,12 +1341,12 @@ def find_closest_item(name: str, category: str | None = None):
 async def add_item_name(update, context):
     # --- нормальный выход по "Назад" ---
     text_raw = (update.message.text or "").strip()
-    if text_raw.lower() in ("назад", "🔙 назад"):
+    if MENU.action(text_raw) == "back":
         return await end_and_main_menu(update, context)
     # ------------------------------------
 
     uid = context.user_data.get("target_id", update.effective_user.id)
-    inv = get_inventory(uid)
+    inv = get_inventory(uid, _camp(update, context))
     cat = context.user_data.get("add_cat")
 
     raw_text = text_raw
@@ -860,6 +1365,7 @@ async def add_item_name(update, context):
         context.user_data["pending"] = {
             "uid": uid,
             "cat": cat,
+            "ref": lib_item.get("id"),
             "name": found_name,
             "desc": user_desc,
         }
@@ -895,6 +1401,7 @@ async def add_item_name(update, context):
         context.user_data["pending"] = {
             "uid": uid,
             "cat": cat,
+            "ref": closest.get("id"),
             "name": found_name,
             "desc": user_desc,
         }
@@ -925,14 +1432,13 @@ async def add_item_name(update, context):
         return STATE_ADD_CONFIRM
 
     # === 3. вообще ничего не нашли — обычный кастом ===
-    custom_entry = make_custom_string(name, user_desc).strip()
-    inv.setdefault(cat, []).append(custom_entry)
-    save_inventory(uid, inv)
+    inv.add(cat, name=name, desc=user_desc or CUSTOM_DESC)
+    await save_inventory(uid, inv, _camp(update, context))
 
     card = render_item_card(
         {
             "name": name,
-            "description": user_desc or "— пользовательское описание —",
+            "description": user_desc or CUSTOM_DESC,
             "category": cat,
         }
     )
@@ -956,18 +1462,18 @@ async def on_add_confirm_button(update: Update, context: ContextTypes.DEFAULT_TY
     found_name = pend.get("name")
     user_desc = pend.get("desc")
 
-    inv = get_inventory(uid)
+    inv = get_inventory(uid, _camp(update, context))
 
     # ✅ подтвердили библиотечный предмет
     if data == "confirm_yes" and found_name:
-        inv[cat].append(found_name)
-        save_inventory(uid, inv)
+        ref = pend.get("ref") or resolve_ref(found_name, cat)
+        entry = inv.add(cat, ref=ref, name=found_name)
+        await save_inventory(uid, inv, _camp(update, context))
 
-        found_item = enrich_item({"name": found_name, "category": cat}) or {}
-        desc = (found_item.get("description") or "— нет описания —").strip()
+        desc = (entry.description or "— нет описания —").strip()
 
         await q.edit_message_text(
-            f"✅ Добавлено в {cat}:\n\n*{found_name}*\n\n{desc}",
+            f"✅ Добавлено в {cat}:\n\n*{entry.label()}*\n\n{desc}",
             parse_mode=constants.ParseMode.MARKDOWN,
             disable_web_page_preview=True,
         )
@@ -995,12 +1501,10 @@ async def on_add_confirm_button(update: Update, context: ContextTypes.DEFAULT_TY
         if ":" in raw:
             base_name, desc = [x.strip() for x in raw.split(":", 1)]
         else:
-            base_name, desc = raw.strip(), (
-                user_desc or "— пользовательское описание —"
-            )
+            base_name, desc = raw.strip(), (user_desc or CUSTOM_DESC)
 
-        inv[cat].append(f"⭐ {base_name} — {desc}")
-        save_inventory(uid, inv)
+        inv.add(cat, name=base_name, desc=desc)
+        await save_inventory(uid, inv, _camp(update, context))
 
         await q.edit_message_text(
             f"Добавлено в {cat}:\n\n*{base_name}*\n\n{desc}",
@@ -1019,10 +1523,10 @@ async def on_add_confirm_button(update: Update, context: ContextTypes.DEFAULT_TY
 # --------- Мастер-инвентарь ---------
 
 async def show_master_inventory(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id != MASTER_ID:
+    if not _is_master(update, context):
         await update.message.reply_text("🚫 Нет доступа.")
         return
-    keyboard = [[name] for name in PLAYERS.keys()] + [["🔙 Назад"]]
+    keyboard = [[name] for name in _camp(update, context).players] + [[BTN_BACK]]
     await update.message.reply_text(
         "🎩 Выбери игрока:",
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True),
@@ -1031,14 +1535,12 @@ async def show_master_inventory(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def master_select_player(update: Update, context: ContextTypes.DEFAULT_TYPE):
     name = update.message.text.strip()
-    if "назад" in name.lower():
-        return await end_and_main_menu(update, context)
-
-    if name not in PLAYERS:
+    camp = _camp(update, context)
+    if not camp.is_master(update.effective_user.id) or name not in camp.players:
         await update.message.reply_text("⚠️ Неизвестный игрок.")
         return
 
-    context.user_data["target_id"] = PLAYERS[name]
+    context.user_data["target_id"] = camp.players[name]
     context.user_data["target_name"] = name
     await update.message.reply_text(
         f"📦 Управляешь инвентарём игрока: *{name}*",
@@ -1047,11 +1549,450 @@ async def master_select_player(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
 
+# --------- Кампании ---------
+
+def _campaign_line(camp, uid) -> str:
+    role = "мастер" if camp.is_master(uid) else "игрок"
+    return f"{camp.title} ({role}, игроков: {len(camp.players)})"
+
+
+async def campaign_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/campaign — текущая кампания и переключение между своими."""
+    uid = update.effective_user.id
+    cur = _camp(update, context)
+    mine = CAMPAIGNS.of_user(uid)
+    text = f"🗺 Текущая кампания: {_campaign_line(cur, uid)}"
+    if len(mine) < 2:
+        await update.message.reply_text(text + "\n\nНовая кампания: /newcampaign <название>")
+        return
+    buttons = [
+        [InlineKeyboardButton(("✅ " if c is cur else "") + c.title, callback_data=f"camp_{c.cid}")]
+        for c in mine
+    ]
+    await update.message.reply_text(
+        text + "\n\nПереключиться:", reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+
+async def on_campaign_switch(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    camp = CAMPAIGNS.get(q.data.replace("camp_", "", 1))
+    if not camp or update.effective_user.id not in camp.members():
+        await q.edit_message_text("⚠️ Такой кампании нет.")
+        return
+    context.user_data["campaign"] = camp.cid
+    # выбранный игрок — из прошлой кампании
+    context.user_data.pop("target_id", None)
+    context.user_data.pop("target_name", None)
+    await q.edit_message_text(f"🗺 Кампания: {_campaign_line(camp, update.effective_user.id)}")
+    await q.message.reply_text("Меню:", reply_markup=home_kb(update, context))
+
+
+async def new_campaign_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/newcampaign <название> — новая кампания, вызвавший становится мастером."""
+    title = " ".join(context.args or []).strip()
+    if not title:
+        await update.message.reply_text("Используй: /newcampaign <название>")
+        return
+    camp = CAMPAIGNS.create(title[:64], update.effective_user.id)
+    context.user_data["campaign"] = camp.cid
+    context.user_data.pop("target_id", None)
+    context.user_data.pop("target_name", None)
+    await update.message.reply_text(
+        f"🗺 Кампания «{camp.title}» создана, ты в ней мастер.\n"
+        f"Добавь игроков: /addplayer <имя> <telegram id> [sim]",
+        reply_markup=home_kb(update, context),
+    )
+
+
+async def add_player_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/addplayer <имя> <telegram id> [sim] — игрок в текущую кампанию."""
+    camp = _camp(update, context)
+    if not camp.is_master(update.effective_user.id):
+        await update.message.reply_text("🚫 Эта команда только для мастера.")
+        return
+    args = context.args or []
+    if len(args) < 2 or not args[1].isdigit():
+        await update.message.reply_text("Используй: /addplayer <имя> <telegram id> [sim]")
+        return
+    name, pid = args[0], int(args[1])
+    camp.players[name] = pid
+    if len(args) > 2 and args[2].lower() == "sim":
+        camp.sim_player = name
+    CAMPAIGNS.update(camp)
+    await update.message.reply_text(f"✅ {name} теперь в кампании «{camp.title}».")
+
+
+async def del_player_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/delplayer <имя> — убрать игрока из состава (инвентарь остаётся в шарде)."""
+    camp = _camp(update, context)
+    if not camp.is_master(update.effective_user.id):
+        await update.message.reply_text("🚫 Эта команда только для мастера.")
+        return
+    name = " ".join(context.args or []).strip()
+    if camp.players.pop(name, None) is None:
+        await update.message.reply_text("⚠️ Неизвестный игрок.")
+        return
+    if camp.sim_player == name:
+        camp.sim_player = None
+    CAMPAIGNS.update(camp)
+    await update.message.reply_text(f"🗑 {name} убран из кампании «{camp.title}».")
+
+
+# --------- Импорт из файла (мастер) ---------
+
+IMPORT_MAX_BYTES = 1024 * 1024
+
+
+async def import_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _is_master(update, context):
+        await update.message.reply_text("🚫 Эта команда только для мастера.")
+        return
+    if "target_id" not in context.user_data:
+        await update.message.reply_text("⚠️ Сначала выбери игрока в «Мастер-инвентарь».")
+        return
+    context.user_data["import_wait"] = True
+    await update.message.reply_text(
+        f"📥 Пришли файл для игрока *{context.user_data.get('target_name', '')}*:\n"
+        "• .txt — строка на предмет: `[Оружие] Кинжал x2` или `Монетка: приносит удачу`\n"
+        "• .csv — колонки name, category, qty, description\n"
+        "• .json — список строк или объектов с теми же полями",
+        parse_mode=constants.ParseMode.MARKDOWN,
+    )
+
+
+def _import_category(row, item: dict | None) -> str:
+    cat = (row.category or "").strip().capitalize()
+    if cat == "Наборы":
+        cat = "Наборы снаряжения"
+    if cat in ITEMS:
+        return cat
+    return _inventory_category(item) if item else bulk_import.DEFAULT_CATEGORY
+
+
+async def on_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not _is_master(update, context) or not context.user_data.pop("import_wait", False):
+        return
+    doc = update.message.document
+    if doc.file_size and doc.file_size > IMPORT_MAX_BYTES:
+        await update.message.reply_text("❌ Файл больше 1 МБ.")
+        return
+
+    raw = bytes(await (await doc.get_file()).download_as_bytearray())
+    try:
+        rows = bulk_import.parse_file(doc.file_name or "", raw)
+    except (ValueError, csv.Error) as e:
+        await update.message.reply_text(f"❌ Не удалось разобрать файл: {e}")
+        return
+    if not rows:
+        await update.message.reply_text("📭 В файле не нашлось ни одного предмета.")
+        return
+
+    bulk_import.match_rows(rows)
+    plan = []
+    for r in rows:
+        item = get_item(r.ref)
+        name = item["name"] if item else r.name
+        plan.append([_import_category(r, item), r.ref, name, r.desc, r.qty])
+    context.user_data["import_plan"] = plan
+    context.user_data["import_target"] = context.user_data["target_id"]
+
+    kb = InlineKeyboardMarkup(
+        [[
+            InlineKeyboardButton("✅ Импортировать", callback_data="imp_yes"),
+            InlineKeyboardButton("❌ Отмена", callback_data="imp_no"),
+        ]]
+    )
+    await update.message.reply_text(bulk_import.summary(rows), reply_markup=kb)
+
+
+async def on_import_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    plan = context.user_data.pop("import_plan", None)
+    uid = context.user_data.pop("import_target", None)
+    if q.data == "imp_no" or not plan:
+        await q.edit_message_text("🚫 Импорт отменён." if plan else "⌛ Импорт устарел — повтори /import.")
+        return
+
+    inv = get_inventory(uid, _camp(update, context))
+    for cat, ref, name, desc, qty in plan:
+        inv.add(cat, ref=ref, name=name, desc=desc, qty=qty)
+    await save_inventory(uid, inv, _camp(update, context))     # одна запись на весь файл
+
+    total = sum(row[4] for row in plan)
+    await q.edit_message_text(f"✅ Импортировано предметов: {total} ({len(plan)} строк).")
+    await notify_player(context.bot, uid, f"импортировано предметов: {total}")
+
+
+# --------- Сводка партии (мастер) ---------
+
+def _weight(t: party_stats.Totals) -> str:
+    s = f"{round(t.weight, 2):g} фнт."
+    return s + (f" (+{t.unweighed} без веса)" if t.unweighed else "")
+
+
+def render_party(camp: campaigns.Campaign, stats: party_stats.PartyStats) -> str:
+    lines = [f"📊 Сводка партии «{camp.title}»", ""]
+    for name, pid in camp.players.items():
+        t = stats.players.get(pid)
+        if not t or not t.items:
+            lines.append(f"👤 {name} — пусто")
+            continue
+        magic = t.by_cat.get("Магический предмет", 0)
+        lines.append(f"👤 {name} — {t.items} предм., магических {magic}, вес {_weight(t)}")
+
+    total = stats.total
+    lines += ["", f"🎒 Всего предметов: {total.items}", f"⚖️ Вес: {_weight(total)}"]
+    if total.cost:
+        lines.append(f"💰 Стоимость: {round(total.cost, 2):g} зм")
+    cats = [f"{c}: {total.by_cat[c]}" for c in ITEMS if total.by_cat.get(c)]
+    if cats:
+        lines += ["", "По категориям:"] + [f"• {c}" for c in cats]
+    if total.by_rarity:
+        lines += ["", "Магия по редкости:"]
+        for (rarity, tier), n in sorted(total.by_rarity.items(), key=lambda kv: -kv[1]):
+            lines.append(f"• {rarity}" + (f" / {tier}" if tier else "") + f": {n}")
+    return "\n".join(lines)
+
+
+async def party_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    camp = _camp(update, context)
+    if not camp.is_master(update.effective_user.id):
+        await update.message.reply_text("🚫 Эта команда только для мастера.")
+        return
+    await update.message.reply_text(render_party(camp, party_for(camp)))
+
+
+# --------- История и откат ---------
+
+HISTORY_SHOWN = 10
+
+
+async def history_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    camp = _camp(update, context)
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    rows = get_history().entries(camp.cid, uid, HISTORY_SHOWN)
+    if not rows:
+        await update.message.reply_text("📜 История пуста.")
+        return
+    lines = [
+        f"№{seq} · {datetime.datetime.fromtimestamp(ts):%d.%m %H:%M} · {summary}"
+        for seq, ts, summary in rows
+    ]
+    await update.message.reply_text(
+        "📜 Последние изменения:\n" + "\n".join(lines)
+        + "\n\n/undo — отменить последнее, /undo <№> — вернуть состояние после изменения №"
+    )
+
+
+async def undo_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    camp = _camp(update, context)
+    uid = context.user_data.get("target_id", update.effective_user.id)
+    hist = get_history()
+    if context.args:
+        if not context.args[0].lstrip("№#").isdigit():
+            await update.message.reply_text("Используй: /undo или /undo <номер из /history>")
+            return
+        target = int(context.args[0].lstrip("№#"))
+        if target > (hist.last_seq(camp.cid, uid) or 0):
+            await update.message.reply_text("⚠️ Нет такого изменения в истории.")
+            return
+    else:
+        target = hist.undo_target(camp.cid, uid)
+        if target is None:
+            await update.message.reply_text("↩️ Отменять нечего.")
+            return
+
+    state = hist.state_at(camp.cid, uid, target)
+    if state is None:
+        first = hist.first_seq(camp.cid, uid)
+        await update.message.reply_text(
+            f"⚠️ Состояние №{target} уже не хранится." + (f" Самое раннее — №{first}." if first is not None else "")
+        )
+        return
+    current, ver = get_inventory_with_version(uid, camp)
+    restored = Inventory.from_json(state, ITEMS.keys())
+    restored.version = ver
+    # журнал для сводки партии: разница между текущим и восстановленным
+    restored.changes = [(cat, ref, dq) for cat, ref, dq, _ in history.qty_changes(current.to_json(), state)]
+    if not restored.changes and current.to_json() == restored.to_json():
+        await update.message.reply_text(f"↩️ Инвентарь уже в состоянии №{target}.")
+        return
+    await save_inventory(uid, restored, camp, restored=target)
+
+    text = f"↩️ Инвентарь возвращён к состоянию №{target}: {history.describe(current.to_json(), state)}"
+    await update.message.reply_text(text)
+    if not camp.is_master(update.effective_user.id):
+        await notify_master(context.bot, update.effective_user.first_name, text, camp.master_id)
+
+
+# --------- Кости ---------
+
+ROLL_SHOWN = 10             # до стольких бросков — каждый с костями, дальше — статистика
+ROLL_MAX = 100_000
+ROLL_TEXT_MAX = 3500        # Telegram не примет сообщение длиннее 4096 символов
+_ROLL_TIMES_RE = re.compile(r"\s*[xх×*]\s*(\d+)$", re.IGNORECASE)
+
+
+def _roll_stats(expr: dice.Expr, n: int) -> str:
+    rolls = expr.roll(n)
+    p5, p50, p95 = np.percentile(rolls, [5, 50, 95])
+    return (
+        f"🎲 {expr} × {n}\n"
+        f"Среднее {rolls.mean():.2f}, разброс {rolls.min()}–{rolls.max()} "
+        f"(возможно {expr.min}–{expr.max})\n"
+        f"5% / медиана / 95%: {p5:.0f} / {p50:.0f} / {p95:.0f}"
+    )
+
+
+async def roll_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/roll 2к6+3, /roll к20 пр, /roll 4к6кв3 x6 — броски; xN — сколько раз."""
+    text = " ".join(context.args or []).strip() or "к20"
+    n = 1
+    m = _ROLL_TIMES_RE.search(text)
+    if m:
+        n, text = int(m.group(1)), text[:m.start()]
+    if not 1 <= n <= ROLL_MAX:
+        await update.message.reply_text(f"⚠️ Бросков — от 1 до {ROLL_MAX}.")
+        return
+    try:
+        expr = dice.parse(text)
+        out = None
+        if n <= ROLL_SHOWN:
+            rolls = [expr.roll_detail() for _ in range(n)]
+            out = "\n".join(dice.format_detail(expr, *r) for r in rolls)
+            out = "🎲 " + out if n == 1 else "🎲\n" + out
+            if len(out) > ROLL_TEXT_MAX:        # много слагаемых — только итоги
+                out = f"🎲 {expr}: " + ", ".join(str(total) for total, _ in rolls)
+        if out is None or len(out) > ROLL_TEXT_MAX:
+            out = _roll_stats(expr, n)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"⚠️ {e}\nНапример: /roll 2к6+3, /roll к20 пр, /roll 4к6кв3 x6"
+        )
+        return
+    await update.message.reply_text(out)
+
+
+async def on_attack_click(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопка под карточкой оружия: к20 на попадание и урон; 20 — крит, 1 — промах."""
+    q = update.callback_query
+    _, mode, iid = q.data.split("_", 2)
+    item, dmg = get_item(iid), item_catalog.DAMAGE.get(iid)
+    if not item or not dmg:
+        await q.answer("❌ Предмет не найден в каталоге.")
+        return
+    await q.answer()
+
+    hit = dice.parse({"a": "к20 пр", "d": "к20 пом"}.get(mode, "к20"))
+    total, detail = hit.roll_detail()
+    title = item["name"].split(" / ")[0]
+    lines = [f"⚔️ {title}" + {"a": " — с преимуществом", "d": " — с помехой"}.get(mode, "")]
+    lines.append("🎯 " + dice.format_detail(hit, total, detail) + " + бонус атаки")
+
+    dmg_dice, dmg_type, versatile = dmg
+    kind = f" {dmg_type}" if dmg_type else ""
+    if total == 1:
+        lines.append("💨 Естественная 1 — промах.")
+    else:
+        crit = total == 20
+        if crit:
+            lines.append("💥 Естественная 20 — критическое попадание, кости урона удваиваются!")
+        for label, text in (("Урон", dmg_dice), ("Двумя руками", versatile)):
+            if not text:
+                continue
+            expr = dice.parse(text)
+            expr = expr.crit() if crit else expr
+            lines.append(f"🩸 {label}: " + dice.format_detail(expr, *expr.roll_detail()) + kind)
+    await q.message.reply_text("\n".join(lines))
+
+
+# --------- Выгрузка (мастер) ---------
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/export [jsonl|csv] — все инвентари кампании одним файлом."""
+    camp = _camp(update, context)
+    if not camp.is_master(update.effective_user.id):
+        await update.message.reply_text("🚫 Эта команда только для мастера.")
+        return
+    fmt = (context.args[0].lower() if context.args else "jsonl").lstrip(".")
+    if fmt not in export.FORMATS:
+        await update.message.reply_text("Используй: /export [jsonl|csv]")
+        return
+    path = camp.shard.path
+    if not path.exists():
+        await update.message.reply_text("📭 Хранилище пусто.")
+        return
+
+    names = {pid: name for name, pid in camp.players.items()}
+    with tempfile.TemporaryDirectory() as tmp:
+        out = Path(tmp) / f"inventories_{datetime.date.today():%Y%m%d}.{fmt}"
+        # потоковая запись во временный файл — в отдельном потоке, чтобы не стопорить бота
+        with out.open("w", encoding="utf-8", newline="") as fp:
+            n = await asyncio.to_thread(export.write_export, fp, path, fmt, names, ITEMS)
+        with out.open("rb") as fp:
+            await update.message.reply_document(
+                fp, filename=out.name, caption=f"📤 Записей: {n}"
+            )
+
+
+# --------- Профилирование (мастер) ---------
+
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/profile on [бюджет_мс] | off | top — профилирование медленных обработчиков."""
+    # профилировщик общий на процесс — только мастер основной кампании
+    if not CAMPAIGNS.default.is_master(update.effective_user.id):
+        await update.message.reply_text("🚫 Эта команда только для мастера.")
+        return
+
+    prof = profiling.PROFILER
+    args = context.args or []
+    action = args[0].lower() if args else ""
+
+    if action == "on":
+        try:
+            budget = float(args[1]) if len(args) > 1 else None
+        except ValueError:
+            await update.message.reply_text("Используй: /profile on [бюджет в мс]")
+            return
+        prof.enable(budget)
+        await update.message.reply_text(
+            f"🔬 Профилирование включено, бюджет {prof.budget * 1000:.0f} мс."
+        )
+        return
+
+    if action == "off":
+        prof.disable()
+        await update.message.reply_text("🔬 Профилирование выключено.")
+        return
+
+    if action == "top":
+        caps = prof.slowest(10)
+        if not caps:
+            await update.message.reply_text("📭 Медленных вызовов не было.")
+            return
+        lines = ["🐢 Самые медленные вызовы:"]
+        for c in caps:
+            when = datetime.datetime.fromtimestamp(c.ts).strftime("%d.%m %H:%M:%S")
+            where = c.path.name if c.path else "без профиля"
+            lines.append(f"• {c.handler} — {c.elapsed * 1000:.0f} мс ({when}, {where})")
+        await update.message.reply_text("\n".join(lines))
+        return
+
+    state = "включено" if prof.enabled else "выключено"
+    await update.message.reply_text(
+        f"🔬 Профилирование {state}, бюджет {prof.budget * 1000:.0f} мс, "
+        f"снимков: {len(prof.recent)}.\nИспользуй: /profile on [мс] | off | top"
+    )
+
+
 # --------- Уведомления (мягкие) ---------
 
-async def notify_master(bot, player_name, action):
+async def notify_master(bot, player_name, action, master_id: int = MASTER_ID):
     try:
-        await bot.send_message(MASTER_ID, f"🪶 Игрок {player_name} {action}")
+        await bot.send_message(master_id, f"🪶 Игрок {player_name} {action}")
     except Exception:
         pass
 
@@ -1067,48 +2008,183 @@ async def notify_player(bot, player_id, action):
 
 # --------- Бэкап в GitHub ---------
 
+BACKUP_DIR = Path(os.getenv("BACKUP_DIR", "backup"))
+
+
+def _backup_files() -> list[tuple[Path, Path]]:
+    """(шард, его копия в BACKUP_DIR) для всех кампаний, у которых уже есть файл."""
+    CAMPAIGNS.refresh()     # кампании, созданные другими процессами пула
+    out = []
+    for camp in CAMPAIGNS.campaigns.values():
+        src = camp.shard.path
+        if src.exists():
+            name = src.name if camp is CAMPAIGNS.default else f"{CAMPAIGNS_DIR.name}/{camp.cid}.json"
+            out.append((src, BACKUP_DIR / name))
+    return out
+
+
+def _backup_to_git(files: list[tuple[Path, Path]], ts: str):
+    # в git — всегда JSON с отступами: читаемые построчные диффы, в каком бы
+    # формате (STORAGE_CODEC) ни лежали сами шарды
+    pretty = storage_codec.get("json-pretty")
+    for src, dst in files:
+        storage_codec.export(src, dst, pretty)
+    subprocess.run(
+        ["git", "config", "--global", "user.email", os.getenv("GITHUB_EMAIL")],
+        check=True,
+    )
+    subprocess.run(
+        ["git", "config", "--global", "user.name", os.getenv("GITHUB_NAME")],
+        check=True,
+    )
+    paths = [str(dst) for _, dst in files] + ([str(CAMPAIGNS_FILE)] if CAMPAIGNS_FILE.exists() else [])
+    if paths:
+        subprocess.run(["git", "add", *paths], check=True)
+    subprocess.run(
+        ["git", "commit", "-m", f"auto backup {ts}"], check=False
+    )
+    subprocess.run(
+        [
+            "git",
+            "push",
+            f"https://{os.getenv('GITHUB_TOKEN')}@github.com/{os.getenv('GITHUB_REPO')}.git",
+            "HEAD:main",
+        ],
+        check=False,
+    )
+
+
 async def backup_inventory_to_github():
     ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     try:
-        subprocess.run(
-            ["git", "config", "--global", "user.email", os.getenv("GITHUB_EMAIL")],
-            check=True,
-        )
-        subprocess.run(
-            ["git", "config", "--global", "user.name", os.getenv("GITHUB_NAME")],
-            check=True,
-        )
-        subprocess.run(["git", "add", "inventory_data.json"], check=True)
-        subprocess.run(
-            ["git", "commit", "-m", f"auto backup {ts}"], check=False
-        )
-        subprocess.run(
-            [
-                "git",
-                "push",
-                f"https://{os.getenv('GITHUB_TOKEN')}@github.com/{os.getenv('GITHUB_REPO')}.git",
-                "HEAD:main",
-            ],
-            check=False,
-        )
+        # список кампаний — в цикле событий, файлы и git — в потоке
+        await asyncio.to_thread(_backup_to_git, _backup_files(), ts)
         print(f"✅ GitHub backup done at {ts}")
     except Exception as e:
         print(f"⚠️ Backup error: {e}")
 
 
+# --------- Состояние разговоров ---------
+
+async def evict_idle_state(app):
+    """
+    Выкидывает из памяти и с диска состояние давно неактивных пользователей.
+    async — чтобы планировщик запускал её в цикле событий: соединение sqlite
+    у CompactPersistence открыто в его потоке, а из пула потоков оно недоступно.
+    """
+    if not app.persistence:
+        return
+    for uid in app.persistence.evict_idle():
+        app.drop_user_data(uid)
+
+
 # --------- Запуск ---------
 
-async def run_bot():
-    # загрузка каталогов
-    global MAGIC, NONMAGIC
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")            # публичный https-адрес, если задан — режим webhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")      # X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or os.getenv("PORT") or 8443)
+BOT_MODE = os.getenv("BOT_MODE", "webhook" if WEBHOOK_URL else "polling")
+BOT_CONCURRENCY = int(os.getenv("BOT_CONCURRENCY", "16"))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))  # >1 — фронт и N процессов-обработчиков, см. worker_pool.py
+WORKER_INDEX = os.getenv("WORKER_INDEX")          # номер процесса в пуле (задаёт worker_pool)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))   # 0 — не поднимать /metrics
+
+
+SYNC_INTERVAL = 1.0          # как часто сверять общие файлы с другими процессами, с
+_CATALOG_STAMP = None
+_SYNCED_AT = 0.0
+
+
+def load_catalogs():
+    global MAGIC, NONMAGIC, _CATALOG_STAMP
+    _CATALOG_STAMP = item_catalog.catalog_stamp(DATA_DIR)
     MAGIC, NONMAGIC = init_catalogs(str(DATA_DIR))
+    _inline_articles.cache_clear()
+    # в разобранных инвентарях и готовых страницах — ссылки на старые записи каталога
+    INVENTORY_CACHE.clear()
+    PAGE_CACHE.clear()
+    PARTY.clear()
 
-    app = ApplicationBuilder().token(TOKEN).build()
+
+def sync_shared_state(force: bool = False):
+    """
+    Подхватывает то, что поменяли другие процессы: состав кампаний (campaigns.json)
+    и файлы каталога. Инвентари сверяются сами при каждом чтении шарда.
+    Проверка — пара stat() не чаще раза в SYNC_INTERVAL.
+    """
+    global _SYNCED_AT
+    now = time.monotonic()
+    if not force and now - _SYNCED_AT < SYNC_INTERVAL:
+        return
+    _SYNCED_AT = now
+    CAMPAIGNS.refresh()
+    if item_catalog.catalog_stamp(DATA_DIR) != _CATALOG_STAMP:
+        print("📚 Каталог изменился на диске — перечитываю")
+        load_catalogs()
+
+
+async def on_any_update(update: object, context: ContextTypes.DEFAULT_TYPE):
+    sync_shared_state()
+
+
+# кнопки, повтор которых меняет инвентарь ещё раз; см. idempotency.py
+MUTATING_CALLBACKS = ("rm_", "confirm_yes", "add_custom_yes", "imp_yes", "qa_")
+SEEN_CALLBACKS = idempotency.SeenSet(
+    int(os.getenv("CALLBACK_SEEN_MAX", str(idempotency.DEFAULT_MAX_SIZE))),
+    float(os.getenv("CALLBACK_SEEN_TTL", str(idempotency.DEFAULT_TTL))),
+)
+
+
+async def drop_duplicate_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Раньше всех обработчиков (и до сверки с диском): повтор нажатия не доходит до хранилища."""
+    reason = idempotency.check(SEEN_CALLBACKS, update.callback_query, MUTATING_CALLBACKS)
+    if reason is None:
+        return
+    metrics.DUPLICATE_CALLBACKS.inc(reason=reason)
+    if reason == "double_tap":
+        # у повтора доставки ответ уже дан первым запросом, у второго нажатия — свой id
+        await update.callback_query.answer()
+    raise ApplicationHandlerStop
+
+
+def build_application(token: str | None = None, request=None, webhook: bool = False):
+    """
+    Собирает Application со всеми разговорниками и командами.
+    request — подменный транспорт Bot API (например, офлайн для тестов),
+    webhook=True — без Updater: апдейты приходят через WebhookServer.
+    """
+    from state_persistence import CompactPersistence
+    from telegram.request import HTTPXRequest
+
+    if request is None:
+        request, updates_request = HTTPXRequest(connection_pool_size=256), HTTPXRequest()
+    else:
+        updates_request = request
+
+    builder = (
+        ApplicationBuilder()
+        .token(token or TOKEN)
+        .persistence(CompactPersistence(STATE_DB, ttl=STATE_TTL))
+        .request(metrics.instrument_request(request))
+        .get_updates_request(metrics.instrument_request(updates_request))
+    )
+    if webhook:
+        from webhook_server import PerUserUpdateProcessor
+
+        builder = builder.updater(None).concurrent_updates(
+            PerUserUpdateProcessor(BOT_CONCURRENCY)
+        )
+    app = builder.build()
 
     # разговорники
     remove_conv = ConversationHandler(
+        name="remove",
+        persistent=True,
         entry_points=[
-            MessageHandler(filters.Regex("^➖ Удалить предмет$"), remove_item)
+            MessageHandler(MENU.only("remove"), remove_item)
         ],
         states={
             STATE_REMOVE_CATEGORY: [
@@ -1119,12 +2195,14 @@ async def run_bot():
                 CallbackQueryHandler(on_remove_nav, pattern="^pg_"),
             ]
         },
-        fallbacks=[MessageHandler(filters.Regex(BACK_RE), on_any_back)],
+        fallbacks=[MessageHandler(MENU.only("back"), on_any_back)],
     )
 
     inventory_conv = ConversationHandler(
+        name="inventory",
+        persistent=True,
         entry_points=[
-            MessageHandler(filters.Regex("^📦 Инвентарь$"), show_inventory_menu)
+            MessageHandler(MENU.only("inventory"), show_inventory_menu)
         ],
         states={
             STATE_INVENTORY_CATEGORY: [
@@ -1132,21 +2210,21 @@ async def run_bot():
                     filters.TEXT & ~filters.COMMAND, show_inventory_list
                 ),
                 CallbackQueryHandler(
-                    on_inventory_nav, pattern="^inv_(prev|next|exit)$"
+                    on_inventory_nav, pattern="^inv_(pg_|prev|next|exit)"
                 ),
                 CallbackQueryHandler(
-                    on_inventory_item, pattern="^inv_[0-9]+$"
+                    on_inventory_item, pattern="^inv_[0-9_]+$"
                 ),
             ]
         },
-        fallbacks=[MessageHandler(filters.Regex(BACK_RE), on_any_back)],
+        fallbacks=[MessageHandler(MENU.only("back"), on_any_back)],
     )
 
     simulate_conv = ConversationHandler(
+        name="simulate",
+        persistent=True,
         entry_points=[
-            MessageHandler(
-                filters.Regex("^🎲 Симулировать день$"), ask_simulation_days
-            )
+            MessageHandler(MENU.only("simulate"), ask_simulation_days)
         ],
         states={
             STATE_SIMULATE_DAYS: [
@@ -1155,12 +2233,14 @@ async def run_bot():
                 )
             ]
         },
-        fallbacks=[MessageHandler(filters.Regex(BACK_RE), on_any_back)],
+        fallbacks=[MessageHandler(MENU.only("back"), on_any_back)],
     )
 
     add_conv = ConversationHandler(
+        name="add",
+        persistent=True,
         entry_points=[
-            MessageHandler(filters.Regex("^➕ Добавить предмет$"), add_item_start)
+            MessageHandler(MENU.only("add"), add_item_start)
         ],
         states={
             STATE_ADD_CATEGORY: [
@@ -1178,28 +2258,23 @@ async def run_bot():
                 )
             ],
         },
-        fallbacks=[MessageHandler(filters.Regex(BACK_RE), on_any_back)],
+        fallbacks=[MessageHandler(MENU.only("back"), on_any_back)],
     )
 
     # регистрация
+    app.add_handler(CallbackQueryHandler(drop_duplicate_callbacks), group=-2)
+    app.add_handler(TypeHandler(Update, on_any_update), group=-1)
     app.add_handler(inventory_conv)
     app.add_handler(remove_conv)
     app.add_handler(simulate_conv)
     app.add_handler(add_conv)
 
-    app.add_handler(MessageHandler(filters.Regex(BACK_RE), on_any_back))
+    app.add_handler(MessageHandler(MENU.only("back"), on_any_back))
 
-    app.add_handler(
-        MessageHandler(
-            filters.Regex("^📜 Мастер-инвентарь$"), show_master_inventory
-        )
-    )
-    app.add_handler(
-        MessageHandler(
-            filters.Regex("^(Карла|Энсо|Найт|Гундар|Рошах|🔙 Назад)$"),
-            master_select_player,
-        )
-    )
+    app.add_handler(MessageHandler(MENU.only("master"), show_master_inventory))
+    app.add_handler(MessageHandler(MENU.only("player"), master_select_player))
+    app.add_handler(MessageHandler(MENU.only("categories"), categories))
+    app.add_handler(MessageHandler(MENU.only("party"), party_cmd))
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_cmd))
@@ -1207,13 +2282,113 @@ async def run_bot():
     app.add_handler(CommandHandler("inventory", show_inventory))
     app.add_handler(CommandHandler("simulate", simulate_days))  # по желанию
     app.add_handler(CommandHandler("master", master_inventory_cmd))
+    app.add_handler(CommandHandler("profile", profile_cmd))
+    app.add_handler(CommandHandler("search", search_cmd))
+    app.add_handler(CommandHandler("catalog", catalog_query_cmd))
+    app.add_handler(CommandHandler("browse", browse_cmd))
+    app.add_handler(CallbackQueryHandler(on_browse_click, pattern="^br_"))
+    app.add_handler(CallbackQueryHandler(on_search_click, pattern="^sr_"))
+    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(CallbackQueryHandler(on_inline_add, pattern="^qa_"))
+    app.add_handler(CommandHandler("import", import_cmd))
+    app.add_handler(MessageHandler(filters.Document.ALL, on_import_file))
+    app.add_handler(CallbackQueryHandler(on_import_confirm, pattern="^imp_"))
+    app.add_handler(CommandHandler("export", export_cmd))
+    app.add_handler(CommandHandler("party", party_cmd))
+    app.add_handler(CommandHandler("history", history_cmd))
+    app.add_handler(CommandHandler("undo", undo_cmd))
+    app.add_handler(CommandHandler("roll", roll_cmd))
+    app.add_handler(CallbackQueryHandler(on_attack_click, pattern="^atk_"))
+    app.add_handler(CommandHandler("campaign", campaign_cmd))
+    app.add_handler(CommandHandler("newcampaign", new_campaign_cmd))
+    app.add_handler(CommandHandler("addplayer", add_player_cmd))
+    app.add_handler(CommandHandler("delplayer", del_player_cmd))
+    app.add_handler(CallbackQueryHandler(on_campaign_switch, pattern="^camp_"))
+
+    profiling.PROFILER.instrument(app)
+    metrics.instrument_handlers(app)
+    return app
+
+
+async def run_webhook(app):
+    """Webhook-режим: свой HTTP-сервер, параллельная обработка и мягкая остановка."""
+    import signal
+    import worker_pool
+    from webhook_server import WebhookServer
+
+    server = WebhookServer(
+        app, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT
+    )
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    # обработчик пула завершается вместе со входом, даже если тот убит без SIGTERM
+    watchdog = asyncio.create_task(worker_pool.watch_parent(stop_event.set))
+
+    await app.initialize()
+    await app.start()
+    await server.start()
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=BOT_CONCURRENCY,
+        )
+    print(f"✅ Бот запущен (webhook {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH})!")
+
+    try:
+        await stop_event.wait()
+    finally:
+        watchdog.cancel()
+        # сначала перестаём принимать запросы и дожидаемся начатых,
+        # затем Application дорабатывает очередь апдейтов
+        await server.stop()
+        await app.stop()
+        await app.shutdown()
+
+
+async def run_bot():
+    webhook = BOT_MODE == "webhook"
+    if webhook and BOT_WORKERS > 1:
+        # этот процесс — только вход: каталоги и обработчики живут в дочерних
+        import worker_pool
+
+        await worker_pool.run_pool(
+            BOT_WORKERS, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+            WEBHOOK_URL, TOKEN, max_connections=BOT_CONCURRENCY * BOT_WORKERS,
+            metrics_port=METRICS_PORT,
+        )
+        return
+
+    # загрузка каталогов
+    load_catalogs()
+
+    app = build_application(webhook=webhook)
 
     from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(backup_inventory_to_github, "interval", hours=24)
+    if WORKER_INDEX in (None, "0"):
+        # резервная копия одна на пул
+        scheduler.add_job(backup_inventory_to_github, "interval", hours=24)
+    scheduler.add_job(evict_idle_state, "interval", hours=1, args=[app])
+    scheduler.add_job(evict_idle_shards, "interval", minutes=5)
     scheduler.start()
 
+    if METRICS_PORT:
+        await metrics.serve_metrics(METRICS_HOST, METRICS_PORT)
+        print(f"📈 Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    if webhook:
+        await run_webhook(app)
+        return
+
     print("✅ Бот запущен!")
     await app.run_polling()
 
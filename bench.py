@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+# bench.py — микробенчмарки горячих путей: каталог, поиск, хранилище, отрисовка
+#
+#   python bench.py run [--scales 10000 100000] [--users 10000] [-o bench_results/new.json]
+#   python bench.py compare bench_results/baseline.json bench_results/new.json [--threshold 0.2]
+#
+# Каждый замер — медиана нескольких прогонов timeit (секунды на одну операцию).
+# compare помечает как регрессию всё, что стало медленнее больше чем на threshold,
+# и завершается с кодом 1.
+
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+from pathlib import Path
+
+import catalog_facets
+import dice
+import item_catalog
+import storage_codec
+import InventoryBot as bot
+from inventory_model import Inventory
+
+RESULTS_DIR = Path(__file__).with_name("bench_results")
+REPEAT = 5
+MIN_TIME = 0.05   # минимальная длительность одного прогона timeit
+
+
+# --------- Каталоги ---------
+
+def use_catalogs(magic: list[dict], nonmagic: list[dict]):
+    """Подставляет каталоги и в item_catalog, и в бота (там свои ссылки)."""
+    item_catalog.MAGIC, item_catalog.NONMAGIC = magic, nonmagic
+    bot.MAGIC, bot.NONMAGIC = magic, nonmagic
+    item_catalog.index_catalogs()
+
+
+def synth_catalogs(size: int, magic: list[dict], nonmagic: list[dict], seed: int = 1):
+    """
+    Синтетический каталог на size предметов: имена и описания собраны
+    из настоящих, чтобы распределение длин и слов было похожим.
+    Треть — магия, остальное — немагическое.
+    """
+    rnd = random.Random(seed)
+    words = sorted({w for it in magic + nonmagic for w in it["name"].split() if w.isalpha()})
+    descs = [it["description"] for it in magic if it.get("description")]
+
+    def name(i):
+        return " ".join(rnd.sample(words, rnd.randint(1, 3))) + f" {i}"
+
+    n_magic = size // 3
+    out_magic = []
+    for i in range(n_magic):
+        src = rnd.choice(magic)
+        out_magic.append({
+            "name": name(i),
+            "rarity": src["rarity"],
+            "tier": src["tier"],
+            "description": rnd.choice(descs),
+            "source": src.get("source"),
+            "url": src.get("url"),
+        })
+    out_nonmagic = []
+    for i in range(size - n_magic):
+        src = rnd.choice(nonmagic)
+        out_nonmagic.append({
+            "category": src["category"],
+            "name": name(n_magic + i),
+            "description": src.get("description"),
+        })
+    return out_magic, out_nonmagic
+
+
+def synth_inventory(rnd: random.Random, magic: list[dict], nonmagic: list[dict], per_cat: int = 3):
+    inv = Inventory(bot.ITEMS)
+    for cat in bot.ITEMS:
+        for _ in range(per_cat):
+            if cat == "Магический предмет":
+                it = rnd.choice(magic)
+                inv.add(cat, ref=it["id"], name=it["name"])
+            elif rnd.random() < 0.2:
+                inv.add(cat, name=f"Самоделка {rnd.randint(1, 999)}", desc="описание")
+            else:
+                it = rnd.choice(nonmagic)
+                inv.add(cat, ref=it["id"], name=it["name"])
+    return inv
+
+
+def synth_legacy_inventory(rnd: random.Random, magic: list[dict], nonmagic: list[dict], per_cat: int = 3):
+    """Инвентарь в старом строковом формате — для замера миграции."""
+    inv = {cat: [] for cat in bot.ITEMS}
+    for cat in bot.ITEMS:
+        for _ in range(per_cat):
+            if cat == "Магический предмет":
+                it = rnd.choice(magic)
+                inv[cat].append(f"{it['name']} — {it['description'][:600]}…")
+            elif rnd.random() < 0.2:
+                inv[cat].append(f"⭐ Самоделка {rnd.randint(1, 999)} — описание")
+            else:
+                inv[cat].append(rnd.choice(nonmagic)["name"])
+    return inv
+
+
+# --------- Замеры ---------
+
+def measure(fn, repeat: int = REPEAT) -> dict:
+    timer = timeit.Timer(fn)
+    number = 1
+    while timer.timeit(number) < MIN_TIME:
+        number *= 4
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {"median_s": statistics.median(runs), "min_s": min(runs), "number": number}
+
+
+def bench_catalog(label: str, magic: list[dict], nonmagic: list[dict], results: dict):
+    use_catalogs(magic, nonmagic)
+    rnd = random.Random(7)
+    mid_magic = magic[len(magic) // 2]["name"]
+    mid_nonmagic = nonmagic[len(nonmagic) // 2]
+    partial = mid_magic.split(" / ")[0].split()[0].lower()
+    typo = mid_nonmagic["name"][:-1] + "ь"
+
+    facet_sel = {"rarity": "Редкий", "attunement": "требуется"}
+    cases = {
+        "find_nonmagic_item[exact]": lambda: item_catalog.find_nonmagic_item(mid_nonmagic["name"]),
+        "find_nonmagic_item[category]": lambda: item_catalog.find_nonmagic_item(
+            mid_nonmagic["name"], mid_nonmagic["category"]),
+        "find_nonmagic_item[miss]": lambda: item_catalog.find_nonmagic_item("несуществующий предмет"),
+        "find_magic_item[exact]": lambda: item_catalog.find_magic_item(mid_magic),
+        "find_magic_item[partial]": lambda: item_catalog.find_magic_item(partial),
+        "find_magic_item[miss]": lambda: item_catalog.find_magic_item("несуществующий предмет"),
+        "enrich_item[magic]": lambda: item_catalog.enrich_item(
+            {"name": mid_magic, "category": "Магический предмет"}),
+        "enrich_item[weapon]": lambda: item_catalog.enrich_item(
+            {"name": mid_nonmagic["name"], "category": "Оружие"}),
+        "find_closest_item[exact]": lambda: bot.find_closest_item(mid_nonmagic["name"], "Снаряжение"),
+        "find_closest_item[fuzzy]": lambda: bot.find_closest_item(typo, "Снаряжение"),
+        "find_closest_item[miss]": lambda: bot.find_closest_item("йцукен фыва", "Снаряжение"),
+        "search_items[2 words]": lambda: item_catalog.search_items("огонь урон"),
+        "search_items[miss]": lambda: item_catalog.search_items("йцукен фыва"),
+        "complete_names[3 chars]": lambda: item_catalog.complete_names(partial[:3]),
+        "complete_names[2 words]": lambda: item_catalog.complete_names(mid_magic[:12]),
+        "COLUMNS.select[weight<=2lb, sort]": lambda: item_catalog.COLUMNS.select(
+            "Оружие", (None, 2.0), sort="weight"),
+        "COLUMNS.select[all, sort desc]": lambda: item_catalog.COLUMNS.select(sort="weight", desc=True),
+        "FACETS.counts[5 facets, 2 filters]": lambda: [
+            item_catalog.FACETS.counts(field, facet_sel) for field, _ in catalog_facets.FACETS.values()],
+    }
+
+    card_items = [dict(rnd.choice(magic), category="Магический предмет"), rnd.choice(nonmagic)]
+    cases["render_item_card"] = lambda: [item_catalog.render_item_card(it) for it in card_items]
+
+    legacy = synth_legacy_inventory(rnd, magic, nonmagic)
+    cases["Inventory.from_json[legacy]"] = lambda: Inventory.from_json(legacy, bot.ITEMS)
+    stored = synth_inventory(rnd, magic, nonmagic).to_json()
+    cases["Inventory.from_json"] = lambda: Inventory.from_json(stored, bot.ITEMS)
+
+    inv = synth_inventory(rnd, magic, nonmagic, per_cat=20)
+
+    def find_lose():
+        bot._find_item(inv)
+        bot._lose_item(inv)
+
+    cases["_find_item+_lose_item"] = find_lose
+
+    for name, fn in cases.items():
+        key = f"catalog={label}/{name}"
+        results[key] = measure(fn)
+        print(f"  {key:<58} {results[key]['median_s'] * 1e6:>12.1f} µs")
+
+
+def bench_dice(results: dict):
+    expr = dice.parse("2к6+1к8+3")
+    cases = {
+        "parse[cached]": lambda: dice.parse("2к6+1к8+3"),
+        "roll[x10000]": lambda: expr.roll(10000),
+        "roll[x10000, кв]": lambda: dice.parse("4к6кв3").roll(10000),
+        "roll_detail": expr.roll_detail,
+        "total[к20]": bot.D20.total,
+    }
+    for name, fn in cases.items():
+        key = f"dice/{name}"
+        results[key] = measure(fn)
+        print(f"  {key:<58} {results[key]['median_s'] * 1e6:>12.1f} µs")
+
+
+def bench_storage(users: int, magic: list[dict], nonmagic: list[dict], results: dict):
+    rnd = random.Random(11)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot.DATA_FILE = Path(tmp) / "inventory_data.json"
+        bot.HISTORY_DB = Path(tmp) / "inventory_history.sqlite3"
+        texts = {}
+        data = {str(100000 + i): synth_inventory(rnd, magic, nonmagic).to_json(texts) for i in range(users)}
+        data["_texts"] = texts
+        bot._save_all(data)
+        size = bot.DATA_FILE.stat().st_size
+        uid = 100000 + users // 2
+        inv = bot.get_inventory(uid)
+        loop = asyncio.new_event_loop()     # save_inventory — корутина (ждёт блокировку шарда)
+        shard = bot.CAMPAIGNS.for_user(uid).shard
+
+        def get_cold():
+            # чтение с диска и разбор, как до кэшей: шард и инвентарь выгружаются перед замером
+            shard.evict()
+            bot.INVENTORY_CACHE.clear()
+            return bot.get_inventory(uid)
+
+        cases = {
+            "get_inventory": get_cold,
+            "get_inventory[cached]": lambda: bot.get_inventory(uid),
+            "save_inventory": lambda: loop.run_until_complete(bot.save_inventory(uid, inv)),
+        }
+        for name, fn in cases.items():
+            key = f"storage=users{users}/{name}"
+            results[key] = measure(fn, repeat=3)
+            results[key]["file_bytes"] = size
+            print(f"  {key:<58} {results[key]['median_s'] * 1e3:>12.2f} ms")
+        loop.close()
+
+        # тот же шард во всех форматах: время кодирования/разбора и размер файла
+        data = bot._load_all()
+        for name in storage_codec.available():
+            codec = storage_codec.get(name)
+            raw = codec.encode(data)
+            for op, fn in (("encode", lambda: codec.encode(data)), ("decode", lambda: codec.decode(raw))):
+                key = f"storage=users{users}/{op}[{name}]"
+                results[key] = measure(fn, repeat=3)
+                results[key]["file_bytes"] = len(raw)
+                print(f"  {key:<58} {results[key]['median_s'] * 1e3:>12.2f} ms  {len(raw) / 1024:>8.0f} КиБ")
+
+
+# --------- CLI ---------
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def cmd_run(args):
+    magic, nonmagic = item_catalog.init_catalogs(str(bot.DATA_DIR))
+    random.seed(0)
+    results = {}
+
+    print("⏱ Каталог из data/")
+    bench_catalog("shipped", magic, nonmagic, results)
+    for size in args.scales:
+        print(f"⏱ Синтетический каталог на {size} предметов")
+        s_magic, s_nonmagic = synth_catalogs(size, magic, nonmagic)
+        bench_catalog(f"synth{size}", s_magic, s_nonmagic, results)
+
+    print("⏱ Кости")
+    bench_dice(results)
+
+    use_catalogs(magic, nonmagic)
+    print(f"⏱ Хранилище на {args.users} игроков")
+    bench_storage(args.users, magic, nonmagic, results)
+
+    out = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+    path = Path(args.output) if args.output else (
+        RESULTS_DIR / f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(out, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"💾 Результаты: {path}")
+    return 0
+
+
+def compare(base: dict, new: dict) -> list[tuple[str, float, float, float]]:
+    """Список (ключ, было, стало, отношение) для всех замеров, что есть в обоих файлах."""
+    rows = []
+    for key, b in base["results"].items():
+        n = new["results"].get(key)
+        if not n:
+            continue
+        rows.append((key, b["median_s"], n["median_s"], n["median_s"] / b["median_s"]))
+    return rows
+
+
+def cmd_compare(args):
+    base = json.loads(Path(args.base).read_text(encoding="utf-8"))
+    new = json.loads(Path(args.new).read_text(encoding="utf-8"))
+    regressions = 0
+    for key, b, n, ratio in compare(base, new):
+        mark = ""
+        if ratio > 1 + args.threshold:
+            mark = "  ❌ регрессия"
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            mark = "  ✅ быстрее"
+        print(f"{key:<60} {b * 1e6:>12.1f} → {n * 1e6:>12.1f} µs  ×{ratio:.2f}{mark}")
+    print(f"Регрессий: {regressions} (порог {args.threshold:.0%})")
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Микробенчмарки InventoryBot")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    run = sub.add_parser("run", help="прогнать бенчмарки и сохранить JSON")
+    run.add_argument("--scales", type=int, nargs="*", default=[10000, 100000],
+                     help="размеры синтетических каталогов")
+    run.add_argument("--users", type=int, default=10000, help="игроков в хранилище")
+    run.add_argument("-o", "--output", help="куда сохранить результаты")
+    run.set_defaults(func=cmd_run)
+
+    cmp_ = sub.add_parser("compare", help="сравнить два файла результатов")
+    cmp_.add_argument("base")
+    cmp_.add_argument("new")
+    cmp_.add_argument("--threshold", type=float, default=0.2,
+                      help="допустимое замедление (0.2 = 20%%)")
+    cmp_.set_defaults(func=cmd_compare)
+
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+# bulk_import.py — массовый импорт предметов из файла (CSV / JSON / текст)
+#
+# Форматы:
+#   текст — строка на предмет: «[Категория] Название: описание x3»
+#           (категория, описание и количество необязательны);
+#   CSV   — колонки name, category, qty, description (или по-русски:
+#           название, категория, количество, описание), разделитель , или ;
+#           без заголовка — те же колонки по порядку;
+#   JSON  — список строк или объектов с теми же полями,
+#           либо {категория: [названия]} как в старом inventory_data.json.
+
+import csv
+import io
+import json
+import re
+
+from rapidfuzz import fuzz, process
+
+import item_catalog
+from prefix_trie import normalize
+
+FUZZY_CUTOFF = 75            # как в find_closest_item
+DEFAULT_CATEGORY = "Снаряжение"
+MAX_QTY = 999                # больше в одной строке — почти наверняка опечатка
+
+_FIELDS = {
+    "name": "name", "название": "name", "предмет": "name",
+    "category": "category", "категория": "category",
+    "qty": "qty", "count": "qty", "количество": "qty", "кол-во": "qty",
+    "description": "desc", "desc": "desc", "описание": "desc",
+}
+_QTY_RE = re.compile(r"\s*[x×х]\s*(\d+)\s*$", re.IGNORECASE)
+_CAT_RE = re.compile(r"^\[([^\]]+)\]\s*")
+
+
+class ImportRow:
+    __slots__ = ("name", "category", "qty", "desc", "ref", "kind", "score")
+
+    def __init__(self, name: str, category: str | None = None, qty: int = 1, desc: str | None = None):
+        self.name = name
+        self.category = category
+        self.qty = qty
+        self.desc = desc
+        self.ref: str | None = None
+        self.kind = "custom"          # exact | fuzzy | custom
+        self.score = 0.0
+
+
+# --------- Разбор файла ---------
+
+def _qty(v) -> int:
+    try:
+        return min(MAX_QTY, max(1, int(str(v).strip())))
+    except (TypeError, ValueError):
+        return 1
+
+
+def _row(obj) -> ImportRow | None:
+    if isinstance(obj, str):
+        return parse_line(obj)
+    if not isinstance(obj, dict):
+        return None
+    f = {_FIELDS[k.strip().lower()]: v for k, v in obj.items() if k and k.strip().lower() in _FIELDS}
+    name = str(f.get("name") or "").strip()
+    if not name:
+        return None
+    return ImportRow(name, (f.get("category") or "").strip() or None, _qty(f.get("qty", 1)),
+                     (f.get("desc") or "").strip() or None)
+
+
+def parse_line(line: str) -> ImportRow | None:
+    s = line.strip().lstrip("-•*⭐ ").strip()
+    if not s or s.startswith("#"):
+        return None
+    cat = None
+    m = _CAT_RE.match(s)
+    if m:
+        cat, s = m.group(1).strip(), s[m.end():]
+    qty = 1
+    m = _QTY_RE.search(s)
+    if m:
+        qty, s = _qty(m.group(1)), s[: m.start()]
+    name, _, desc = s.partition(":")
+    name = name.strip()
+    return ImportRow(name, cat, qty, desc.strip() or None) if name else None
+
+
+def _parse_json(data) -> list[ImportRow]:
+    if isinstance(data, dict):
+        rows = [ImportRow(str(n).strip(), cat) for cat, lst in data.items() for n in (lst or [])]
+        return [r for r in rows if r.name]
+    if not isinstance(data, list):
+        raise ValueError("ожидался список или объект")
+    return [r for r in map(_row, data) if r]
+
+
+def parse_file(filename: str, raw: bytes) -> list[ImportRow]:
+    text = raw.decode("utf-8-sig", errors="replace")
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+    if ext == "json":
+        return _parse_json(json.loads(text))
+    if ext not in ("csv", "txt") and text.lstrip()[:1] in ("[", "{"):
+        try:
+            return _parse_json(json.loads(text))
+        except ValueError:
+            pass          # «[Оружие] Кинжал» — это текст, а не JSON
+
+    if ext == "csv":
+        try:
+            dialect = csv.Sniffer().sniff(text[:2048], delimiters=",;\t")
+        except csv.Error:       # одна колонка — разделитель не угадать
+            dialect = csv.excel
+        reader = csv.reader(io.StringIO(text), dialect)
+        head = next(reader, [])
+        if any(h.strip().lower() in _FIELDS for h in head):
+            cols = [h.strip() for h in head]
+        else:
+            cols = ["name", "category", "qty", "description"][: len(head)]
+            reader = csv.reader(io.StringIO(text), dialect)
+        return [r for r in (_row(dict(zip(cols, rec))) for rec in reader if rec) if r]
+
+    return [r for r in map(parse_line, text.splitlines()) if r]
+
+
+# --------- Сопоставление с каталогом ---------
+
+def match_rows(rows: list[ImportRow]) -> list[ImportRow]:
+    """
+    Точные совпадения — по индексу имён; остальные строки сопоставляются
+    пакетным process.cdist: с категорией — только против своей библиотеки
+    (магической или обычной, как find_closest_item), без категории — против всего каталога.
+    """
+    pending = []
+    for r in rows:
+        magic = r.category == "Магический предмет"
+        it = item_catalog.find_exact(r.name, magic) or item_catalog.find_exact(r.name, not magic)
+        if it:
+            r.ref, r.kind, r.score = it["id"], "exact", 100.0
+        else:
+            pending.append(r)
+    if not pending:
+        return rows
+
+    groups: dict[str, list[ImportRow]] = {}
+    for r in pending:
+        lib = "all" if not r.category else "magic" if "маг" in r.category.lower() else "nonmagic"
+        groups.setdefault(lib, []).append(r)
+    for lib, group in groups.items():
+        catalog = {
+            "magic": item_catalog.MAGIC,
+            "nonmagic": item_catalog.NONMAGIC,
+            "all": item_catalog.MAGIC + item_catalog.NONMAGIC,
+        }[lib]
+        if not catalog:
+            continue
+        choices = [normalize(it["name"].split(" / ")[0]) for it in catalog]
+        queries = [normalize(r.name) for r in group]
+        scores = process.cdist(queries, choices, scorer=fuzz.WRatio, score_cutoff=FUZZY_CUTOFF, workers=-1)
+        for r, row in zip(group, scores):
+            best = int(row.argmax())
+            if row[best] >= FUZZY_CUTOFF:
+                r.ref, r.kind, r.score = catalog[best]["id"], "fuzzy", float(row[best])
+    return rows
+
+
+def summary(rows: list[ImportRow], limit: int = 15) -> str:
+    """Текст сводки: сколько точных/похожих/своих и примеры похожих."""
+    by_kind = {"exact": [], "fuzzy": [], "custom": []}
+    for r in rows:
+        by_kind[r.kind].append(r)
+    lines = [
+        f"📥 Строк: {len(rows)}",
+        f"✅ Точно: {len(by_kind['exact'])}",
+        f"🤔 Похоже: {len(by_kind['fuzzy'])}",
+        f"⭐ Свои: {len(by_kind['custom'])}",
+    ]
+    if by_kind["fuzzy"]:
+        lines.append("\nПохожие (проверь):")
+        for r in by_kind["fuzzy"][:limit]:
+            title = item_catalog.get_item(r.ref)["name"].split(" / ")[0]
+            lines.append(f"• {r.name} → {title} ({r.score:.0f}%)")
+        if len(by_kind["fuzzy"]) > limit:
+            lines.append(f"… и ещё {len(by_kind['fuzzy']) - limit}")
+    if by_kind["custom"]:
+        lines.append("\nНе найдены, будут своими:")
+        lines += [f"• {r.name}" for r in by_kind["custom"][:limit]]
+        if len(by_kind["custom"]) > limit:
+            lines.append(f"… и ещё {len(by_kind['custom']) - limit}")
+    return "\n".join(lines)
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+# campaigns.py — кампании: свой мастер, состав игроков и файл-шард с инвентарями
+#
+# Реестр кампаний (campaigns.json) маленький и читается целиком при старте.
+# Шард кампании — JSON того же вида, что и inventory_data.json; он читается
+# при первом обращении, держится в памяти и выгружается после простоя.
+# Перед каждым чтением сверяются mtime/размер/inode файла, так что правка шарда
+# другим процессом подхватывается без перезапуска. Запись «прочитать — поправить —
+# сохранить» идёт под файловой блокировкой (Shard.alock), чтобы несколько процессов
+# бота (worker_pool.py) не теряли правки друг друга.
+
+import asyncio
+import contextlib
+import json
+import os
+import secrets
+import time
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:         # Windows: один процесс, блокировка не нужна
+    fcntl = None
+
+import metrics
+import storage_codec
+
+DEFAULT_CAMPAIGN = "main"
+
+
+def _lock_file(path: Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path.with_name(f".{path.name}.lock"), "a")
+
+
+@contextlib.contextmanager
+def file_lock(path: Path):
+    """Эксклюзивная блокировка между процессами на файле-спутнике .<имя>.lock."""
+    if fcntl is None:
+        yield
+        return
+    with _lock_file(path) as fp:
+        t0 = time.perf_counter()
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        metrics.STORAGE_SECONDS.observe(time.perf_counter() - t0, op="lock")
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+@contextlib.asynccontextmanager
+async def file_lock_async(path: Path):
+    """
+    То же для обработчиков: свободная блокировка берётся сразу, а занятую
+    другим процессом ждёт поток — цикл событий тем временем обслуживает других.
+    Внутри блока не должно быть await: блокировку держит весь процесс.
+    """
+    if fcntl is None:
+        yield
+        return
+    with _lock_file(path) as fp:
+        t0 = time.perf_counter()
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            await asyncio.to_thread(fcntl.flock, fp, fcntl.LOCK_EX)
+        metrics.STORAGE_SECONDS.observe(time.perf_counter() - t0, op="lock")
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _file_stamp(path: Path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class Shard:
+    """Файл инвентарей одной кампании с ленивой загрузкой и записью насквозь."""
+
+    __slots__ = ("_path", "codec", "disk_codec", "data", "stamp", "last_used", "generation")
+
+    def __init__(self, path, codec: str = storage_codec.DEFAULT):
+        self._path = path          # Path или функция без аргументов, возвращающая Path
+        self.codec = storage_codec.get(codec)     # чем писать
+        self.disk_codec: storage_codec.Codec | None = None     # чем записан файл сейчас
+        self.data: dict | None = None
+        self.stamp = None
+        self.last_used = 0.0
+        self.generation = 0        # растёт при каждом чтении с диска (не при своей записи)
+
+    @property
+    def path(self) -> Path:
+        return Path(self._path() if callable(self._path) else self._path)
+
+    _stat = staticmethod(_file_stamp)
+
+    def lock(self):
+        """Блокировка шарда на время чтения и записи: with shard.lock(): load() … save()."""
+        return file_lock(self.path)
+
+    def alock(self):
+        """То же из цикла событий: async with shard.alock(): load() … save()."""
+        return file_lock_async(self.path)
+
+    def load(self) -> dict:
+        self.last_used = time.monotonic()
+        path = self.path
+        stamp = self._stat(path)
+        if self.data is not None and stamp == self.stamp:
+            return self.data
+        self.generation += 1
+        if stamp is None:
+            self.data = {}
+        else:
+            t0 = time.perf_counter()
+            raw = path.read_bytes()
+            # формат — по содержимому: старый JSON с отступами читается и после
+            # смены STORAGE_CODEC, а при записи переписывается в новом
+            self.disk_codec = storage_codec.detect(raw)
+            self.data = self.disk_codec.decode(raw)
+            metrics.STORAGE_SECONDS.observe(time.perf_counter() - t0, op="read")
+            metrics.STORAGE_BYTES.inc(len(raw), op="read")
+        self.stamp = stamp
+        return self.data
+
+    def save(self, data: dict):
+        t0 = time.perf_counter()
+        # служебные ключи (_texts, _versions) — в начало: потоковое чтение
+        # (export.py) получает таблицу описаний раньше инвентарей
+        data = {k: data[k] for k in sorted(data, key=lambda k: not k.startswith("_"))}
+        raw = self.codec.encode(data)
+        path = self.path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            tmp.write_bytes(raw)
+            os.replace(tmp, path)  # читатели видят либо старый, либо новый файл целиком
+        except OSError:
+            self.evict()           # в памяти могли остаться незаписанные правки
+            raise
+        metrics.STORAGE_SECONDS.observe(time.perf_counter() - t0, op="write")
+        metrics.STORAGE_BYTES.inc(len(raw), op="write")
+        self.data, self.stamp, self.disk_codec = data, self._stat(path), self.codec
+        self.last_used = time.monotonic()
+
+    def evict(self):
+        self.data, self.stamp = None, None
+        self.generation += 1
+
+
+class Campaign:
+    __slots__ = ("cid", "title", "master_id", "players", "sim_player", "shard")
+
+    def __init__(self, cid: str, title: str, master_id: int, players: dict[str, int],
+                 sim_player: str | None, shard: Shard):
+        self.cid = cid
+        self.title = title
+        self.master_id = master_id
+        self.players = players          # имя -> Telegram id
+        self.sim_player = sim_player    # кому доступна симуляция
+        self.shard = shard
+
+    def is_master(self, uid: int) -> bool:
+        return uid == self.master_id
+
+    def player_name(self, uid: int) -> str | None:
+        for name, pid in self.players.items():
+            if pid == uid:
+                return name
+        return None
+
+    def members(self) -> set[int]:
+        return {self.master_id, *self.players.values()}
+
+    def to_json(self) -> dict:
+        return {
+            "title": self.title,
+            "master": self.master_id,
+            "players": self.players,
+            "simulation": self.sim_player,
+        }
+
+
+class Registry:
+    """
+    Все кампании процесса. Кампания по умолчанию собирается из констант бота
+    и хранит инвентари в прежнем inventory_data.json — старые установки
+    продолжают работать без миграции.
+    """
+
+    def __init__(self, path: Path, shard_dir: Path, default: Campaign, codec: str = storage_codec.DEFAULT):
+        self.path = Path(path)
+        self.shard_dir = Path(shard_dir)
+        self.codec = codec          # для шардов; сам campaigns.json — JSON, его правят руками
+        self.default = default
+        self.campaigns: dict[str, Campaign] = {default.cid: default}
+        self._by_user: dict[int, list[str]] = {}
+        self._roster: dict[int, set[str]] = {}       # мастер -> имена его игроков во всех кампаниях
+        self.stamp = False          # ещё не читали; None — файла нет
+        self.refresh()
+
+    def _read(self) -> dict:
+        self.stamp = _file_stamp(self.path)
+        if self.stamp is None:
+            return {}
+        return json.loads(self.path.read_text(encoding="utf-8"))
+
+    def refresh(self) -> bool:
+        """
+        Перечитывает campaigns.json, если его поменял другой процесс.
+        Уже загруженные шарды сохраняются: меняется только состав кампаний.
+        """
+        if _file_stamp(self.path) == self.stamp:
+            return False
+        for cid, obj in self._read().items():
+            self._put(cid, obj)
+        self._reindex()
+        return True
+
+    def _put(self, cid: str, obj: dict) -> Campaign:
+        old = self.campaigns.get(cid)
+        if old is not None:
+            shard = old.shard
+        elif cid == self.default.cid:
+            shard = self.default.shard
+        else:
+            shard = Shard(self.shard_dir / f"{cid}.json", self.codec)
+        camp = Campaign(cid, obj.get("title") or cid, int(obj["master"]),
+                        {n: int(p) for n, p in (obj.get("players") or {}).items()},
+                        obj.get("simulation"), shard)
+        self.campaigns[cid] = camp
+        if cid == self.default.cid:
+            self.default = camp
+        return camp
+
+    def _reindex(self):
+        self._by_user, self._roster = {}, {}
+        for camp in self.campaigns.values():
+            for uid in camp.members():
+                self._by_user.setdefault(uid, []).append(camp.cid)
+            self._roster.setdefault(camp.master_id, set()).update(camp.players)
+
+    def _persist(self, camp: Campaign):
+        """
+        Записывает кампанию camp. Файл перечитывается под блокировкой, так что
+        кампании, созданные или изменённые другим процессом, не затираются.
+        """
+        with file_lock(self.path):
+            data = self._read()
+            data[camp.cid] = camp.to_json()
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, self.path)
+            for cid, obj in data.items():
+                if cid != camp.cid:
+                    self._put(cid, obj)
+            self.stamp = _file_stamp(self.path)
+        self._reindex()
+
+    # --- поиск ---
+
+    def get(self, cid: str | None) -> Campaign | None:
+        return self.campaigns.get(cid) if cid else None
+
+    def of_user(self, uid: int) -> list[Campaign]:
+        return [self.campaigns[c] for c in self._by_user.get(uid, ())]
+
+    def for_user(self, uid: int, preferred: str | None = None) -> Campaign:
+        """Выбранная кампания, если пользователь в ней состоит, иначе первая его, иначе основная."""
+        cids = self._by_user.get(uid, ())
+        if preferred in cids:
+            return self.campaigns[preferred]
+        return self.campaigns[cids[0]] if cids else self.default
+
+    def mastered_names(self, uid: int) -> frozenset[str]:
+        """Имена игроков во всех кампаниях, где uid — мастер (только для чтения)."""
+        return frozenset(self._roster.get(uid, ()))
+
+    # --- изменение ---
+
+    def create(self, title: str, master_id: int) -> Campaign:
+        cid = "c" + secrets.token_hex(4)
+        while cid in self.campaigns:
+            cid = "c" + secrets.token_hex(4)
+        camp = self._put(cid, {"title": title, "master": master_id})
+        self._persist(camp)
+        return camp
+
+    def update(self, camp: Campaign):
+        """Сохраняет изменения состава кампании."""
+        self._persist(camp)
+
+    # --- память ---
+
+    def loaded(self) -> int:
+        return sum(1 for c in self.campaigns.values() if c.shard.data is not None)
+
+    def evict_idle(self, max_idle: float, now: float | None = None) -> list[str]:
+        """Выгружает из памяти шарды, к которым не обращались max_idle секунд."""
+        now = time.monotonic() if now is None else now
+        out = []
+        for camp in self.campaigns.values():
+            if camp.shard.data is not None and now - camp.shard.last_used > max_idle:
+                camp.shard.evict()
+                out.append(camp.cid)
+        return out
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+# catalog_columns.py — числовые колонки каталога (вес, цена, категория) в массивах NumPy
+#
+# Вес и цена разбираются из текста один раз при загрузке каталога
+# (item_catalog.parse_weight / parse_cost) и приводятся к общим единицам:
+# фунты (как в книгах и в сводке партии) и медные монеты. Фильтры по диапазону,
+# сортировка и суммарный вес дальше считаются векторно, без разбора строк на каждый запрос.
+# Категории — те же, что у инвентаря (InventoryBot.ITEMS), а не сырые из каталога.
+
+import re
+
+import numpy as np
+
+LB_KG = 0.45          # «фнт.» в русских книгах ≈ 0,45 кг
+GP_CP = 100           # 1 зм = 100 мм
+MAGIC_CATEGORY = "Магический предмет"
+# категория каталога -> категория инвентаря, где они называются по-разному
+CATEGORY_ALIASES = {"Наборы": "Наборы снаряжения"}
+
+
+def inventory_category(item: dict) -> str:
+    cat = item.get("category") or MAGIC_CATEGORY
+    return CATEGORY_ALIASES.get(cat, cat)
+
+
+class CatalogColumns:
+    """Строка i — предмет items[i]; неизвестный вес/цена — NaN."""
+
+    def __init__(self, items: list[dict], weights_lb: dict[str, float], costs_gp: dict[str, float]):
+        self.items = items
+        self.row = {it["id"]: i for i, it in enumerate(items)}
+        cats = [inventory_category(it) for it in items]
+        self.categories = sorted(set(cats))
+        code = {c: i for i, c in enumerate(self.categories)}
+        self.cat_code = np.array([code[c] for c in cats], dtype=np.int16)
+        self.weight_lb = np.array([weights_lb.get(it["id"], np.nan) for it in items], dtype=np.float64)
+        self.cost_cp = np.array([costs_gp.get(it["id"], np.nan) for it in items], dtype=np.float64) * GP_CP
+
+    def __len__(self):
+        return len(self.items)
+
+    def category_code(self, name: str) -> int | None:
+        try:
+            return self.categories.index(name)
+        except ValueError:
+            return None
+
+    def select(self, category: str | None = None, weight=(None, None), cost=(None, None),
+               rows: np.ndarray | None = None, sort: str | None = None, desc: bool = False) -> np.ndarray:
+        """
+        Номера строк, прошедших фильтры. weight — (от, до) в фунтах, cost — в мм,
+        rows — ограничить набором строк (например, предметами игрока).
+        sort: "weight" | "cost" | None; неизвестные значения — в конце.
+        """
+        mask = np.ones(len(self.items), dtype=bool)
+        if rows is not None:
+            only = np.zeros_like(mask)
+            only[rows] = True
+            mask &= only
+        if category is not None:
+            mask &= self.cat_code == self.category_code(category)
+        for col, (lo, hi) in ((self.weight_lb, weight), (self.cost_cp, cost)):
+            if lo is not None:
+                mask &= col >= lo
+            if hi is not None:
+                mask &= col <= hi
+        found = np.flatnonzero(mask)
+        if sort:
+            col = (self.weight_lb if sort == "weight" else self.cost_cp)[found]
+            key = np.where(np.isnan(col), np.inf, -col if desc else col)
+            found = found[np.argsort(key, kind="stable")]
+        return found
+
+    def rows_of(self, refs) -> np.ndarray:
+        return np.array([self.row[r] for r in refs if r in self.row], dtype=np.int64)
+
+    def total_weight(self, refs: list[str], qtys: list[int]) -> tuple[float, int]:
+        """Суммарный вес (фунты) и число предметов без известного веса."""
+        pairs = [(self.row[r], q) for r, q in zip(refs, qtys) if r in self.row]
+        if not pairs:
+            return 0.0, sum(qtys)
+        rows, q = np.array(pairs, dtype=np.int64).T
+        w = self.weight_lb[rows]
+        known = ~np.isnan(w)
+        unknown = int(q[~known].sum()) + (sum(qtys) - int(q.sum()))
+        return float(np.dot(w[known], q[known])), unknown
+
+
+# --------- Разбор запроса ---------
+
+_COND_RE = re.compile(
+    r"(вес|цена)\s*(<=|>=|<|>|=)\s*(\d+(?:[.,]\d+)?)\s*(кг|фнт|зм|см|мм|пм|эм)?",
+    re.IGNORECASE,
+)
+_SORT_RE = re.compile(r"(?:сорт|sort)[:=]?\s*(-)?(вес|цена)", re.IGNORECASE)
+_UNITS = {"фнт": 1.0, "кг": 1 / LB_KG, "мм": 1.0, "см": 10.0, "эм": 50.0, "зм": 100.0, "пм": 1000.0}
+
+
+def parse_query(text: str, categories: list[str]) -> dict:
+    """
+    «оружие вес<2 цена<=10зм сорт:-вес мой» -> аргументы select.
+    Вес без единиц — в фунтах, цена — в зм; «мой» — только предметы своего инвентаря.
+    """
+    q = {"category": None, "weight": [None, None], "cost": [None, None], "sort": None, "desc": False, "mine": False}
+    for m in _COND_RE.finditer(text):
+        field, op, num, unit = m.group(1).lower(), m.group(2), float(m.group(3).replace(",", ".")), (m.group(4) or "").lower()
+        if field == "вес":
+            key, value = "weight", num * _UNITS.get(unit, 1.0)
+        else:
+            key, value = "cost", num * _UNITS.get(unit, 100.0)
+        if op in ("<", "<=", "="):
+            q[key][1] = np.nextafter(value, -np.inf) if op == "<" else value
+        if op in (">", ">=", "="):
+            q[key][0] = np.nextafter(value, np.inf) if op == ">" else value
+    m = _SORT_RE.search(text)
+    if m:
+        q["sort"] = "weight" if m.group(2).lower() == "вес" else "cost"
+        q["desc"] = bool(m.group(1))
+    rest = _SORT_RE.sub(" ", _COND_RE.sub(" ", text)).lower().split()
+    q["mine"] = "мой" in rest or "мои" in rest
+    words = " ".join(w for w in rest if w not in ("мой", "мои"))
+    if words:
+        q["category"] = next((c for c in categories if c.lower().startswith(words)), None) or words
+    q["weight"], q["cost"] = tuple(q["weight"]), tuple(q["cost"])
+    return q
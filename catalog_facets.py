@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# catalog_facets.py — просмотр каталога по фасетам на битовых масках
+#
+# Для каждого значения каждого фасета при загрузке каталога строится битовая маска
+# (обычный int: бит i — предмет items[i]). Отбор по нескольким фасетам — это AND
+# масок, а счётчик «сколько предметов будет, если выбрать значение» — popcount
+# пересечения, без прохода по списку предметов.
+
+import re
+
+MAGIC_CATEGORY = "Магический предмет"
+
+# код (для callback_data) -> (поле, подпись)
+FACETS = {
+    "c": ("category", "Категория"),
+    "r": ("rarity", "Редкость"),
+    "t": ("tier", "Тир"),
+    "s": ("source", "Источник"),
+    "a": ("attunement", "Настройка"),
+}
+
+_ATTUNE_RE = re.compile(r"\(требуется настройка", re.IGNORECASE)
+
+
+def facet_values(item: dict) -> dict[str, list[str]]:
+    """Значения фасетов предмета; у немагических нет редкости, тира, источника и настройки."""
+    if item.get("category"):
+        return {"category": [item["category"]]}
+    parts = [p.strip() for p in (item.get("name") or "").split(" / ")]
+    first_line = (item.get("description") or "").split("\n", 1)[0]
+    out = {
+        "category": [MAGIC_CATEGORY],
+        "attunement": ["требуется" if _ATTUNE_RE.search(first_line) else "не требуется"],
+    }
+    if item.get("rarity"):
+        out["rarity"] = [item["rarity"]]
+    if item.get("tier"):
+        out["tier"] = [item["tier"]]
+    if len(parts) > 2:
+        out["source"] = [s.strip() for s in parts[2].split(", ") if s.strip()]
+    return out
+
+
+def iter_bits(mask: int, skip: int = 0):
+    """Номера установленных битов по возрастанию, начиная с (skip+1)-го."""
+    while mask:
+        low = mask & -mask
+        if skip:
+            skip -= 1
+        else:
+            yield low.bit_length() - 1
+        mask ^= low
+
+
+class FacetIndex:
+    def __init__(self, items: list[dict]):
+        self.items = items
+        self.all = (1 << len(items)) - 1
+        rows: dict[str, dict[str, list[int]]] = {f: {} for f, _ in FACETS.values()}
+        for i, it in enumerate(items):
+            for field, values in facet_values(it).items():
+                for v in values:
+                    rows[field].setdefault(v, []).append(i)
+        self.bits: dict[str, dict[str, int]] = {
+            field: {v: sum(1 << i for i in idx) for v, idx in vals.items()}
+            for field, vals in rows.items()
+        }
+        # значения фасета — от частых к редким; порядок задаёт номера в callback_data
+        self.values: dict[str, list[str]] = {
+            field: sorted(vals, key=lambda v: (-len(vals[v]), v)) for field, vals in rows.items()
+        }
+
+    def mask(self, selected: dict[str, str], without: str | None = None) -> int:
+        m = self.all
+        for field, value in selected.items():
+            if field != without:
+                m &= self.bits[field].get(value, 0)
+        return m
+
+    def counts(self, field: str, selected: dict[str, str]) -> list[tuple[str, int]]:
+        """(значение, сколько предметов) при остальных выбранных фильтрах; нулевые опущены."""
+        base = self.mask(selected, without=field)
+        out = []
+        for v in self.values[field]:
+            n = (base & self.bits[field][v]).bit_count()
+            if n:
+                out.append((v, n))
+        return out
+
+    def page(self, mask: int, page: int, per_page: int) -> list[dict]:
+        found = []
+        for i in iter_bits(mask, page * per_page):
+            found.append(self.items[i])
+            if len(found) == per_page:
+                break
+        return found
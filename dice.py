@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# dice.py — кости: разбор выражений и броски пачками
+#
+#   «2к6+3», «к20», «d100», «4к6кв3» (три высших из четырёх), «2к20кн1» (низший),
+#   «к20 пр» / «к20 преимущество» и «к20 пом» / «к20 помеха» — для первого к20.
+#
+# Выражение разбирается один раз в Expr (кеш parse); Expr.roll(n) бросает n раз
+# сразу — по матрице костей NumPy, Expr.total() — один бросок через random
+# (им пользуется симуляция: random.seed по-прежнему воспроизводит дни).
+
+import functools
+import random
+import re
+from typing import NamedTuple
+
+import numpy as np
+
+MAX_DICE = 1000             # костей в одном слагаемом
+MAX_SIDES = 1000
+MAX_TERMS = 20
+MAX_BATCH_DICE = 2_000_000  # бросков × костей за один вызов roll
+MAX_CONST = 1_000_000       # модификатор по модулю (и для int64 в roll)
+MAX_SHOWN_DICE = 20         # в format_detail: больше костей в слагаемом — только сумма
+
+_ADV_RE = re.compile(r"\b(преим\w*|пр|adv|advantage)\b")
+_DIS_RE = re.compile(r"\b(помех\w*|пом|dis|disadvantage)\b")
+_TERM_RE = re.compile(
+    r"([+-])?(?:(\d*)[кdд](\d+|%)(?:(kh|kl|кв|кн)(\d+))?|(\d+))"
+)
+
+
+class Term(NamedTuple):
+    sign: int       # +1 / -1
+    count: int
+    sides: int
+    keep: int       # сколько костей оставить; равно count — все
+    high: bool      # оставлять высшие (иначе низшие)
+
+    def __str__(self):
+        s = f"{self.count if self.count > 1 else ''}к{self.sides}"
+        if self.keep < self.count:
+            s += f"{'кв' if self.high else 'кн'}{self.keep}"
+        return s
+
+
+class Expr:
+    """Разобранное выражение: сумма слагаемых-костей и константы."""
+
+    __slots__ = ("terms", "const")
+
+    def __init__(self, terms: tuple[Term, ...], const: int):
+        self.terms = terms
+        self.const = const
+
+    def __str__(self):
+        parts = []
+        for t in self.terms:
+            parts.append(("-" if t.sign < 0 else "+") + str(t))
+        if self.const:
+            parts.append(f"{self.const:+d}")
+        return "".join(parts).lstrip("+") or "0"
+
+    @property
+    def dice(self) -> int:
+        return sum(t.count for t in self.terms)
+
+    @property
+    def min(self) -> int:
+        return self.const + sum(t.sign * (t.keep if t.sign > 0 else t.keep * t.sides) for t in self.terms)
+
+    @property
+    def max(self) -> int:
+        return self.const + sum(t.sign * (t.keep * t.sides if t.sign > 0 else t.keep) for t in self.terms)
+
+    def crit(self) -> "Expr":
+        """Критическое попадание: кости удваиваются, модификатор — нет."""
+        return Expr(tuple(t._replace(count=t.count * 2, keep=t.keep * 2) for t in self.terms), self.const)
+
+    def roll(self, n: int, rng: np.random.Generator | None = None) -> np.ndarray:
+        """n бросков выражения целиком, вектор int64."""
+        if n * max(1, self.dice) > MAX_BATCH_DICE:
+            raise ValueError(f"слишком много костей за раз (больше {MAX_BATCH_DICE})")
+        rng = rng or _RNG
+        out = np.full(n, self.const, dtype=np.int64)
+        for t in self.terms:
+            a = rng.integers(1, t.sides + 1, size=(n, t.count), dtype=np.int64)
+            if t.keep == t.count:
+                s = a.sum(axis=1)
+            elif t.keep == 1:
+                s = a.max(axis=1) if t.high else a.min(axis=1)
+            else:
+                a.sort(axis=1)
+                s = (a[:, -t.keep:] if t.high else a[:, :t.keep]).sum(axis=1)
+            out += t.sign * s
+        return out
+
+    def roll_detail(self, rnd: random.Random | None = None) -> tuple[int, list[tuple[Term, list[int], list[int]]]]:
+        """Один бросок с костями: (итог, [(слагаемое, оставленные, отброшенные)])."""
+        rnd = rnd or random
+        total, detail = self.const, []
+        for t in self.terms:
+            vals = [rnd.randint(1, t.sides) for _ in range(t.count)]
+            order = sorted(range(t.count), key=vals.__getitem__, reverse=t.high)
+            kept = set(order[:t.keep])
+            detail.append((t, [v for i, v in enumerate(vals) if i in kept],
+                           [v for i, v in enumerate(vals) if i not in kept]))
+            total += t.sign * sum(vals[i] for i in kept)
+        return total, detail
+
+    def total(self, rnd: random.Random | None = None) -> int:
+        """Один бросок без подробностей; для одиночной кости — просто randint."""
+        rnd = rnd or random
+        if len(self.terms) == 1 and self.terms[0].count == 1:
+            t = self.terms[0]
+            return self.const + t.sign * rnd.randint(1, t.sides)
+        return self.roll_detail(rnd)[0]
+
+
+_RNG = np.random.default_rng()
+
+
+@functools.lru_cache(maxsize=512)
+def parse(text: str) -> Expr:
+    """
+    «2к6+3», «к20 пр», «4к6кв3» -> Expr. ValueError, если не разобрать
+    или выражение больше лимитов (MAX_DICE, MAX_SIDES, MAX_TERMS).
+    """
+    s = (text or "").lower().replace("−", "-").replace("ё", "е")
+    adv, dis = bool(_ADV_RE.search(s)), bool(_DIS_RE.search(s))
+    if adv and dis:
+        adv = dis = False       # по правилам взаимно гасятся
+    s = re.sub(r"\s+", "", _DIS_RE.sub("", _ADV_RE.sub("", s)))
+    if not s:
+        raise ValueError("пустое выражение")
+
+    terms, const, pos = [], 0, 0
+    while pos < len(s):
+        m = _TERM_RE.match(s, pos)
+        if not m or (pos and not m.group(1)):
+            raise ValueError(f"не понимаю «{s[pos:]}»")
+        pos = m.end()
+        sign = -1 if m.group(1) == "-" else 1
+        if m.group(6) is not None:
+            const += sign * int(m.group(6))
+            if abs(const) > MAX_CONST:
+                raise ValueError(f"модификатор больше {MAX_CONST}")
+            continue
+        count = int(m.group(2) or 1)
+        sides = 100 if m.group(3) == "%" else int(m.group(3))
+        keep = int(m.group(5)) if m.group(5) else count
+        high = m.group(4) in (None, "kh", "кв")
+        if not (1 <= count <= MAX_DICE and 2 <= sides <= MAX_SIDES and 1 <= keep <= count):
+            raise ValueError(f"кости вне пределов: {m.group(0).lstrip('+-')}")
+        terms.append(Term(sign, count, sides, keep, high))
+    if len(terms) > MAX_TERMS:
+        raise ValueError(f"больше {MAX_TERMS} слагаемых")
+
+    if adv or dis:
+        for i, t in enumerate(terms):
+            if t.sides == 20 and t.count == 1:
+                terms[i] = Term(t.sign, 2, 20, 1, adv)
+                break
+        else:
+            raise ValueError("преимущество и помеха — только для к20")
+    return Expr(tuple(terms), const)
+
+
+def format_detail(expr: Expr, total: int, detail) -> str:
+    """
+    «2к6+3: [4, 2] + 3 = 9»; отброшенные кости — в скобках. Слагаемое больше
+    MAX_SHOWN_DICE костей показывается суммой: «[Σ 10480 из 1000]».
+    """
+    parts = []
+    for t, kept, dropped in detail:
+        if t.count > MAX_SHOWN_DICE:
+            dice = f"Σ {sum(kept)} из {t.count}"
+        else:
+            dice = ", ".join([str(v) for v in kept] + [f"({v})" for v in dropped])
+        parts.append((t.sign, f"[{dice}]"))
+    if expr.const:
+        parts.append((1 if expr.const > 0 else -1, str(abs(expr.const))))
+    s = ""
+    for i, (sign, p) in enumerate(parts):
+        s += ("−" if sign < 0 else "") + p if i == 0 else f" {'−' if sign < 0 else '+'} {p}"
+    return f"{expr}: {s} = {total}"
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# export.py — потоковая выгрузка всех инвентарей в JSONL / CSV
+#
+#   python export.py [--format jsonl|csv] [-o out.csv] [--campaign ID | --data inventory_data.json]
+#
+# Файл хранилища читается по кускам: в памяти одновременно один инвентарь,
+# таблица описаний и буфер чтения, сколько бы игроков ни было
+# (если шард в JSON; двоичный msgpack-шард читается целиком).
+
+import contextlib
+import csv
+import io
+import json
+import sys
+
+import item_catalog
+import storage_codec
+from inventory_model import Inventory
+
+CHUNK = 64 * 1024
+FIELDS = [
+    "user_id", "player", "category", "entry_id", "qty", "name", "custom",
+    "ref", "rarity", "tier", "catalog_category", "description",
+]
+
+_WS = " \t\r\n"
+_NUM = "0123456789.eE+-"
+
+
+# --------- Потоковое чтение JSON-объекта верхнего уровня ---------
+
+def iter_object_items(fp, chunk: int = CHUNK):
+    """
+    (ключ, значение) из файла вида {"k": {...}, ...} без загрузки всего файла.
+    Значение разбирается целиком, поэтому память ~ самое большое значение + chunk.
+    Недоразобранное значение дочитывается, пока буфер не вырастет вдвое, — большое
+    значение разбирается O(log) раз, а не по разу на каждый кусок.
+    """
+    dec = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def more(at_least: int = 1) -> bool:
+        nonlocal buf, pos, eof
+        parts, got = [], 0
+        while got < at_least:
+            data = fp.read(chunk)
+            if not data:
+                eof = True
+                break
+            parts.append(data)
+            got += len(data)
+        if not parts:
+            return False
+        buf, pos = buf[pos:] + "".join(parts), 0
+        return True
+
+    def skip(chars: str):
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in chars:
+                pos += 1
+            if pos < len(buf) or not more():
+                return
+
+    def decode():
+        nonlocal pos
+        while True:
+            try:
+                val, end = dec.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof or not more(max(1, len(buf) - pos)):
+                    raise
+                continue
+            # число могло оборваться на границе куска («-1500.» -> -1500) — дочитаем и разберём заново
+            if not eof and not buf[end:].lstrip(_NUM) and more():
+                continue
+            pos = end
+            return val
+
+    skip(_WS)
+    if pos >= len(buf):
+        return
+    if buf[pos] != "{":
+        raise ValueError("ожидался JSON-объект")
+    pos += 1
+    while True:
+        skip(_WS + ",")
+        if pos >= len(buf) or buf[pos] == "}":
+            return
+        key = decode()
+        skip(_WS + ":")
+        yield key, decode()
+
+
+def iter_file_items(path):
+    """
+    (ключ, значение) файла хранилища. JSON читается потоком; двоичный формат
+    (storage_codec, например msgpack) потоком не разобрать — он читается целиком.
+    """
+    with open(path, "rb") as fp:
+        binary = storage_codec.is_binary(fp.read(len(storage_codec.MAGIC)))
+    if binary:
+        yield from storage_codec.load_file(path).items()
+        return
+    with open(path, encoding="utf-8") as fp:
+        yield from iter_object_items(fp)
+
+
+# --------- Строки выгрузки ---------
+
+def load_texts(path) -> dict:
+    """Таблица описаний "_texts"; при записи она идёт первой, так что поиск короткий."""
+    for key, val in iter_file_items(path):
+        if key == "_texts":
+            return val
+    return {}
+
+
+def export_rows(path, names: dict[int, str] | None = None, categories=()):
+    """Генератор строк выгрузки: одна строка на запись инвентаря, с данными каталога."""
+    names = names or {}
+    texts = load_texts(path)
+    for key, obj in iter_file_items(path):
+        if key.startswith("_") or not isinstance(obj, dict):
+            continue
+        inv = Inventory.from_json(obj, categories, texts)
+        for cat, entries in inv.items():
+            for e in entries:
+                it = e.item or {}
+                yield {
+                    "user_id": key,
+                    "player": names.get(int(key), "") if key.isdigit() else "",
+                    "category": cat,
+                    "entry_id": e.eid,
+                    "qty": e.qty,
+                    "name": e.title,
+                    "custom": e.ref is None,
+                    "ref": e.ref or "",
+                    "rarity": it.get("rarity") or "",
+                    "tier": it.get("tier") or "",
+                    "catalog_category": it.get("category") or ("Магический предмет" if it else ""),
+                    "description": e.description or "",
+                }
+
+
+def iter_jsonl(rows):
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def iter_csv(rows):
+    out = io.StringIO()
+    w = csv.DictWriter(out, FIELDS)
+    w.writeheader()
+    for row in rows:
+        w.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
+
+FORMATS = {"jsonl": iter_jsonl, "csv": iter_csv}
+
+
+def write_export(fp, path, fmt: str = "jsonl", names=None, categories=()) -> int:
+    """Пишет выгрузку в открытый текстовый файл, возвращает число записей."""
+    n = 0
+
+    def counted():
+        nonlocal n
+        for row in export_rows(path, names, categories):
+            n += 1
+            yield row
+
+    for chunk in FORMATS[fmt](counted()):
+        fp.write(chunk)
+    return n
+
+
+# --------- CLI ---------
+
+def main(argv=None):
+    import argparse
+    import InventoryBot as bot
+
+    ap = argparse.ArgumentParser(description="Выгрузка всех инвентарей")
+    ap.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    ap.add_argument("-o", "--output", help="файл (по умолчанию stdout)")
+    ap.add_argument("--campaign", default=None, help="id кампании (по умолчанию основная)")
+    ap.add_argument("--data", default=None, help="файл хранилища (вместо шарда кампании)")
+    args = ap.parse_args(argv)
+
+    camp = bot.CAMPAIGNS.get(args.campaign) if args.campaign else bot.CAMPAIGNS.default
+    if camp is None:
+        ap.error(f"нет кампании {args.campaign}")
+    data = args.data or camp.shard.path
+
+    with contextlib.redirect_stdout(sys.stderr):     # stdout — под выгрузку
+        item_catalog.init_catalogs(str(bot.DATA_DIR))
+    names = {pid: name for name, pid in camp.players.items()}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8", newline="") as fp:
+            n = write_export(fp, data, args.format, names, bot.ITEMS)
+    else:
+        n = write_export(sys.stdout, data, args.format, names, bot.ITEMS)
+    print(f"📤 Выгружено записей: {n}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# handler_hooks.py — обход зарегистрированных обработчиков и обёртка их колбэков
+# (замеры, метрики, профилирование — без правки самих обработчиков)
+
+import functools
+
+from telegram.ext import ConversationHandler
+
+
+def iter_handlers(app):
+    """
+    Все «листовые» обработчики приложения, включая вложенные в ConversationHandler.
+    Отдаёт (handler, label), где label — "<разговор>:<состояние>" или "<группа>".
+    """
+    for group, handlers in sorted(app.handlers.items()):
+        for h in handlers:
+            yield from _walk(h, f"group{group}")
+
+
+def _walk(handler, where):
+    if isinstance(handler, ConversationHandler):
+        name = handler.name or "conv"
+        for h in handler.entry_points:
+            yield from _walk(h, f"{name}:entry")
+        for state, hs in handler.states.items():
+            for h in hs:
+                yield from _walk(h, f"{name}:{state}")
+        for h in handler.fallbacks:
+            yield from _walk(h, f"{name}:fallback")
+    else:
+        yield handler, where
+
+
+def callback_name(callback) -> str:
+    return getattr(callback, "__name__", type(callback).__name__)
+
+
+def wrap_callbacks(app, wrapper):
+    """
+    Подменяет callback каждого обработчика на wrapper(callback, label).
+    label — "<имя колбэка>@<разговор>:<состояние>".
+    Один и тот же объект обработчика оборачивается один раз.
+    """
+    seen = set()
+    for handler, where in iter_handlers(app):
+        if id(handler) in seen:
+            continue
+        seen.add(id(handler))
+        cb = handler.callback
+        label = f"{callback_name(cb)}@{where}"
+        wrapped = wrapper(cb, label)
+        functools.update_wrapper(wrapped, cb)
+        handler.callback = wrapped
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# history.py — история изменений инвентаря: дельты + периодические снимки (SQLite)
+#
+# Каждая запись инвентаря сохраняет дельту — какие записи появились/изменились
+# и какие исчезли. Каждые SNAPSHOT_EVERY изменений рядом с дельтой лежит полный
+# снимок, поэтому любое прошлое состояние собирается из ближайшего снимка
+# и не более SNAPSHOT_EVERY-1 дельт, без проигрывания всего журнала.
+# Хранятся последние KEEP изменений игрока (и всё от ближайшего снимка перед ними):
+# при каждом новом снимке записи до этой границы удаляются.
+#
+# Состояние — Inventory.to_json() без таблицы описаний (описания прямо в записях):
+# общая таблица _texts чистится, а история должна пережить это.
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from inventory_model import Inventory
+
+SNAPSHOT_EVERY = 20
+KEEP = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    campaign TEXT    NOT NULL,
+    user_id  INTEGER NOT NULL,
+    seq      INTEGER NOT NULL,
+    ts       REAL    NOT NULL,
+    summary  TEXT    NOT NULL,
+    delta    TEXT    NOT NULL,
+    snapshot TEXT,               -- полное состояние после изменения (каждое SNAPSHOT_EVERY-е)
+    restored INTEGER,            -- для /undo: номер состояния, к которому вернулись
+    PRIMARY KEY (campaign, user_id, seq)
+);
+"""
+
+EMPTY = {"next": 1, "items": {}}
+
+
+def _dump(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def plain(obj: dict | None, texts: dict | None, categories=()) -> dict:
+    """Сохранённый инвентарь -> состояние для истории (описания подставлены из texts)."""
+    if not obj:
+        return EMPTY
+    if "items" not in obj:      # старый строковый формат
+        return Inventory.from_json(obj, categories).to_json()
+    items = {}
+    for cat, lst in obj["items"].items():
+        items[cat] = []
+        for o in lst:
+            if "d" in o:
+                tid = o["d"]
+                o = {k: v for k, v in o.items() if k != "d"}
+                if (texts or {}).get(tid):
+                    o["desc"] = texts[tid]
+            items[cat].append(o)
+    return {"next": obj.get("next", 1), "items": items}
+
+
+def _entries(state: dict) -> dict[tuple, dict]:
+    return {(cat, o["id"]): o for cat, lst in state.get("items", {}).items() for o in lst}
+
+
+def diff(before: dict, after: dict) -> dict:
+    b, a = _entries(before), _entries(after)
+    return {
+        "put": [[cat, o] for (cat, eid), o in a.items() if b.get((cat, eid)) != o],
+        "del": [[cat, eid] for (cat, eid) in b if (cat, eid) not in a],
+        "next": after.get("next", 1),
+    }
+
+
+def apply(state: dict, delta: dict) -> dict:
+    """Новое состояние; порядок записей — по id, как в Inventory."""
+    cats = {cat: {o["id"]: o for o in lst} for cat, lst in state.get("items", {}).items()}
+    for cat, eid in delta["del"]:
+        cats.get(cat, {}).pop(eid, None)
+    for cat, o in delta["put"]:
+        cats.setdefault(cat, {})[o["id"]] = o
+    return {
+        "next": delta["next"],
+        "items": {cat: sorted(d.values(), key=lambda o: o["id"]) for cat, d in cats.items()},
+    }
+
+
+def _title(o: dict) -> str:
+    import item_catalog
+    it = item_catalog.get_item(o.get("ref"))
+    return (o.get("name") or (it or {}).get("name") or "?").split(" / ")[0]
+
+
+def qty_changes(before: dict, after: dict) -> list[tuple[str, str | None, int, str]]:
+    """(категория, ref, ±количество, название) по каждой изменившейся записи."""
+    b, a = _entries(before), _entries(after)
+    out = []
+    for key in b.keys() | a.keys():
+        ob, oa = b.get(key), a.get(key)
+        dq = (oa.get("qty", 1) if oa else 0) - (ob.get("qty", 1) if ob else 0)
+        if dq:
+            o = oa or ob
+            out.append((key[0], o.get("ref"), dq, _title(o)))
+    out.sort(key=lambda c: (c[2] > 0, c[0], c[3]))
+    return out
+
+
+def describe(before: dict, after: dict, limit: int = 4) -> str:
+    parts = [f"{'+' if dq > 0 else '−'}{abs(dq)} {title}" for _, _, dq, title in qty_changes(before, after)]
+    if not parts:
+        return "без изменений"
+    more = f" … ещё {len(parts) - limit}" if len(parts) > limit else ""
+    return ", ".join(parts[:limit]) + more
+
+
+class History:
+    def __init__(self, path: str | Path, snapshot_every: int = SNAPSHOT_EVERY, keep: int = KEEP):
+        self.path = Path(path)
+        self.snapshot_every = snapshot_every
+        self.keep = keep
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def last_seq(self, cid: str, uid: int) -> int | None:
+        row = self._db.execute(
+            "SELECT MAX(seq) FROM changes WHERE campaign=? AND user_id=?", (cid, uid)
+        ).fetchone()
+        return row[0]
+
+    def record(self, cid: str, uid: int, before: dict, after: dict,
+               summary: str | None = None, restored: int | None = None) -> int | None:
+        """Записывает изменение; возвращает его номер или None, если ничего не поменялось."""
+        delta = diff(before, after)
+        if not delta["put"] and not delta["del"]:
+            return None
+        now = time.time()
+        last = self.last_seq(cid, uid)
+        with self._db:
+            if last is None:
+                # №0 — состояние до начала истории, чтобы было куда откатываться
+                self._db.execute(
+                    "INSERT INTO changes VALUES (?, ?, 0, ?, ?, ?, ?, NULL)",
+                    (cid, uid, now, "начало истории", _dump(diff(EMPTY, before)), _dump(before)),
+                )
+                last = 0
+            seq = last + 1
+            snapshot = _dump(after) if seq % self.snapshot_every == 0 else None
+            self._db.execute(
+                "INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (cid, uid, seq, now, summary or describe(before, after), _dump(delta), snapshot, restored),
+            )
+            if snapshot is not None:
+                self._prune(cid, uid, seq - self.keep)
+        return seq
+
+    def _prune(self, cid: str, uid: int, oldest: int):
+        """Удаляет записи раньше последнего снимка не позже oldest — с него собирается всё, что осталось."""
+        if oldest <= 0:
+            return
+        row = self._db.execute(
+            "SELECT MAX(seq) FROM changes WHERE campaign=? AND user_id=? AND seq<=? AND snapshot IS NOT NULL",
+            (cid, uid, oldest),
+        ).fetchone()
+        if row[0]:
+            self._db.execute(
+                "DELETE FROM changes WHERE campaign=? AND user_id=? AND seq<?", (cid, uid, row[0])
+            )
+
+    def first_seq(self, cid: str, uid: int) -> int | None:
+        """Самое старое состояние, которое ещё можно восстановить."""
+        row = self._db.execute(
+            "SELECT MIN(seq) FROM changes WHERE campaign=? AND user_id=?", (cid, uid)
+        ).fetchone()
+        return row[0]
+
+    def entries(self, cid: str, uid: int, limit: int = 10) -> list[tuple[int, float, str]]:
+        """Последние изменения: (номер, время, описание), новые первыми."""
+        return self._db.execute(
+            "SELECT seq, ts, summary FROM changes WHERE campaign=? AND user_id=? AND seq > 0 "
+            "ORDER BY seq DESC LIMIT ?",
+            (cid, uid, limit),
+        ).fetchall()
+
+    def state_at(self, cid: str, uid: int, seq: int) -> dict | None:
+        """Состояние после изменения seq: ближайший снимок + дельты после него (None — уже удалено)."""
+        row = self._db.execute(
+            "SELECT seq, snapshot FROM changes WHERE campaign=? AND user_id=? AND seq<=? "
+            "AND snapshot IS NOT NULL ORDER BY seq DESC LIMIT 1",
+            (cid, uid, seq),
+        ).fetchone()
+        if row is None:
+            return None
+        base, state = row[0], json.loads(row[1])
+        for (delta,) in self._db.execute(
+            "SELECT delta FROM changes WHERE campaign=? AND user_id=? AND seq>? AND seq<=? ORDER BY seq",
+            (cid, uid, base, seq),
+        ):
+            state = apply(state, json.loads(delta))
+        return state
+
+    def undo_target(self, cid: str, uid: int) -> int | None:
+        """
+        Куда откатывает /undo без номера: на шаг назад от последнего изменения,
+        а если оно само было откатом — ещё на шаг от того, к чему вернулись.
+        """
+        row = self._db.execute(
+            "SELECT seq, restored FROM changes WHERE campaign=? AND user_id=? ORDER BY seq DESC LIMIT 1",
+            (cid, uid),
+        ).fetchone()
+        if row is None:
+            return None
+        seq, restored = row
+        target = (restored if restored is not None else seq) - 1
+        return target if target >= 0 else None
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# idempotency.py — отсев повторов нажатий inline-кнопок до обработчиков
+#
+# Одно нажатие может прийти дважды:
+#   повтор доставки — Telegram не дождался ответа на webhook и шлёт тот же апдейт
+#     (тот же id callback-запроса);
+#   двойное нажатие — два разных запроса от одной кнопки одного сообщения.
+# Повтор доставки отсеивается для всех кнопок, двойное нажатие — только для
+# кнопок, меняющих инвентарь: «➡️» дважды подряд — законное листание.
+# Ключи живут ttl секунд и не больше max_size штук, так что память ограничена.
+# Пул процессов делит игроков по id (worker_pool.worker_for), поэтому набора
+# в памяти своего процесса достаточно.
+
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 10_000
+DEFAULT_TTL = 600.0         # Telegram повторяет доставку несколько минут
+
+
+class SeenSet:
+    """Ключи в порядке добавления: старые вытесняются по ttl и по max_size."""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._items: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _expire(self, now: float):
+        while self._items:
+            key, ts = next(iter(self._items.items()))
+            if now - ts < self.ttl:
+                break
+            self._items.popitem(last=False)
+
+    def __contains__(self, key) -> bool:
+        self._expire(self.clock())
+        return key in self._items
+
+    def add(self, key) -> bool:
+        """Запоминает key; False, если он уже был (и ещё не истёк)."""
+        now = self.clock()
+        self._expire(now)
+        if key in self._items:
+            return False
+        self._items[key] = now
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return True
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+def callback_keys(query, mutating: tuple[str, ...]) -> tuple[tuple, tuple | None]:
+    """
+    (ключ повтора доставки, ключ двойного нажатия или None).
+    Второй — сообщение + data, только для data, начинающихся с mutating.
+    """
+    retry = ("q", query.id)
+    data = query.data or ""
+    if not data.startswith(mutating):
+        return retry, None
+    if query.message is not None:
+        return retry, ("m", query.message.chat.id, query.message.message_id, data)
+    if query.inline_message_id:
+        return retry, ("i", query.inline_message_id, data)
+    return retry, None
+
+
+def check(seen: SeenSet, query, mutating: tuple[str, ...]) -> str | None:
+    """Причина отсева ("retry" / "double_tap") или None — нажатие новое и запомнено."""
+    retry, tap = callback_keys(query, mutating)
+    if retry in seen:
+        return "retry"
+    if tap is not None and tap in seen:
+        seen.add(retry)
+        return "double_tap"
+    seen.add(retry)
+    if tap is not None:
+        seen.add(tap)
+    return None
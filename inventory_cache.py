@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# inventory_cache.py — LRU-кеш разобранных инвентарей с ограничением по байтам
+#
+# Обработчики одного действия (показ списка, выбор, подтверждение) читают один
+# и тот же инвентарь по нескольку раз. Кеш держит готовый Inventory и отдаёт копию,
+# чтобы правки обработчика, не дошедшие до save_inventory, не портили кеш.
+# Запись — насквозь: save_inventory сначала пишет шард, затем кладёт сюда новую версию.
+#
+# Копия считается свежей, пока совпадают версия инвентаря (_versions) и поколение
+# шарда (Shard.generation растёт, когда файл перечитан с диска).
+
+from collections import OrderedDict
+
+import metrics
+from inventory_model import Inventory
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+_INV_OVERHEAD = 400        # объект, словари категорий и индекс стопок
+_ENTRY_OVERHEAD = 250      # Entry со слотами + место в двух словарях
+
+
+def estimate_size(inv: Inventory) -> int:
+    """Грубая оценка памяти под инвентарь в байтах (для лимита, не для отчёта)."""
+    size = _INV_OVERHEAD + 100 * len(inv.cats)
+    for d in inv.cats.values():
+        for e in d.values():
+            size += _ENTRY_OVERHEAD + 2 * (len(e.name or "") + len(e.desc or ""))
+    return size
+
+
+class InventoryCache:
+    """(кампания, игрок) -> (поколение шарда, версия, Inventory, байты) в порядке LRU."""
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items: OrderedDict[tuple, tuple] = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key: tuple, generation: int, version: int) -> Inventory | None:
+        hit = self._items.get(key)
+        if hit is None or hit[0] != generation or hit[1] != version:
+            metrics.INVENTORY_CACHE_TOTAL.inc(outcome="miss")
+            return None
+        self._items.move_to_end(key)
+        metrics.INVENTORY_CACHE_TOTAL.inc(outcome="hit")
+        return hit[2].copy()
+
+    def put(self, key: tuple, generation: int, inv: Inventory):
+        """Кладёт копию inv; версия берётся из inv.version."""
+        self.discard(key)
+        size = estimate_size(inv)
+        if size > self.max_bytes:
+            return
+        self._items[key] = (generation, inv.version, inv.copy(), size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, old = self._items.popitem(last=False)
+            self.bytes -= old[3]
+            metrics.INVENTORY_CACHE_TOTAL.inc(outcome="evict")
+        metrics.INVENTORY_CACHE_BYTES.set(self.bytes)
+
+    def discard(self, key: tuple):
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.bytes -= old[3]
+            metrics.INVENTORY_CACHE_BYTES.set(self.bytes)
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+        metrics.INVENTORY_CACHE_BYTES.set(0)
+
+    def drop_campaign(self, cid: str):
+        """Убирает все инвентари кампании (например, когда её шард выгружен)."""
+        for key in [k for k in self._items if k[0] == cid]:
+            self.discard(key)
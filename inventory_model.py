@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# inventory_model.py — типизированные записи инвентаря и миграция со старых строк
+
+import hashlib
+
+import item_catalog
+
+MAGIC_CATEGORY = "Магический предмет"
+
+
+# --------- Старый формат ---------
+
+def parse_item_entry(entry):
+    """Возвращает (name, desc|None) из строки/словаря."""
+    if isinstance(entry, dict):
+        return (
+            entry.get("name", "").strip(),
+            (entry.get("description") or entry.get("desc"))
+        )
+
+    s = str(entry)
+    if "—" in s:
+        nm, ds = s.split("—", 1)
+        return nm.strip().lstrip("⭐ ").strip(), ds.strip()
+    return s.strip().lstrip("⭐ ").strip(), None
+
+
+def resolve_ref(name: str, category: str) -> str | None:
+    """id предмета каталога по точному имени или None."""
+    it = item_catalog.find_exact(name, category == MAGIC_CATEGORY)
+    return it["id"] if it else None
+
+
+def text_id(text: str) -> str:
+    """Id описания в общей таблице текстов: хеш, одинаковый для одинаковых текстов."""
+    return "t" + hashlib.blake2b(text.encode("utf-8"), digest_size=6).hexdigest()
+
+
+def referenced_texts(obj: dict) -> set[str]:
+    """Id текстов, на которые ссылается сохранённый инвентарь."""
+    return {o["d"] for lst in obj.get("items", {}).values() for o in lst if "d" in o}
+
+
+# --------- Запись ---------
+
+class Entry:
+    """
+    Одна запись инвентаря.
+    eid  — id записи внутри инвентаря (не меняется, по нему удаляют);
+    ref  — id предмета каталога (item_catalog.get_item) или None;
+    name — название (для каталожных — копия имени на случай правки каталога);
+    desc — пользовательское описание;
+    qty  — количество одинаковых предметов в стопке.
+    """
+
+    __slots__ = ("eid", "ref", "name", "desc", "qty")
+
+    def __init__(self, eid: int, ref: str | None = None, name: str | None = None,
+                 desc: str | None = None, qty: int = 1):
+        self.eid = eid
+        self.ref = ref
+        self.name = name
+        self.desc = desc
+        self.qty = qty
+
+    @property
+    def key(self) -> tuple:
+        """Одинаковые по key записи складываются в одну стопку."""
+        return self.ref, self.name, self.desc
+
+    @property
+    def item(self) -> dict | None:
+        return item_catalog.get_item(self.ref)
+
+    @property
+    def title(self) -> str:
+        if self.name:
+            return self.name
+        it = self.item
+        return it.get("name", "Безымянный") if it else "Безымянный"
+
+    def label(self, width: int | None = None) -> str:
+        """Название (обрезанное до width) с количеством: «Факел ×5»."""
+        title = self.title[:width] if width else self.title
+        return f"{title} ×{self.qty}" if self.qty > 1 else title
+
+    @property
+    def description(self) -> str | None:
+        """Своё описание, иначе — из каталога."""
+        if self.desc:
+            return self.desc
+        it = self.item
+        return ((it.get("description") or "").strip() or None) if it else None
+
+    def to_json(self, texts: dict[str, str] | None = None) -> dict:
+        """
+        texts — общая таблица описаний: если передана, описание кладётся
+        туда, а в записи остаётся только его id ("d").
+        """
+        out = {"id": self.eid}
+        if self.ref:
+            out["ref"] = self.ref
+        if self.name:
+            out["name"] = self.name
+        if self.desc and texts is not None:
+            tid = text_id(self.desc)
+            texts[tid] = self.desc
+            out["d"] = tid
+        elif self.desc:
+            out["desc"] = self.desc
+        if self.qty != 1:
+            out["qty"] = self.qty
+        return out
+
+    def __repr__(self):
+        return f"Entry({self.eid}, ref={self.ref!r}, name={self.name!r}, qty={self.qty})"
+
+
+def entry_from_legacy(eid: int, raw, category: str) -> Entry:
+    """
+    Строка/словарь старого формата -> Entry.
+    «⭐ имя — описание» — пользовательский предмет; «Имя — длинное описание…»
+    у магических находок — ссылка на каталог (описание там уже есть).
+    """
+    custom = isinstance(raw, str) and raw.lstrip().startswith("⭐")
+    name, desc = parse_item_entry(raw)
+    ref = None if custom else resolve_ref(name, category)
+    if ref:
+        return Entry(eid, ref=ref, name=item_catalog.get_item(ref)["name"])
+    return Entry(eid, name=name, desc=desc)
+
+
+# --------- Инвентарь ---------
+
+class Inventory:
+    """
+    Инвентарь игрока: категория -> {eid: Entry} в порядке добавления.
+    Одинаковые предметы лежат одной стопкой (Entry.qty).
+    Удаление и поиск записи — по eid, поиск стопки — по Entry.key, без перебора.
+    changes — журнал (категория, ref, ±количество) с момента загрузки;
+    по нему save_inventory обновляет сводку партии (party_stats.py).
+    ops — сами вызовы add/remove с момента загрузки: если инвентарь тем временем
+    записал другой процесс, save_inventory переносит их на свежую версию (rebase).
+    """
+
+    __slots__ = ("cats", "next_id", "version", "changes", "ops", "_stacks")
+
+    def __init__(self, categories=(), next_id: int = 1, version: int = 0):
+        self.cats: dict[str, dict[int, Entry]] = {c: {} for c in categories}
+        self.next_id = next_id
+        self.version = version
+        self.changes: list[tuple[str, str | None, int]] = []
+        self.ops: list[tuple] = []
+        self._stacks: dict[tuple, Entry] = {}   # (категория, *Entry.key) -> запись
+
+    def _put(self, cat: str, e: Entry):
+        self.cats.setdefault(cat, {})[e.eid] = e
+        self._stacks.setdefault((cat, *e.key), e)
+
+    def add(self, cat: str, ref: str | None = None, name: str | None = None,
+            desc: str | None = None, qty: int = 1) -> Entry:
+        """Кладёт qty предметов: в существующую стопку или новой записью."""
+        self.changes.append((cat, ref, qty))
+        e = self._stacks.get((cat, ref, name, desc))
+        if e is not None:
+            e.qty += qty
+        else:
+            e = Entry(self.next_id, ref=ref, name=name, desc=desc, qty=qty)
+            self.next_id += 1
+            self._put(cat, e)
+        self.ops.append(("add", cat, ref, name, desc, qty, e.eid))
+        return e
+
+    def remove(self, cat: str, eid: int, qty: int = 1) -> Entry | None:
+        """
+        Убирает qty предметов из стопки eid; пустая стопка удаляется.
+        Возвращает запись (qty — сколько осталось) или None, если её нет.
+        """
+        d = self.cats.get(cat, {})
+        e = d.get(eid)
+        if e is None:
+            return None
+        self.changes.append((cat, e.ref, -min(qty, e.qty)))
+        self.ops.append(("remove", cat, eid, qty, e.key))
+        e.qty -= qty
+        if e.qty <= 0:
+            e.qty = 0
+            del d[eid]
+            if self._stacks.get((cat, *e.key)) is e:
+                del self._stacks[(cat, *e.key)]
+        return e
+
+    def get(self, cat: str, eid: int) -> Entry | None:
+        return self.cats.get(cat, {}).get(eid)
+
+    def entries(self, cat: str) -> list[Entry]:
+        return list(self.cats.get(cat, {}).values())
+
+    def count(self, cat: str | None = None) -> int:
+        """Число записей (стопок)."""
+        if cat is not None:
+            return len(self.cats.get(cat, ()))
+        return sum(len(d) for d in self.cats.values())
+
+    def total(self, cat: str | None = None) -> int:
+        """Число предметов с учётом количества."""
+        cats = [self.cats.get(cat, {})] if cat is not None else self.cats.values()
+        return sum(e.qty for d in cats for e in d.values())
+
+    def items(self):
+        """(категория, [Entry]) — как у старого dict[str, list]."""
+        for cat, d in self.cats.items():
+            yield cat, list(d.values())
+
+    def copy(self) -> "Inventory":
+        """Независимая копия: правки копии не трогают оригинал (и наоборот)."""
+        inv = Inventory((), self.next_id, self.version)
+        for cat, d in self.cats.items():
+            inv.cats[cat] = {}
+            for e in d.values():
+                inv._put(cat, Entry(e.eid, e.ref, e.name, e.desc, e.qty))
+        return inv
+
+    def rebase(self, base: "Inventory"):
+        """
+        Повторяет свои ops поверх base (более свежей версии того же инвентаря)
+        и становится результатом. eid у base свои: запись, добавленная в этой сессии,
+        удаляется по eid, который она получила при повторе, а загруженная раньше —
+        по стопке (категория, *Entry.key). Удаление записи, которой в base уже нет, пропускается.
+        """
+        ops = self.ops
+        self.cats, self.next_id, self._stacks = base.cats, base.next_id, base._stacks
+        self.changes, self.ops = [], []
+        moved: dict[tuple[str, int], int] = {}     # (категория, eid сессии) -> eid в base
+        for op in ops:
+            if op[0] == "add":
+                _, cat, ref, name, desc, qty, eid = op
+                moved[(cat, eid)] = self.add(cat, ref, name, desc, qty).eid
+            else:
+                _, cat, eid, qty, key = op
+                if (cat, eid) in moved:
+                    self.remove(cat, moved[(cat, eid)], qty)
+                else:
+                    e = self._stacks.get((cat, *key))
+                    if e is not None:
+                        self.remove(cat, e.eid, qty)
+
+    # --- сериализация ---
+
+    def to_json(self, texts: dict[str, str] | None = None) -> dict:
+        return {
+            "next": self.next_id,
+            "items": {cat: [e.to_json(texts) for e in d.values()] for cat, d in self.cats.items()},
+        }
+
+    @classmethod
+    def from_json(cls, obj: dict | None, categories=(), texts: dict[str, str] | None = None) -> "Inventory":
+        """texts — общая таблица описаний для записей вида {"d": id}."""
+        inv = cls(categories)
+        if not obj:
+            return inv
+        if "items" not in obj:
+            # старый формат {категория: [строки/словари]}
+            # одинаковые строки собираются в стопки
+            for cat, lst in obj.items():
+                inv.cats.setdefault(cat, {})
+                for raw in lst or []:
+                    e = entry_from_legacy(0, raw, cat)
+                    inv.add(cat, e.ref, e.name, e.desc)
+            inv.changes.clear()     # миграция — не изменение содержимого
+            inv.ops.clear()
+            return inv
+
+        for cat, lst in obj["items"].items():
+            inv.cats.setdefault(cat, {})
+            for o in lst:
+                desc = texts.get(o["d"]) if "d" in o and texts else o.get("desc")
+                inv._put(cat, Entry(o["id"], o.get("ref"), o.get("name"), desc, o.get("qty", 1)))
+        inv.next_id = obj.get("next", 1)
+        return inv
@@ -2,9 +2,16 @@
 # item_catalog.py — загрузка каталогов и форматированный вывод карточек предметов
 
 from pathlib import Path
+import hashlib
 import json
 import re
 
+import metrics
+from catalog_columns import CatalogColumns
+from catalog_facets import FacetIndex
+from prefix_trie import PrefixTrie
+from search_index import SearchIndex
+
 # Пути по умолчанию: рядом со скриптом бота
 DATA_DIR = Path(__file__).resolve().parent / "data"
 NONMAGIC_PATH = DATA_DIR / "nonmagic.json"   # оружие/доспехи/прочее
@@ -19,6 +26,20 @@ from pathlib import Path
 MAGIC = []
 NONMAGIC = []
 
+# стабильные id предметов: не зависят от порядка записей в JSON
+BY_ID: dict[str, dict] = {}
+_EXACT_MAGIC: dict[str, dict] = {}
+_EXACT_NONMAGIC: dict[str, dict] = {}
+SEARCH: SearchIndex | None = None
+NAME_TRIE: PrefixTrie | None = None
+COLUMNS: CatalogColumns | None = None
+FACETS: FacetIndex | None = None
+# вес (фунты) и цена (зм) по id — для сводки партии; у большинства предметов их нет
+WEIGHTS: dict[str, float] = {}
+COSTS: dict[str, float] = {}
+# урон оружия по id: (кости, вид, кости двумя руками или None) — для кнопки атаки
+DAMAGE: dict[str, tuple[str, str | None, str | None]] = {}
+
 def init_catalogs(data_dir: str):
     """
     Загружает:
@@ -51,40 +72,167 @@ def init_catalogs(data_dir: str):
     else:
         NONMAGIC = []
 
+    index_catalogs()
     print(f"📚 Загружено: {len(MAGIC)} магических и {len(NONMAGIC)} немагических предметов.")
     return MAGIC, NONMAGIC
 
 
+def catalog_stamp(data_dir) -> tuple:
+    """mtime/размер/inode файлов каталога: по нему процессы бота замечают их замену."""
+    out = []
+    for name in ("library.json", "nonmagic.json"):
+        try:
+            st = (Path(data_dir) / name).stat()
+        except FileNotFoundError:
+            out.append(None)
+        else:
+            out.append((st.st_mtime_ns, st.st_size, st.st_ino))
+    return tuple(out)
+
+
+def _make_id(prefix: str, name: str) -> str:
+    return prefix + hashlib.blake2b(_norm(name).encode("utf-8"), digest_size=5).hexdigest()
+
+def index_catalogs():
+    """
+    Проставляет каждому предмету поле "id" ("m…" — магия, "n…" — прочее),
+    строит словари для поиска по id и по точному имени, полнотекстовый индекс
+    префиксное дерево названий для автодополнения, числовые колонки (вес, цена)
+    и битовые маски фасетов для /browse.
+    """
+    global SEARCH, NAME_TRIE, COLUMNS, FACETS
+    BY_ID.clear()
+    WEIGHTS.clear()
+    COSTS.clear()
+    DAMAGE.clear()
+    _EXACT_MAGIC.clear()
+    _EXACT_NONMAGIC.clear()
+    for prefix, items, exact in (("m", MAGIC, _EXACT_MAGIC), ("n", NONMAGIC, _EXACT_NONMAGIC)):
+        for it in items:
+            iid = base = _make_id(prefix, it.get("name"))
+            n = 2
+            while iid in BY_ID:      # коллизия хеша — детерминированный суффикс
+                iid = f"{base}-{n}"
+                n += 1
+            it["id"] = iid
+            BY_ID[iid] = it
+            exact.setdefault(_norm(it.get("name")), it)
+            # «Плащ защиты / Магические предметы …» находится и по «Плащ защиты»
+            exact.setdefault(_norm((it.get("name") or "").split(" / ")[0]), it)
+            w = parse_weight(it)
+            if w is not None:
+                WEIGHTS[iid] = w
+            c = parse_cost(it.get("cost"))
+            if c is not None:
+                COSTS[iid] = c
+            dmg = parse_damage(it)
+            if dmg is not None:
+                DAMAGE[iid] = dmg
+    SEARCH = SearchIndex(MAGIC + NONMAGIC)
+    NAME_TRIE = PrefixTrie(MAGIC + NONMAGIC)
+    COLUMNS = CatalogColumns(MAGIC + NONMAGIC, WEIGHTS, COSTS)
+    FACETS = FacetIndex(MAGIC + NONMAGIC)
+
+_FRACTIONS = {"¼": 0.25, "½": 0.5, "¾": 0.75}
+_WEIGHT_RE = re.compile(r"Вес\s+(\d+(?:[.,]\d+)?)?\s*([¼½¾])?\s*фнт", re.IGNORECASE)
+_COST_RE = re.compile(r"(\d+(?:[.,]\d+)?)\s*(зм|эм|см|мм|пм)", re.IGNORECASE)
+_COIN_GP = {"пм": 10.0, "зм": 1.0, "эм": 0.5, "см": 0.1, "мм": 0.01}
+_DAMAGE_RE = re.compile(r"(?<![\w(])(\d+к\d+|\d+)\s+(дробящий|колющий|рубящий)", re.IGNORECASE)
+_VERSATILE_RE = re.compile(r"универсальное\s*\((\d+к\d+)\)", re.IGNORECASE)
+
+
+def _number(s: str | None) -> float:
+    return float(s.replace(",", ".")) if s else 0.0
+
+
+def parse_weight(item: dict) -> float | None:
+    """Вес в фунтах: поле "weight" или «Вес 4 фнт.» / «Вес ¼ фнт.» в описании."""
+    w = item.get("weight")
+    if isinstance(w, (int, float)):
+        return float(w)
+    m = _WEIGHT_RE.search(str(w or item.get("description") or ""))
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    return _number(m.group(1)) + _FRACTIONS.get(m.group(2), 0.0)
+
+
+def parse_damage(item: dict) -> tuple[str, str | None, str | None] | None:
+    """
+    Урон оружия: props.damage (если каталог структурный) или «1к8 рубящий.
+    Универсальное (1к10)» в описании. (кости, вид урона, кости двумя руками).
+    """
+    p = item.get("props") if isinstance(item.get("props"), dict) else {}
+    dmg = p.get("damage") or {}
+    if dmg.get("dice"):
+        return dmg["dice"], dmg.get("type"), p.get("versatile_dice")
+    if (item.get("category") or "") != "Оружие":
+        return None
+    desc = item.get("description") or ""
+    m = _DAMAGE_RE.search(desc)
+    if not m:
+        return None
+    v = _VERSATILE_RE.search(desc)
+    return m.group(1), m.group(2).lower(), v.group(1) if v else None
+
+
+def parse_cost(cost) -> float | None:
+    """Цена в золотых: число или строка вида «15 зм», «5 см»."""
+    if isinstance(cost, (int, float)):
+        return float(cost)
+    m = _COST_RE.search(str(cost or ""))
+    return _number(m.group(1)) * _COIN_GP[m.group(2).lower()] if m else None
+
+
+def get_item(item_id: str | None) -> dict | None:
+    """Предмет каталога по стабильному id."""
+    return BY_ID.get(item_id) if item_id else None
+
+def find_exact(name: str, magic: bool) -> dict | None:
+    """Только точное совпадение имени (без учёта регистра), O(1)."""
+    return (_EXACT_MAGIC if magic else _EXACT_NONMAGIC).get(_norm(name))
+
+
+def search_items(query: str, limit: int = 50) -> list[dict]:
+    """Полнотекстовый поиск по названиям и описаниям обоих каталогов (BM25)."""
+    if SEARCH is None:
+        return []
+    return [it for it, _ in SEARCH.search(query, limit)]
+
+
+def complete_names(prefix: str) -> list[dict]:
+    """Предметы, в названии которых есть слово, начинающееся с prefix."""
+    if NAME_TRIE is None:
+        return []
+    return NAME_TRIE.lookup(prefix)
+
+
 def _norm(s: str) -> str:
     return (s or "").strip().lower()
 
-def find_nonmagic_item(name: str, category: str | None = None) -> dict | None:
-    """Поиск по nonmagic.json: точное, затем частичное совпадение."""
+def _lookup(items: list[dict], name: str, category: str | None = None):
+    """Точное, затем частичное совпадение. Возвращает (item, "exact"|"partial"|"miss")."""
     q = _norm(name)
     # точное
-    for it in NONMAGIC:
+    for it in items:
         if category and it.get("category") != category:
             continue
         if _norm(it.get("name")) == q:
-            return it
+            return it, "exact"
     # частичное
-    for it in NONMAGIC:
+    for it in items:
         if category and it.get("category") != category:
             continue
         if q and q in _norm(it.get("name")):
-            return it
-    return None
+            return it, "partial"
+    return None, "miss"
+
+def find_nonmagic_item(name: str, category: str | None = None) -> dict | None:
+    """Поиск по nonmagic.json: точное, затем частичное совпадение."""
+    return _lookup(NONMAGIC, name, category)[0]
 
 def find_magic_item(name: str) -> dict | None:
     """Поиск по library.json: точное, затем частичное совпадение."""
-    q = _norm(name)
-    for it in MAGIC:
-        if _norm(it.get("name")) == q:
-            return it
-    for it in MAGIC:
-        if q and q in _norm(it.get("name")):
-            return it
-    return None
+    return _lookup(MAGIC, name)[0]
 
 def enrich_item(obj: dict) -> dict | None:
     """
@@ -99,12 +247,14 @@ def enrich_item(obj: dict) -> dict | None:
         return obj
 
     if category in ("Оружие","Доспехи","Инструменты","Снаряжение","Наборы","Одежда"):
-        found = find_nonmagic_item(name, category if category in ("Оружие","Доспехи") else None) \
-                or find_nonmagic_item(name)
+        found, outcome = _lookup(NONMAGIC, name, category if category in ("Оружие","Доспехи") else None)
+        if not found:
+            found, outcome = _lookup(NONMAGIC, name)
     else:
         # всё остальное считаем магией
-        found = find_magic_item(name)
+        found, outcome = _lookup(MAGIC, name)
 
+    metrics.ENRICH_TOTAL.inc(outcome=outcome)
     return found or obj
 
 def render_item_card(item: dict) -> str:
@@ -0,0 +1,579 @@
+# -*- coding: utf-8 -*-
+# loadtest.py — офлайн-нагрузка: тот же граф обработчиков, что в run_bot,
+# офлайн-Bot вместо сети и тысячи синтетических апдейтов от параллельных игроков.
+#
+#   python loadtest.py [--users 200] [--rounds 3] [--concurrency 50] [--json out.json]
+#   python loadtest.py --workers 4 ...   # пул процессов (worker_pool.py) за HTTP-входом
+#
+# Печатает p50/p95/p99 по каждому обработчику и общую пропускную способность.
+# С --workers апдейты идут по HTTP во вход пула; обработчики — отдельные процессы
+# с офлайн-Bot и общим хранилищем во временном каталоге. В конце проверяется,
+# что каждый игрок обработан ровно одним процессом и что ни одна запись инвентаря
+# не потеряна (шард совпадает с последним состоянием в истории).
+# Без пула перед нагрузкой проверяется перенос правок на свежую версию (check_rebase).
+# В обоих режимах число вызовов каждого обработчика и отсеянных повторов сверяется
+# со сценарием (ROUND_CALLS, ROUND_RETRIES) — лишний отсев или потеря видны как ошибка.
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+import InventoryBot as bot
+import history
+import metrics
+import storage_codec
+from handler_hooks import wrap_callbacks
+from offline_bot import OfflineRequest, BOT_USER
+from webhook_server import SECRET_HEADER, WebhookServer
+
+FIRST_USER_ID = 5_000_000_000
+CLICK_WAIT = 60.0       # сколько нажатие ждёт прежних апдейтов игрока (под полной нагрузкой — секунды)
+ID_SPAN = 1_000_000_000     # id апдейтов/сообщений/нажатий: у клиента с 1, у обработчика i — с (i+1)·ID_SPAN
+
+
+# --------- Синтетические апдейты ---------
+
+class UpdateFactory:
+    def __init__(self, first_id: int = 1):
+        self._update_ids = itertools.count(first_id)
+        self._message_ids = itertools.count(first_id)
+        self._query_ids = itertools.count(first_id)
+
+    @staticmethod
+    def _user(uid):
+        return {"id": uid, "is_bot": False, "first_name": f"Игрок{uid % 10000}"}
+
+    def message(self, uid: int, text: str) -> dict:
+        msg = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": uid, "type": "private"},
+            "from": self._user(uid),
+            "text": text,
+        }
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": msg}
+
+    def click(self, uid: int, prefix: str) -> dict:
+        """
+        Нажатие первой кнопки с data на prefix из последней клавиатуры игрока.
+        Кнопку знает только тот, кто видел ответы бота, поэтому в пуле процессов
+        её подставляет обработчик (ClickServer); "from" — для маршрутизации.
+        """
+        return {"update_id": next(self._update_ids), "click": {"from": self._user(uid), "prefix": prefix}}
+
+    def callback(self, uid: int, data: str) -> dict:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._query_ids)),
+                "from": self._user(uid),
+                "chat_instance": str(uid),
+                "data": data,
+                "message": {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": uid, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "…",
+                },
+            },
+        }
+
+
+# сколько раз за раунд сценария вызывается каждый обработчик и сколько повторов отсеивается
+ROUND_CALLS = {
+    "add_item_start": 4, "add_item_category": 4, "add_item_name": 4, "on_add_confirm_button": 5,
+    "show_inventory_menu": 1, "show_inventory_list": 1, "on_inventory_item": 1,
+    "remove_item": 1, "show_remove_page": 1, "on_remove_click": 1,
+    "ask_simulation_days": 1, "handle_simulation_days": 1, "show_inventory": 1,
+}
+ROUND_RETRIES = 1
+
+
+def scenario(f: UpdateFactory, uid: int, rnd: random.Random) -> list[dict]:
+    """Один «раунд» игрока: добавить, посмотреть, удалить, симулировать."""
+    out = []
+    adds = [("Оружие", rnd.choice(["Кинжал", "Длинный меч"]))] + rnd.sample(
+        [("Снаряжение", "Факел"), ("Доспехи", "Кожаный доспех"),
+         ("Инструменты", "Воровские инструменты")], 2
+    )
+    for cat, name in adds:
+        yes = f.callback(uid, "confirm_yes")
+        out += [
+            f.message(uid, "➕ Добавить предмет"),
+            f.message(uid, cat),
+            f.message(uid, name),
+            yes,
+        ]
+    out.append(yes)     # повтор доставки того же апдейта: должен отсеяться до обработчиков
+    out += [
+        f.message(uid, "➕ Добавить предмет"),
+        f.message(uid, "Снаряжение"),
+        f.message(uid, f"Счастливая монетка {uid % 97}: приносит удачу"),
+        f.callback(uid, "confirm_no"),
+        f.callback(uid, "add_custom_yes"),
+    ]
+    out += [
+        f.message(uid, "📦 Инвентарь"),
+        f.message(uid, "⚔ Оружие"),
+        f.click(uid, "inv_"),
+        f.message(uid, "➖ Удалить предмет"),
+        f.message(uid, "Оружие"),
+        f.click(uid, "rm_"),
+        f.message(uid, "🎲 Симулировать день"),
+        f.message(uid, str(rnd.choice([1, 3, 5]))),
+        f.message(uid, "/inventory"),
+    ]
+    return out
+
+
+def last_button(request: OfflineRequest, uid: int, prefix: str) -> str | None:
+    """callback_data первой подходящей кнопки в последнем сообщении игроку с клавиатурой."""
+    for _, params, _ in reversed(request.calls):
+        if str(params.get("chat_id")) != str(uid):
+            continue
+        markup = params.get("reply_markup")
+        if isinstance(markup, str):
+            markup = json.loads(markup)
+        if not markup or "inline_keyboard" not in markup:
+            continue
+        for row in markup["inline_keyboard"]:
+            for b in row:
+                if b.get("callback_data", "").startswith(prefix):
+                    return b["callback_data"]
+        return None
+    return None
+
+
+# --------- Замеры ---------
+
+def percentile(sorted_vals: list[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = min(len(sorted_vals) - 1, max(0, round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[k]
+
+
+def summarize(samples: dict[str, list[float]]) -> dict[str, dict]:
+    out = {}
+    for label, vals in sorted(samples.items()):
+        vals = sorted(vals)
+        out[label] = {
+            "count": len(vals),
+            "p50_ms": percentile(vals, 50) * 1e3,
+            "p95_ms": percentile(vals, 95) * 1e3,
+            "p99_ms": percentile(vals, 99) * 1e3,
+            "max_ms": vals[-1] * 1e3,
+        }
+    return out
+
+
+def instrument(app):
+    """Замер каждого обработчика и сбор ошибок: (замеры по обработчикам, ошибки)."""
+    handler_samples: dict[str, list[float]] = defaultdict(list)
+    errors: list[BaseException] = []
+
+    def timed(cb, label):
+        async def wrapper(update, context):
+            t0 = time.perf_counter()
+            try:
+                return await cb(update, context)
+            finally:
+                handler_samples[label.split("@")[0]].append(time.perf_counter() - t0)
+        return wrapper
+
+    wrap_callbacks(app, timed)
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    app.add_error_handler(on_error)
+    return handler_samples, errors
+
+
+def check_calls(calls: dict[str, int], drops: dict[str, int], runs: int) -> list[str]:
+    """
+    Обработчики вызваны ровно столько раз, сколько в сценарии, и отсеяны только
+    повторы доставки из сценария: иначе отсев съел настоящие нажатия (или пропустил повторы).
+    """
+    out = [
+        f"{name}: вызван {calls.get(name, 0)} раз, по сценарию {n * runs}"
+        for name, n in ROUND_CALLS.items() if calls.get(name, 0) != n * runs
+    ]
+    want = {"retry": ROUND_RETRIES * runs, "double_tap": 0}
+    if {k: drops.get(k, 0) for k in want} != want:
+        out.append(f"отсеяно повторов: {drops}, по сценарию {want}")
+    return out
+
+
+def dropped() -> dict[str, int]:
+    """Сколько нажатий отсеял bot.drop_duplicate_callbacks в этом процессе, по причинам."""
+    return {reason: int(metrics.DUPLICATE_CALLBACKS.get(reason=reason)) for reason in ("retry", "double_tap")}
+
+
+def make_scripts(users: int, rounds: int, seed: int, factory: UpdateFactory) -> dict[int, list[dict]]:
+    rnd = random.Random(seed)
+    return {
+        FIRST_USER_ID + i: [u for _ in range(rounds) for u in scenario(factory, FIRST_USER_ID + i, rnd)]
+        for i in range(users)
+    }
+
+
+def resolve_click(request: OfflineRequest, factory: UpdateFactory, raw: dict) -> dict | None:
+    """Апдейт-нажатие вместо {"click": …}; None — подходящей кнопки нет."""
+    uid = raw["click"]["from"]["id"]
+    data = last_button(request, uid, raw["click"]["prefix"])
+    return None if data is None else factory.callback(uid, data)
+
+
+async def check_rebase(uid: int = FIRST_USER_ID - 1) -> list[str]:
+    """
+    Две правки одного инвентаря с одной версии: A добавляет и тут же убирает
+    верёвку, B тем временем добавляет фонарь (тот же eid) и записывает первым.
+    После записи A фонарь должен остаться, а верёвки — не быть.
+    """
+    cat = "Снаряжение"
+    inv = bot.get_inventory(uid)
+    inv.add(cat, name="Факел")
+    await bot.save_inventory(uid, inv)
+    a, b = bot.get_inventory(uid).copy(), bot.get_inventory(uid).copy()
+    rope = a.add(cat, name="Верёвка")
+    a.remove(cat, rope.eid)
+    b.add(cat, name="Фонарь")
+    await bot.save_inventory(uid, b)
+    await bot.save_inventory(uid, a)
+    got = sorted(e.title for e in bot.get_inventory(uid).entries(cat))
+    want = ["Факел", "Фонарь"]
+    return [] if got == want else [f"rebase: ожидали {want}, получили {got} — чужая правка потеряна"]
+
+
+async def run_load(users: int, rounds: int, concurrency: int, seed: int = 1) -> dict:
+    tmp = tempfile.TemporaryDirectory()
+    bot.DATA_FILE = Path(tmp.name) / "inventory_data.json"
+    bot.STATE_DB = Path(tmp.name) / "conversation_state.sqlite3"
+    bot.HISTORY_DB = Path(tmp.name) / "inventory_history.sqlite3"
+    bot.load_catalogs()
+
+    request = OfflineRequest()
+    app = bot.build_application(token="0:offline", request=request)
+    handler_samples, errors = instrument(app)
+    update_samples: list[float] = []
+
+    factory = UpdateFactory()
+    scripts = make_scripts(users, rounds, seed, factory)
+    total = sum(len(s) for s in scripts.values())
+    sem = asyncio.Semaphore(concurrency)
+
+    async def play(script):
+        # апдейты одного игрока — строго по очереди, игроки — параллельно
+        async with sem:
+            for raw in script:
+                if "click" in raw:
+                    raw = resolve_click(request, factory, raw)
+                    if raw is None:
+                        continue
+                upd = Update.de_json(raw, app.bot)
+                t0 = time.perf_counter()
+                await app.process_update(upd)
+                update_samples.append(time.perf_counter() - t0)
+
+    await app.initialize()
+    await app.start()
+    failures = await check_rebase()
+    drops0 = dropped()
+    t_start = time.perf_counter()
+    await asyncio.gather(*(play(s) for s in scripts.values()))
+    elapsed = time.perf_counter() - t_start
+    await app.stop()
+    await app.shutdown()
+    tmp.cleanup()
+    drops = {k: v - drops0[k] for k, v in dropped().items()}
+    failures += check_calls({k: len(v) for k, v in handler_samples.items()}, drops, users * rounds)
+
+    return {
+        "users": users,
+        "updates": total,
+        "elapsed_s": elapsed,
+        "throughput_ups": total / elapsed if elapsed else 0.0,
+        "api_calls": len(request.calls),
+        "errors": [repr(e) for e in errors] + failures,
+        "update": summarize({"*": update_samples})["*"],
+        "handlers": summarize(handler_samples),
+    }
+
+
+# --------- Пул процессов (--workers) ---------
+
+class ClickServer(WebhookServer):
+    """
+    Webhook-сервер обработчика пула: вместо {"click": …} ставит в очередь
+    нажатие настоящей кнопки. Кнопка берётся из ответов бота, поэтому
+    сначала дожидается, пока обработаны все прежние апдейты игрока.
+    """
+
+    def __init__(self, app, request: OfflineRequest, index: int = 0, **kw):
+        super().__init__(app, **kw)
+        self.request = request
+        # свои id, не пересекающиеся с клиентскими: иначе нажатие с уже виденным
+        # id нажатия отсеялось бы как повтор доставки
+        self.factory = UpdateFactory(first_id=(index + 1) * ID_SPAN)
+        self.queued: dict[int, int] = defaultdict(int)
+        self.done: dict[int, int] = defaultdict(int)
+        self._update_ids: set[int] = set()
+        # последняя группа: апдейт прошёл все обработчики
+        app.add_handler(TypeHandler(Update, self._on_done), group=1000)
+
+    async def _on_done(self, update, context):
+        if update.effective_user:
+            self.done[update.effective_user.id] += 1
+
+    async def _handle(self, method, path, headers, body) -> int:
+        from worker_pool import update_key
+
+        uid = None
+        if method == "POST" and path == self.path:
+            try:
+                raw = json.loads(body)
+                uid = update_key(raw)
+            except (ValueError, AttributeError):
+                raw = None
+            if isinstance(raw, dict) and "click" in raw:
+                deadline = time.monotonic() + CLICK_WAIT
+                while self.done[uid] < self.queued[uid]:
+                    if time.monotonic() > deadline:
+                        return 503      # апдейт игрока потерялся — клиент запишет сбой
+                    await asyncio.sleep(0.001)
+                raw = resolve_click(self.request, self.factory, raw)
+                if raw is None:
+                    return 200
+                body = json.dumps(raw).encode()
+        status = await super()._handle(method, path, headers, body)
+        # повтор доставки (тот же update_id) до последней группы не дойдёт — это не новая работа
+        if status == 200 and uid is not None and raw.get("update_id") not in self._update_ids:
+            self._update_ids.add(raw.get("update_id"))
+            self.queued[uid] += 1
+        return status
+
+
+async def serve_worker() -> int:
+    """
+    Один обработчик пула: офлайн-Bot, хранилище — по путям из окружения.
+    До SIGTERM принимает апдейты, затем печатает в stdout итог одной строкой JSON.
+    """
+    from worker_pool import watch_parent
+
+    with contextlib.redirect_stdout(sys.stderr):     # stdout — под итог
+        bot.load_catalogs()
+    request = OfflineRequest()
+    app = bot.build_application(token="0:offline", request=request, webhook=True)
+    handler_samples, errors = instrument(app)
+    server = ClickServer(app, request, int(bot.WORKER_INDEX or 0), path=bot.WEBHOOK_PATH, secret=bot.WEBHOOK_SECRET,
+                         host=bot.WEBHOOK_HOST, port=bot.WEBHOOK_PORT)
+
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    watchdog = asyncio.create_task(watch_parent(stop.set))     # нагрузка упала — не висеть на порту
+    await app.initialize()
+    await app.start()
+    await server.start()
+    await stop.wait()
+    watchdog.cancel()
+    await server.stop()
+    await app.stop()
+    await app.shutdown()
+
+    print(json.dumps({
+        "worker": bot.WORKER_INDEX,
+        "users": sorted(server.done),
+        "updates": sum(server.done.values()),
+        "api_calls": len(request.calls),
+        "errors": [repr(e) for e in errors],
+        "handlers": handler_samples,
+        "dropped": dropped(),
+    }))
+    return 0
+
+
+def free_ports(n: int) -> list[int]:
+    import socket
+
+    socks = [socket.socket() for _ in range(n)]
+    try:
+        for s in socks:
+            s.bind(("127.0.0.1", 0))
+        return [s.getsockname()[1] for s in socks]
+    finally:
+        for s in socks:
+            s.close()
+
+
+def check_storage(base: Path, users: list[int]) -> list[str]:
+    """Шард совпадает с последним состоянием из истории у каждого игрока — правки не потеряны."""
+    data = storage_codec.load_file(base / "inventory_data.json")
+    texts = data.get("_texts", {})
+    hist = history.History(base / "inventory_history.sqlite3")
+    out = []
+    try:
+        for uid in users:
+            seq = hist.last_seq(bot.CAMPAIGNS.default.cid, uid)
+            if seq is None:
+                out.append(f"игрок {uid}: нет истории")
+                continue
+            delta = history.diff(history.plain(data.get(str(uid)), texts, bot.ITEMS.keys()),
+                                 hist.state_at(bot.CAMPAIGNS.default.cid, uid, seq))
+            if delta["put"] or delta["del"]:
+                out.append(f"игрок {uid}: шард расходится с историей (№{seq}) — запись потеряна")
+    finally:
+        hist.close()
+    return out
+
+
+async def run_pool_load(users: int, rounds: int, concurrency: int, workers: int, seed: int = 1) -> dict:
+    from worker_pool import FrontServer, Upstream, WorkerPool, update_key, worker_for
+
+    tmp = tempfile.TemporaryDirectory()
+    base = Path(tmp.name)
+    env = {
+        "DATA_FILE": str(base / "inventory_data.json"),
+        "STATE_DB": str(base / "conversation_state.sqlite3"),
+        "HISTORY_DB": str(base / "inventory_history.sqlite3"),
+        "CAMPAIGNS_FILE": str(base / "campaigns.json"),
+        "CAMPAIGNS_DIR": str(base / "campaigns"),
+        "PYTHONWARNINGS": "ignore::UserWarning",     # PTBUserWarning про per_message — в каждом процессе
+    }
+    pool = WorkerPool(workers, [sys.executable, str(Path(__file__).resolve()), "--serve"],
+                      env=env, stdout=subprocess.PIPE, ports=free_ports(workers))
+    front = FrontServer(pool, secret="load-secret", host="127.0.0.1", port=0)
+
+    factory = UpdateFactory()
+    scripts = make_scripts(users, rounds, seed, factory)
+    total = sum(len(s) for s in scripts.values())
+    update_samples: list[float] = []
+    failures: list[str] = []
+    sem = asyncio.Semaphore(concurrency)
+
+    client = Upstream("127.0.0.1", 0, max_idle=concurrency)
+
+    async def play(script):
+        async with sem:
+            for raw in script:
+                body = json.dumps(raw, ensure_ascii=False).encode("utf-8")
+                t0 = time.perf_counter()
+                status = await client.request("POST", "/telegram", body, {SECRET_HEADER: "load-secret"})
+                update_samples.append(time.perf_counter() - t0)
+                if status != 200:
+                    failures.append(f"update {raw['update_id']}: HTTP {status}")
+
+    # при любом исключении обработчики всё равно останавливаются, а не остаются на портах
+    try:
+        pool.start()
+        await pool.wait_ready()
+        await front.start()
+        client.port = front.port
+        t_start = time.perf_counter()
+        await asyncio.gather(*(play(s) for s in scripts.values()))
+    finally:
+        client.close()
+        await front.stop()
+        outputs = await pool.stop()     # обработчики дорабатывают очереди
+    elapsed = time.perf_counter() - t_start
+
+    reports = []
+    for i, out in enumerate(outputs):
+        lines = out.decode("utf-8", "replace").strip().splitlines()
+        try:
+            reports.append(json.loads(lines[-1]))
+        except (IndexError, ValueError):
+            failures.append(f"обработчик {i} не прислал итог")
+            reports.append({"users": [], "updates": 0, "api_calls": 0, "errors": [], "handlers": {}, "dropped": {}})
+
+    # маршрутизация: каждый игрок — ровно в одном процессе, и в том, что выбрал вход
+    seen: dict[int, int] = {}
+    for i, rep in enumerate(reports):
+        for uid in rep["users"]:
+            if uid in seen:
+                failures.append(f"игрок {uid} обработан процессами {seen[uid]} и {i}")
+            seen[uid] = i
+    for uid in scripts:
+        expect = worker_for(update_key(scripts[uid][0]), workers)
+        if seen.get(uid) != expect:
+            failures.append(f"игрок {uid}: ожидался процесс {expect}, обработан {seen.get(uid)}")
+    failures += check_storage(base, list(scripts))
+    tmp.cleanup()
+
+    handler_samples: dict[str, list[float]] = defaultdict(list)
+    drops: dict[str, int] = defaultdict(int)
+    for rep in reports:
+        for label, vals in rep["handlers"].items():
+            handler_samples[label] += vals
+        for reason, n in rep["dropped"].items():
+            drops[reason] += n
+    failures += check_calls({k: len(v) for k, v in handler_samples.items()}, drops, users * rounds)
+    return {
+        "users": users,
+        "updates": total,
+        "workers": [rep["updates"] for rep in reports],
+        "elapsed_s": elapsed,
+        "throughput_ups": total / elapsed if elapsed else 0.0,
+        "api_calls": sum(rep["api_calls"] for rep in reports),
+        "errors": [e for rep in reports for e in rep["errors"]] + failures,
+        "update": summarize({"*": update_samples})["*"],
+        "handlers": summarize(handler_samples),
+    }
+
+
+def print_report(rep: dict):
+    print(f"👥 Игроков: {rep['users']}, апдейтов: {rep['updates']}, "
+          f"время: {rep['elapsed_s']:.2f} с, пропускная способность: {rep['throughput_ups']:.0f} апд/с")
+    if "workers" in rep:
+        print(f"🧵 Апдейтов по процессам: {rep['workers']} (строка «апдейт целиком» — приём входом)")
+    print(f"📤 Вызовов Bot API: {rep['api_calls']}, ошибок обработчиков: {len(rep['errors'])}")
+    print(f"{'обработчик':<28}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (мс)")
+    rows = [("апдейт целиком", rep["update"])] + list(rep["handlers"].items())
+    for label, s in rows:
+        print(f"{label:<28}{s['count']:>7}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}"
+              f"{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}")
+    for e in rep["errors"][:5]:
+        print("❌ " + e)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Офлайн-нагрузка на обработчики бота")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--rounds", type=int, default=3, help="сколько раз каждый игрок проходит сценарий")
+    ap.add_argument("--concurrency", type=int, default=50, help="игроков одновременно")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="сохранить отчёт в файл")
+    ap.add_argument("--workers", type=int, default=0, help="N процессов за HTTP-входом (worker_pool.py)")
+    ap.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)   # процесс пула
+    args = ap.parse_args(argv)
+
+    if args.serve:
+        return asyncio.run(serve_worker())
+    if args.workers:
+        rep = asyncio.run(run_pool_load(args.users, args.rounds, args.concurrency, args.workers, args.seed))
+    else:
+        rep = asyncio.run(run_load(args.users, args.rounds, args.concurrency, args.seed))
+    print_report(rep)
+    if args.json:
+        Path(args.json).write_text(json.dumps(rep, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 1 if rep["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
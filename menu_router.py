@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# menu_router.py — кнопки reply-клавиатур: точный текст кнопки -> действие
+#
+# Все тексты кнопок известны заранее, поэтому вместо цепочки filters.Regex
+# обработчик выбирается поиском в словаре. Тексты, которых нет в таблице
+# (имена игроков — состав меняется через /addplayer), отдаются resolver'ам.
+# Набранный вручную текст («назад», «оружие») узнаётся без учёта регистра и значка.
+
+import re
+
+from telegram.ext import filters
+
+_ICON_RE = re.compile(r"^[^\w]+")
+
+
+def fold(text: str) -> str:
+    """«🔙 Назад» и «назад» -> «назад»: без значка в начале, регистра и ё."""
+    return " ".join(_ICON_RE.sub("", (text or "").strip()).casefold().replace("ё", "е").split())
+
+
+class MenuRouter:
+    def __init__(self):
+        self.actions: dict[str, str] = {}    # текст кнопки -> действие
+        self.values: dict[str, str] = {}     # текст кнопки -> значение («⚔ Оружие» -> «Оружие»)
+        self.resolvers = []                  # (message, text) -> действие | None
+        self._folded: dict[str, str] = {}    # fold(текст) -> точный текст первой такой кнопки
+
+    def button(self, text: str, action: str, value: str | None = None) -> str:
+        """Регистрирует кнопку и возвращает её текст (удобно при сборке клавиатур)."""
+        self.actions[text] = action
+        self._folded.setdefault(fold(text), text)
+        if value is not None:
+            self.values[text] = value
+        return text
+
+    def _exact(self, text: str) -> str:
+        """Текст кнопки, которой соответствует набранный текст (или он сам)."""
+        text = (text or "").strip()
+        return text if text in self.actions else self._folded.get(fold(text), text)
+
+    def buttons(self, rows: list[list[str]], action: str, strip_icon: bool = False) -> list[list[str]]:
+        """Регистрирует все кнопки клавиатуры (кроме уже известных) одним действием."""
+        for row in rows:
+            for text in row:
+                if text not in self.actions:
+                    value = text.split(" ", 1)[-1] if strip_icon else None
+                    self.button(text, action, value)
+        return rows
+
+    def resolver(self, fn):
+        self.resolvers.append(fn)
+        return fn
+
+    def route(self, message) -> str | None:
+        text = (message.text or "").strip()
+        action = self.actions.get(self._exact(text))
+        if action is None:
+            for fn in self.resolvers:
+                action = fn(message, text)
+                if action:
+                    break
+        return action
+
+    def action(self, text: str) -> str | None:
+        """Действие для текста без учёта resolver'ов — проверка «Назад» внутри разговоров."""
+        return self.actions.get(self._exact(text))
+
+    def value(self, text: str) -> str:
+        text = (text or "").strip()
+        return self.values.get(self._exact(text), text)
+
+    def only(self, *actions: str) -> filters.MessageFilter:
+        return _ActionFilter(self, frozenset(actions))
+
+
+class _ActionFilter(filters.MessageFilter):
+    def __init__(self, router: MenuRouter, actions: frozenset):
+        super().__init__(name=f"MenuRouter({', '.join(sorted(actions))})")
+        self.router = router
+        self.actions = actions
+
+    def filter(self, message) -> bool:
+        return self.router.route(message) in self.actions
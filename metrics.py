@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# metrics.py — счётчики и гистограммы в формате Prometheus + локальный /metrics
+#
+# Без внешних зависимостей: модуль импортируется и каталогом, и ботом.
+
+import asyncio
+import bisect
+import time
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCORE_BUCKETS = (50, 60, 70, 75, 80, 85, 90, 95, 100)
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: tuple = ()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(tuple(labels.get(n, "") for n in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_fmt_labels(self.labelnames, k)} {v:g}"
+            for k, v in sorted(self.values.items())
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[tuple(labels.get(n, "") for n in self.labelnames)] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple = (), buckets=LATENCY_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (+Inf последней), сумма, количество]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        row[0][bisect.bisect_left(self.buckets, value)] += 1
+        row[1] += value
+        row[2] += 1
+
+    def count(self, **labels) -> int:
+        row = self.values.get(tuple(labels.get(n, "") for n in self.labelnames))
+        return row[2] if row else 0
+
+    def render(self) -> list[str]:
+        out = []
+        for key, (counts, total, n) in sorted(self.values.items()):
+            acc = 0
+            for le, c in zip(self.buckets + ("+Inf",), counts):
+                acc += c
+                le_s = le if isinstance(le, str) else f"{le:g}"
+                labels = _fmt_labels(self.labelnames, key, 'le="%s"' % le_s)
+                out.append(f"{self.name}_bucket{labels} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total:g}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for m in self.metrics:
+            lines.append(f"# HELP {m.name} {m.doc}")
+            lines.append(f"# TYPE {m.name} {m.kind}")
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "inventorybot_handler_seconds", "Время работы обработчика",
+    ("handler", "state"),
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "inventorybot_handler_errors_total", "Исключения в обработчиках", ("handler",),
+))
+ENRICH_TOTAL = REGISTRY.register(Counter(
+    "inventorybot_enrich_total", "Результаты enrich_item: exact/partial/miss", ("outcome",),
+))
+FUZZY_TOTAL = REGISTRY.register(Counter(
+    "inventorybot_fuzzy_total", "Вызовы fuzzy-поиска в find_closest_item", ("outcome",),
+))
+FUZZY_SCORE = REGISTRY.register(Histogram(
+    "inventorybot_fuzzy_score", "Лучший балл WRatio в find_closest_item", buckets=SCORE_BUCKETS,
+))
+STORAGE_SECONDS = REGISTRY.register(Histogram(
+    "inventorybot_storage_seconds", "Чтение/запись файла инвентаря и ожидание его блокировки (op=lock)", ("op",),
+))
+STORAGE_BYTES = REGISTRY.register(Counter(
+    "inventorybot_storage_bytes_total", "Байт прочитано/записано", ("op",),
+))
+INVENTORY_CACHE_TOTAL = REGISTRY.register(Counter(
+    "inventorybot_inventory_cache_total", "Кеш инвентарей: hit/miss/evict", ("outcome",),
+))
+INVENTORY_CACHE_BYTES = REGISTRY.register(Gauge(
+    "inventorybot_inventory_cache_bytes", "Оценка памяти под кеш инвентарей",
+))
+DUPLICATE_CALLBACKS = REGISTRY.register(Counter(
+    "inventorybot_duplicate_callbacks_total", "Отброшенные повторы нажатий: retry/double_tap", ("reason",),
+))
+TELEGRAM_SECONDS = REGISTRY.register(Histogram(
+    "inventorybot_telegram_api_seconds", "Задержка вызовов Bot API", ("method",),
+))
+TELEGRAM_ERRORS = REGISTRY.register(Counter(
+    "inventorybot_telegram_api_errors_total", "Ошибки вызовов Bot API", ("method",),
+))
+
+
+# --------- Хуки ---------
+
+def instrument_handlers(app):
+    """Оборачивает все обработчики приложения замером времени."""
+    from telegram.ext import ApplicationHandlerStop
+
+    from handler_hooks import wrap_callbacks
+
+    def timed(cb, label):
+        handler, _, state = label.partition("@")
+
+        async def wrapper(update, context):
+            t0 = time.perf_counter()
+            try:
+                return await cb(update, context)
+            except ApplicationHandlerStop:      # не ошибка: обработчик остановил цепочку
+                raise
+            except Exception:
+                HANDLER_ERRORS.inc(handler=handler)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - t0, handler=handler, state=state)
+
+        return wrapper
+
+    wrap_callbacks(app, timed)
+
+
+def instrument_request(request):
+    """Оборачивает транспорт Bot API (BaseRequest) замером задержки по методам."""
+    from telegram.request import BaseRequest
+
+    class TimedRequest(BaseRequest):
+        def __init__(self, inner):
+            self.inner = inner
+
+        @property
+        def read_timeout(self):
+            return self.inner.read_timeout
+
+        async def initialize(self):
+            await self.inner.initialize()
+
+        async def shutdown(self):
+            await self.inner.shutdown()
+
+        async def do_request(self, url, method, request_data=None, **timeouts):
+            api_method = url.rsplit("/", 1)[-1]
+            t0 = time.perf_counter()
+            try:
+                return await self.inner.do_request(url, method, request_data, **timeouts)
+            except Exception:
+                TELEGRAM_ERRORS.inc(method=api_method)
+                raise
+            finally:
+                TELEGRAM_SECONDS.observe(time.perf_counter() - t0, method=api_method)
+
+    return TimedRequest(request)
+
+
+# --------- HTTP ---------
+
+async def serve_metrics(host: str = "127.0.0.1", port: int = 9108, registry: Registry = REGISTRY):
+    """Поднимает GET /metrics. Возвращает asyncio.Server."""
+    from webhook_server import read_request, write_response
+
+    async def on_connect(reader, writer):
+        try:
+            while True:
+                req = await read_request(reader)
+                if req is None:
+                    break
+                method, path, _, _ = req
+                if method == "GET" and path == "/metrics":
+                    await write_response(
+                        writer, 200, registry.render().encode("utf-8"),
+                        content_type="text/plain; version=0.0.4; charset=utf-8",
+                    )
+                else:
+                    await write_response(writer, 404)
+        except (ValueError, OverflowError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(on_connect, host, port)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# offline_bot.py — офлайн-транспорт Bot API: записывает исходящие вызовы вместо сети
+
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    "id": 1000000001,
+    "is_bot": True,
+    "first_name": "InventoryBot",
+    "username": "inventory_offline_bot",
+}
+
+# методы, которые в ответ отдают Message
+_MESSAGE_METHODS = {
+    "sendMessage", "editMessageText", "editMessageReplyMarkup",
+    "sendDocument", "sendPhoto",
+}
+
+
+class OfflineRequest(BaseRequest):
+    """
+    Подменяет HTTP-транспорт бота: ничего не отправляет в сеть,
+    а складывает (метод, параметры, время) в self.calls и
+    возвращает правдоподобный ответ Bot API.
+    """
+
+    def __init__(self, latency: float = 0.0, files: dict[str, bytes] | None = None):
+        self.calls: list[tuple[str, dict, float]] = []
+        self.latency = latency
+        self.files = files or {}     # file_id -> содержимое для getFile/скачивания
+        self._msg_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, **_timeouts):
+        if "/file/bot" in url:
+            # скачивание файла: путь файла == его file_id
+            return 200, self.files.get(url.rsplit("/", 1)[-1], b"")
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params, time.perf_counter()))
+        if self.latency:
+            import asyncio
+            await asyncio.sleep(self.latency)
+
+        result = self._result(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode("utf-8")
+
+    def _result(self, api_method: str, params: dict):
+        if api_method == "getMe":
+            return dict(BOT_USER, can_join_groups=True, supports_inline_queries=True)
+        if api_method == "getFile":
+            fid = params["file_id"]
+            return {"file_id": fid, "file_unique_id": fid,
+                    "file_size": len(self.files.get(fid, b"")), "file_path": fid}
+        if api_method in _MESSAGE_METHODS:
+            if api_method.startswith("edit") and "inline_message_id" in params:
+                return True
+            msg = {
+                "message_id": params.get("message_id") or next(self._msg_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+                "from": BOT_USER,
+            }
+            if "text" in params:
+                msg["text"] = params["text"]
+            return msg
+        return True
+
+    def methods(self) -> list[str]:
+        return [m for m, _, _ in self.calls]
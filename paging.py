@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# paging.py — постраничные списки инвентаря: курсор в callback_data и кеш готовых страниц
+#
+# Кнопка несёт версию инвентаря, с которой построена страница, и номер страницы:
+#   «rm_7_2_15» — удалить запись 15, список версии 7, страница 2;
+#   «pg_7_3»    — перейти на страницу 3 списка версии 7.
+# По версии устаревшее нажатие видно сразу, без разбора инвентаря, а страница
+# (текст + клавиатура) для той же версии берётся из кеша целиком.
+
+from collections import OrderedDict
+
+PER_PAGE = 10
+
+
+def page_count(n: int) -> int:
+    return max(1, (n + PER_PAGE - 1) // PER_PAGE)
+
+
+def encode(prefix: str, *parts: int) -> str:
+    return prefix + "_".join(str(p) for p in parts)
+
+
+def decode(data: str, prefix: str, n: int) -> tuple[int, ...] | None:
+    """Числа после префикса или None, если кнопка старого вида или чужая."""
+    if not data.startswith(prefix):
+        return None
+    parts = data[len(prefix):].split("_")
+    if len(parts) != n or not all(p.isdigit() for p in parts):
+        return None
+    return tuple(int(p) for p in parts)
+
+
+class PageCache:
+    """LRU готовых страниц: ключ включает версию, поэтому правка инвентаря их не портит."""
+
+    def __init__(self, size: int = 1024):
+        self.size = size
+        self._items: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        page = self._items.get(key)
+        if page is not None:
+            self._items.move_to_end(key)
+        return page
+
+    def clear(self):
+        self._items.clear()
+
+    def put(self, key, page):
+        self._items[key] = page
+        self._items.move_to_end(key)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
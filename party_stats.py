@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# party_stats.py — сводка партии для мастера: итоги по игрокам и по всей кампании
+#
+# Итоги считаются один раз по шарду кампании, дальше только поправляются
+# на журнал изменений инвентаря (Inventory.changes) при каждой записи.
+# Поэтому сводка рисуется за время, зависящее от числа игроков и категорий,
+# а не от размера инвентарей.
+
+import item_catalog
+from inventory_model import MAGIC_CATEGORY, Inventory
+
+NO_RARITY = ("Без редкости", "")
+
+
+def _bump(d: dict, key, n: int):
+    v = d.get(key, 0) + n
+    if v:
+        d[key] = v
+    else:
+        d.pop(key, None)
+
+
+class Totals:
+    """Итоги одного инвентаря (или суммы нескольких)."""
+
+    __slots__ = ("items", "by_cat", "by_rarity", "weight", "cost", "unweighed")
+
+    def __init__(self):
+        self.items = 0
+        self.by_cat: dict[str, int] = {}
+        self.by_rarity: dict[tuple[str, str], int] = {}   # (редкость, тир) -> количество
+        self.weight = 0.0
+        self.cost = 0.0
+        self.unweighed = 0          # предметов без известного веса
+
+    def apply(self, cat: str, ref: str | None, qty: int):
+        """Учитывает qty предметов (qty < 0 — убраны)."""
+        self.items += qty
+        _bump(self.by_cat, cat, qty)
+        it = item_catalog.get_item(ref)
+        if cat == MAGIC_CATEGORY:
+            key = (it.get("rarity") or NO_RARITY[0], it.get("tier") or "") if it else NO_RARITY
+            _bump(self.by_rarity, key, qty)
+        w = item_catalog.WEIGHTS.get(ref)
+        if w is None:
+            self.unweighed += qty
+        else:
+            self.weight += w * qty
+        self.cost += item_catalog.COSTS.get(ref, 0.0) * qty
+
+    def merge(self, other: "Totals", sign: int = 1):
+        self.items += sign * other.items
+        for k, v in other.by_cat.items():
+            _bump(self.by_cat, k, sign * v)
+        for k, v in other.by_rarity.items():
+            _bump(self.by_rarity, k, sign * v)
+        self.weight += sign * other.weight
+        self.cost += sign * other.cost
+        self.unweighed += sign * other.unweighed
+
+    @classmethod
+    def of(cls, inv: Inventory) -> "Totals":
+        t = cls()
+        for cat, entries in inv.items():
+            for e in entries:
+                t.apply(cat, e.ref, e.qty)
+        return t
+
+
+class PartyStats:
+    """Итоги одной кампании: по игрокам и общий. generation — поколение шарда, по которому считали."""
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.players: dict[int, Totals] = {}
+        self.total = Totals()
+
+    @classmethod
+    def build(cls, data: dict, generation: int, categories=()) -> "PartyStats":
+        """Полный пересчёт по данным шарда — только при первом обращении."""
+        stats = cls(generation)
+        texts = data.get("_texts")
+        for key, obj in data.items():
+            if key.startswith("_") or not key.isdigit() or not isinstance(obj, dict):
+                continue
+            stats.replace(int(key), Totals.of(Inventory.from_json(obj, categories, texts)))
+        return stats
+
+    def apply(self, uid: int, changes):
+        t = self.players.setdefault(uid, Totals())
+        for cat, ref, qty in changes:
+            t.apply(cat, ref, qty)
+            self.total.apply(cat, ref, qty)
+
+    def replace(self, uid: int, totals: Totals):
+        old = self.players.get(uid)
+        if old is not None:
+            self.total.merge(old, -1)
+        self.players[uid] = totals
+        self.total.merge(totals)
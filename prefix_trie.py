@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# prefix_trie.py — префиксное дерево названий для автодополнения (inline-режим)
+
+import re
+
+_JUNK_RE = re.compile(r"[^\w\s]+")
+
+
+def normalize(s: str) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания и лишних пробелов."""
+    s = _JUNK_RE.sub(" ", (s or "").lower().replace("ё", "е"))
+    return " ".join(s.split())
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: dict[str, "_Node"] = {}
+        self.top: list[int] = []
+
+
+class PrefixTrie:
+    """
+    Дерево по нормализованным названиям: предмет находится по началу
+    любого слова названия («защ» -> «Плащ защиты»).
+    В каждом узле заранее лежат первые top предметов (короткие названия — выше),
+    поэтому поиск — это проход на длину префикса, без обхода поддерева.
+    Глубина ограничена depth символами; более длинный запрос
+    дофильтровывается по подстроке.
+    """
+
+    def __init__(self, items: list[dict], top: int = 20, depth: int = 24):
+        self.items = items
+        self.top = top
+        self.depth = depth
+        self.root = _Node()
+        self._names = [normalize(self.title(it)) for it in items]
+
+        order = sorted(range(len(items)), key=lambda i: (len(self._names[i]), self._names[i]))
+        for idx in order:
+            name = self._names[idx]
+            starts = [0] + [m.end() for m in re.finditer(" ", name)]
+            for s in starts:
+                self._insert(name[s : s + depth], idx)
+
+    @staticmethod
+    def title(item: dict) -> str:
+        """Название без хвоста « / источник»."""
+        return (item.get("name") or "").split(" / ")[0].strip()
+
+    def _insert(self, key: str, idx: int):
+        node = self.root
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+            # предметы вставляются по одному, повтор может быть только последним
+            if len(node.top) < self.top and (not node.top or node.top[-1] != idx):
+                node.top.append(idx)
+
+    def lookup(self, prefix: str) -> list[dict]:
+        q = normalize(prefix)
+        if not q:
+            return []
+        node = self.root
+        for ch in q[: self.depth]:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        found = node.top
+        if len(q) > self.depth:
+            found = [i for i in found if q in self._names[i]]
+        return [self.items[i] for i in found]
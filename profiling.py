@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# profiling.py — профилирование медленных обработчиков по запросу
+#
+# Включается переменной PROFILE_HANDLERS=1 или командой мастера /profile on.
+# Если обработчик работал дольше бюджета, в каталог профилей пишутся:
+#   <время>_<обработчик>.prof — cProfile (открывается pstats/snakeviz),
+#   <время>_<обработчик>.txt  — топ функций и разница аллокаций tracemalloc.
+# Хранится не больше PROFILE_KEEP последних снимков.
+
+import cProfile
+import datetime
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from collections import deque
+from pathlib import Path
+
+from handler_hooks import wrap_callbacks
+
+
+class Capture:
+    __slots__ = ("ts", "handler", "elapsed", "path")
+
+    def __init__(self, ts: float, handler: str, elapsed: float, path: Path | None):
+        self.ts, self.handler, self.elapsed, self.path = ts, handler, elapsed, path
+
+
+class HandlerProfiler:
+    """
+    Оборачивает обработчики. В выключенном режиме — одна проверка флага.
+    Во включённом профилирует каждый вызов, но сохраняет только медленные.
+
+    cProfile один на поток, а обработчики идут параллельно в одном event loop,
+    поэтому одновременно профилируется один вызов; остальные лишь замеряются
+    (в снимок попадают и чужие корутины, работавшие в это время).
+    """
+
+    def __init__(self, directory: Path, budget_ms: float = 500, keep: int = 50, enabled: bool = False):
+        self.directory = Path(directory)
+        self.budget = budget_ms / 1000
+        self.keep = keep
+        self.enabled = False
+        self.recent: deque[Capture] = deque(maxlen=keep)
+        self._busy = False
+        if enabled:
+            self.enable()
+
+    # --- режим ---
+
+    def enable(self, budget_ms: float | None = None):
+        if budget_ms is not None:
+            self.budget = budget_ms / 1000
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def slowest(self, n: int = 10) -> list[Capture]:
+        return sorted(self.recent, key=lambda c: c.elapsed, reverse=True)[:n]
+
+    # --- обёртка ---
+
+    def instrument(self, app):
+        wrap_callbacks(app, self._wrap)
+
+    def _wrap(self, cb, label):
+        handler = label.partition("@")[0]
+
+        async def wrapper(update, context):
+            if not self.enabled:
+                return await cb(update, context)
+            if self._busy:
+                t0 = time.perf_counter()
+                try:
+                    return await cb(update, context)
+                finally:
+                    self._record(handler, time.perf_counter() - t0, None, None)
+
+            self._busy = True
+            prof = cProfile.Profile()
+            before = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+            t0 = time.perf_counter()
+            prof.enable()
+            try:
+                return await cb(update, context)
+            finally:
+                prof.disable()
+                elapsed = time.perf_counter() - t0
+                self._busy = False
+                self._record(handler, elapsed, prof, before)
+
+        return wrapper
+
+    # --- снимки ---
+
+    def _record(self, handler: str, elapsed: float, prof, before):
+        if elapsed < self.budget:
+            return
+        ts = time.time()
+        path = None
+        if prof is not None:
+            stamp = datetime.datetime.fromtimestamp(ts).strftime("%Y%m%d-%H%M%S-%f")
+            path = self.directory / f"{stamp}_{handler}"
+            prof.dump_stats(path.with_suffix(".prof"))
+            path.with_suffix(".txt").write_text(
+                self._report(handler, elapsed, prof, before), encoding="utf-8"
+            )
+            self._rotate()
+        self.recent.append(Capture(ts, handler, elapsed, path))
+
+    @staticmethod
+    def _report(handler: str, elapsed: float, prof, before) -> str:
+        out = io.StringIO()
+        out.write(f"{handler}: {elapsed * 1000:.1f} мс\n\n")
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(30)
+        if before is not None and tracemalloc.is_tracing():
+            after = tracemalloc.take_snapshot()
+            out.write("\nАллокации (разница, топ-20):\n")
+            for stat in after.compare_to(before, "lineno")[:20]:
+                out.write(f"{stat}\n")
+        return out.getvalue()
+
+    def _rotate(self):
+        snaps = sorted(self.directory.glob("*.prof"))
+        for old in snaps[: max(0, len(snaps) - self.keep)]:
+            old.unlink(missing_ok=True)
+            old.with_suffix(".txt").unlink(missing_ok=True)
+
+
+PROFILER = HandlerProfiler(
+    Path(os.getenv("PROFILE_DIR", "profiles")),
+    budget_ms=float(os.getenv("PROFILE_BUDGET_MS", "500")),
+    keep=int(os.getenv("PROFILE_KEEP", "50")),
+    enabled=os.getenv("PROFILE_HANDLERS") == "1",
+)
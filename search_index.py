@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# search_index.py — полнотекстовый поиск по описаниям предметов (инвертированный индекс + BM25)
+
+import heapq
+import math
+import re
+from collections import Counter
+
+_WORD_RE = re.compile(r"[а-яёa-z0-9]+")
+
+# окончания, от длинных к коротким: прилагательные, причастия, глаголы,
+# существительные — упрощённый Snowball без разбора RV/R2
+_SUFFIXES = sorted(
+    set("""
+    ующими ывающий ивающий ующего ующему ующий ующая ующее ующие ующих ующим ующую
+    ыми ими ого его ому ему ыми ими ая яя ое ее ые ие ой ей ий ый ую юю ых их ым им
+    ешь ете ите ишь ют ут ат ят ет ит ем им ла ло ли ть ться тся ся сь
+    ость ости остью ость ами ями ах ях ов ев ей ом ем ам ям ию ия ие ью ья ье
+    а я о е ы и у ю ь й
+    """.split()),
+    key=lambda s: (-len(s), s),     # длинные первыми; равной длины подходит не больше одного
+)
+_MIN_STEM = 3
+
+
+def stem(word: str) -> str:
+    """Лёгкий стемминг: отрезает самое длинное окончание, оставляя основу от 3 букв."""
+    w = word.replace("ё", "е")
+    for suf in _SUFFIXES:
+        if w.endswith(suf) and len(w) - len(suf) >= _MIN_STEM:
+            return w[: -len(suf)]
+    return w
+
+
+def tokenize(text: str) -> list[str]:
+    return [stem(w) for w in _WORD_RE.findall((text or "").lower()) if len(w) > 1]
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс: основа слова -> [(номер документа, частота)].
+    Документ — название (учитывается дважды) + описание предмета.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, items: list[dict]):
+        self.items = items
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.lengths: list[int] = []
+        for doc, it in enumerate(items):
+            tokens = tokenize(it.get("name")) * 2 + tokenize(it.get("description"))
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                self.postings.setdefault(term, []).append((doc, tf))
+        self.avgdl = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def _idf(self, df: int) -> float:
+        n = len(self.lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, limit: int = 50) -> list[tuple[dict, float]]:
+        """(предмет, оценка BM25) по убыванию оценки."""
+        scores: dict[int, float] = {}
+        k1, b, avgdl = self.K1, self.B, self.avgdl or 1.0
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = self._idf(len(plist))
+            for doc, tf in plist:
+                norm = k1 * (1 - b + b * self.lengths[doc] / avgdl)
+                scores[doc] = scores.get(doc, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+        best = heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+        return [(self.items[doc], score) for doc, score in best]
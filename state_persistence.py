@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# state_persistence.py — компактное хранение состояния разговоров (SQLite)
+#
+# В user_data лежат только маленькие ссылки (категория, страница, версия
+# инвентаря, выбранный игрок), поэтому одна строка на пользователя.
+# Пишутся только изменившиеся пользователи и разговоры; кто давно не
+# появлялся — вытесняется по TTL.
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data    TEXT NOT NULL,
+    touched REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name    TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    user_id INTEGER,
+    state   TEXT NOT NULL,
+    touched REAL NOT NULL,
+    PRIMARY KEY (name, key)
+);
+CREATE INDEX IF NOT EXISTS conversations_user ON conversations(user_id);
+"""
+
+
+def _dump(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+
+
+class CompactPersistence(BasePersistence):
+    """
+    Persistence для python-telegram-bot поверх одного файла SQLite.
+    Хранит только user_data и состояния ConversationHandler.
+    """
+
+    def __init__(self, path: str | Path, ttl: float = 7 * 24 * 3600, update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.path = Path(path)
+        self.ttl = ttl
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        self._written: dict[int, str] = {}      # user_id -> последний записанный JSON
+        self._touched: dict[int, float] = {}    # user_id -> последняя активность
+        self._stamped: dict[int, float] = {}    # user_id -> touched в базе
+        self.writes = 0
+
+    # --- чтение при старте ---
+
+    async def get_user_data(self):
+        cutoff = time.time() - self.ttl
+        out = {}
+        for uid, data, touched in self._db.execute(
+            "SELECT user_id, data, touched FROM user_data WHERE touched >= ?", (cutoff,)
+        ):
+            out[uid] = json.loads(data)
+            self._written[uid] = data
+            self._touched[uid] = self._stamped[uid] = touched
+        return out
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        cutoff = time.time() - self.ttl
+        out = {}
+        for key, state in self._db.execute(
+            "SELECT key, state FROM conversations WHERE name = ? AND touched >= ?",
+            (name, cutoff),
+        ):
+            out[tuple(json.loads(key))] = json.loads(state)
+        return out
+
+    # --- запись ---
+
+    async def update_conversation(self, name, key, new_state):
+        k = _dump(list(key))
+        with self._db:
+            if new_state is None:
+                self._db.execute(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?", (name, k)
+                )
+            else:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?, ?)",
+                    (name, k, key[-1], _dump(new_state), time.time()),
+                )
+        self.writes += 1
+
+    async def update_user_data(self, user_id, data):
+        now = time.time()
+        self._touched[user_id] = now
+        if not data:
+            if self._written.pop(user_id, None) is not None:
+                with self._db:
+                    self._db.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+            return
+        blob = _dump(data)
+        if self._written.get(user_id) == blob:
+            # ничего не поменялось — не пишем, лишь изредка продлеваем TTL
+            if now - self._stamped.get(user_id, 0) > self.ttl / 4:
+                with self._db:
+                    self._db.execute(
+                        "UPDATE user_data SET touched = ? WHERE user_id = ?", (now, user_id)
+                    )
+                self._stamped[user_id] = now
+            return
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO user_data VALUES (?, ?, ?)", (user_id, blob, now)
+            )
+        self._written[user_id] = blob
+        self._stamped[user_id] = now
+        self.writes += 1
+
+    async def drop_user_data(self, user_id):
+        self._written.pop(user_id, None)
+        self._stamped.pop(user_id, None)
+        with self._db:
+            self._db.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+            self._db.execute("DELETE FROM conversations WHERE user_id = ?", (user_id,))
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        self._db.commit()
+
+    # --- вытеснение ---
+
+    def evict_idle(self, now: float | None = None) -> list[int]:
+        """
+        Удаляет состояние тех, кто не появлялся дольше TTL.
+        Возвращает их user_id, чтобы выкинуть данные и из памяти Application.
+        """
+        cutoff = (now or time.time()) - self.ttl
+        idle = [uid for uid, t in self._touched.items() if t < cutoff]
+        for uid in idle:
+            self._touched.pop(uid, None)
+            self._written.pop(uid, None)
+            self._stamped.pop(uid, None)
+        with self._db:
+            self._db.execute("DELETE FROM user_data WHERE touched < ?", (cutoff,))
+            self._db.execute("DELETE FROM conversations WHERE touched < ?", (cutoff,))
+        return idle
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+# storage_codec.py — форматы файлов хранилища: JSON с отступами, компактный JSON, msgpack
+#
+#   python storage_codec.py info FILE...
+#   python storage_codec.py migrate --codec msgpack FILE...
+#
+# Формат определяется по содержимому, а не по расширению:
+#   «{» (после пробелов) — JSON, как все файлы до появления кодеков;
+#   MAGIC + версия формата + номер кодека — двоичный формат с заголовком.
+# Шард пишется кодеком из STORAGE_CODEC; файл в другом формате читается как есть
+# и переписывается при следующей записи (или сразу — командой migrate).
+
+import json
+import os
+import sys
+from pathlib import Path
+
+try:
+    import msgpack
+except ImportError:         # нужен только для STORAGE_CODEC=msgpack
+    msgpack = None
+
+MAGIC = b"\x89INV"          # не-ASCII первый байт: с JSON-текстом не спутать
+FORMAT_VERSION = 1
+DEFAULT = "json"
+
+
+class Codec:
+    """name — имя в STORAGE_CODEC; tag — номер в заголовке (0 — текст без заголовка)."""
+
+    __slots__ = ("name", "tag", "_dumps", "_loads")
+
+    def __init__(self, name: str, tag: int, dumps, loads):
+        self.name = name
+        self.tag = tag
+        self._dumps = dumps
+        self._loads = loads
+
+    @property
+    def binary(self) -> bool:
+        return self.tag != 0
+
+    def encode(self, obj) -> bytes:
+        raw = self._dumps(obj)
+        return MAGIC + bytes((FORMAT_VERSION, self.tag)) + raw if self.binary else raw
+
+    def decode(self, raw: bytes):
+        return self._loads(raw[len(MAGIC) + 2:] if self.binary else raw)
+
+    def __repr__(self):
+        return f"Codec({self.name!r})"
+
+
+def _msgpack_dumps(obj) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _msgpack_loads(raw: bytes):
+    return msgpack.unpackb(raw, raw=False)
+
+
+CODECS = {
+    c.name: c for c in (
+        Codec("json-pretty", 0,
+              lambda o: json.dumps(o, ensure_ascii=False, indent=2).encode("utf-8"), json.loads),
+        Codec("json", 0,
+              lambda o: json.dumps(o, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), json.loads),
+        Codec("msgpack", 1, _msgpack_dumps, _msgpack_loads),
+    )
+}
+_BY_TAG = {c.tag: c for c in CODECS.values() if c.binary}
+
+
+def available() -> list[str]:
+    return [name for name in CODECS if name != "msgpack" or msgpack is not None]
+
+
+def get(name: str) -> Codec:
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"неизвестный кодек {name!r}, есть: {', '.join(CODECS)}")
+    if name == "msgpack" and msgpack is None:
+        raise ValueError("кодек msgpack: пакет msgpack не установлен (pip install msgpack)")
+    return codec
+
+
+def is_binary(head: bytes) -> bool:
+    return head.startswith(MAGIC)
+
+
+def detect(raw: bytes) -> Codec:
+    """Кодек, которым записаны байты. Для JSON — с отступами или компактный, по началу."""
+    if is_binary(raw):
+        if len(raw) < len(MAGIC) + 2:
+            raise ValueError("обрезанный заголовок")
+        version, tag = raw[len(MAGIC)], raw[len(MAGIC) + 1]
+        if version > FORMAT_VERSION:
+            raise ValueError(f"формат версии {version} новее поддерживаемой ({FORMAT_VERSION})")
+        if tag not in _BY_TAG:
+            raise ValueError(f"неизвестный кодек №{tag}")
+        return get(_BY_TAG[tag].name)
+    return CODECS["json-pretty"] if raw[:2] == b"{\n" else CODECS["json"]
+
+
+def decode(raw: bytes):
+    return detect(raw).decode(raw)
+
+
+def load_file(path):
+    return decode(Path(path).read_bytes())
+
+
+def convert(path, codec: Codec) -> tuple[str, int, int]:
+    """Переписывает файл кодеком codec: (прежний кодек, байт было, байт стало)."""
+    from campaigns import file_lock      # тот же замок, что у бота: можно на живом боте
+
+    path = Path(path)
+    with file_lock(path):
+        raw = path.read_bytes()
+        old = detect(raw)
+        new = codec.encode(old.decode(raw))
+        if old is not codec:
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+            tmp.write_bytes(new)
+            os.replace(tmp, path)
+    return old.name, len(raw), len(new)
+
+
+def export(path, dst, codec: Codec) -> int:
+    """Копия файла в формате codec (сам файл не трогается); возвращает размер копии."""
+    from campaigns import file_lock
+
+    with file_lock(path):
+        raw = Path(path).read_bytes()
+    new = codec.encode(decode(raw))
+    dst = Path(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(new)
+    os.replace(tmp, dst)
+    return len(new)
+
+
+def main(argv=None):
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Формат файлов хранилища")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    info = sub.add_parser("info", help="каким кодеком записаны файлы")
+    info.add_argument("files", nargs="+")
+    mig = sub.add_parser("migrate", help="переписать файлы в другом формате")
+    mig.add_argument("--codec", default=os.getenv("STORAGE_CODEC", DEFAULT), choices=sorted(CODECS))
+    mig.add_argument("files", nargs="+")
+    args = ap.parse_args(argv)
+
+    for f in args.files:
+        if args.cmd == "info":
+            raw = Path(f).read_bytes()
+            print(f"{f}: {detect(raw).name}, {len(raw)} байт")
+        else:
+            old, before, after = convert(f, get(args.codec))
+            print(f"{f}: {old} → {args.codec}, {before} → {after} байт")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
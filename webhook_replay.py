@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# webhook_replay.py — сквозная проверка webhook-режима без сети:
+# поднимает WebhookServer на localhost, отправляет в него записанные апдейты
+# и проверяет, что бот их обработал (исходящие вызовы пишет OfflineRequest).
+#
+#   python webhook_replay.py [samples/webhook_updates.jsonl]
+
+import asyncio
+import collections
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import httpx
+
+import InventoryBot as bot
+from offline_bot import OfflineRequest
+from webhook_server import WebhookServer, SECRET_HEADER
+
+SAMPLES = Path(__file__).with_name("samples") / "webhook_updates.jsonl"
+SECRET = "replay-secret"
+
+
+def load_updates(path: Path) -> list[dict]:
+    with path.open(encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def replay(path: Path) -> int:
+    updates = load_updates(path)
+    failures = []
+
+    tmp = tempfile.TemporaryDirectory()
+    bot.DATA_FILE = Path(tmp.name) / "inventory_data.json"
+    bot.STATE_DB = Path(tmp.name) / "conversation_state.sqlite3"
+    bot.HISTORY_DB = Path(tmp.name) / "inventory_history.sqlite3"
+    bot.load_catalogs()
+
+    request = OfflineRequest()
+    app = bot.build_application(token="0:offline", request=request, webhook=True)
+
+    errors = []
+
+    async def on_error(update, context):
+        errors.append(context.error)
+
+    app.add_error_handler(on_error)
+
+    server = WebhookServer(app, path="/telegram", secret=SECRET, host="127.0.0.1", port=0)
+    await app.initialize()
+    await app.start()
+    await server.start()
+    url = f"http://127.0.0.1:{server.port}/telegram"
+
+    async with httpx.AsyncClient() as client:
+        r = await client.post(url, json=updates[0], headers={SECRET_HEADER: "wrong"})
+        if r.status_code != 403:
+            failures.append(f"неверный секрет: ожидали 403, получили {r.status_code}")
+
+        for upd in updates:
+            r = await client.post(url, json=upd, headers={SECRET_HEADER: SECRET})
+            if r.status_code != 200:
+                failures.append(f"update {upd.get('update_id')}: HTTP {r.status_code}")
+
+    # мягкая остановка: всё принятое должно быть обработано
+    await server.stop()
+    await app.stop()
+    await app.shutdown()
+    tmp.cleanup()
+
+    methods = collections.Counter(request.methods())
+    print(f"📨 Отправлено: {len(updates)}, принято: {server.accepted}, отклонено: {server.rejected}")
+    print("📤 Исходящие вызовы: " + ", ".join(f"{m}×{n}" for m, n in sorted(methods.items())))
+
+    if server.accepted != len(updates):
+        failures.append(f"принято {server.accepted} из {len(updates)}")
+    if not methods.get("sendMessage"):
+        failures.append("бот ничего не ответил")
+    for e in errors:
+        failures.append(f"ошибка обработчика: {e!r}")
+
+    for f in failures:
+        print("❌ " + f)
+    if not failures:
+        print("✅ Webhook-режим работает.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    src = Path(sys.argv[1]) if len(sys.argv) > 1 else SAMPLES
+    sys.exit(asyncio.run(replay(src)))
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+# webhook_server.py — встроенный async HTTP-сервер для режима webhook
+
+import asyncio
+import hmac
+import json
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+MAX_BODY = 1 << 20          # Telegram не присылает апдейты больше мегабайта
+HEADER_TIMEOUT = 75.0       # сколько держим простаивающее keep-alive соединение
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+# --------- Минимальный HTTP/1.1 ---------
+
+async def read_request(reader: asyncio.StreamReader, timeout: float = HEADER_TIMEOUT):
+    """
+    Читает один HTTP-запрос.
+    Возвращает (method, path, headers, body) или None, если клиент закрыл соединение.
+    Заголовки — dict с ключами в нижнем регистре.
+    """
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ValueError("headers too large")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise ValueError("bad request line")
+
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        k, _, v = line.partition(":")
+        headers[k.strip().lower()] = v.strip()
+
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise OverflowError(length)
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+async def read_response(reader: asyncio.StreamReader, timeout: float = HEADER_TIMEOUT):
+    """Ответ на наш запрос (для пересылки в worker_pool.py): (status, headers, body)."""
+    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        status = int(lines[0].split(" ", 2)[1])
+    except (IndexError, ValueError):
+        raise ValueError("bad status line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            k, _, v = line.partition(":")
+            headers[k.strip().lower()] = v.strip()
+    length = int(headers.get("content-length") or 0)
+    body = await reader.readexactly(length) if length else b""
+    return status, headers, body
+
+
+async def write_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    body: bytes = b"",
+    content_type: str = "text/plain; charset=utf-8",
+    keep_alive: bool = True,
+):
+    head = (
+        f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    ).encode("latin-1")
+    writer.write(head + body)
+    await writer.drain()
+
+
+# --------- Порядок апдейтов ---------
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллелит апдейты разных пользователей, но апдейты одного пользователя
+    обрабатывает строго по очереди — иначе разговорники (ConversationHandler)
+    увидят «Оружие» раньше, чем «➕ Добавить предмет».
+    """
+
+    # семафор базового класса берётся ещё до do_process_update, то есть до замка
+    # пользователя: пачка апдейтов одного игрока заняла бы все места, ожидая друг друга.
+    # Поэтому базовый семафор не ограничивает, а свой (limit) берётся уже под замком.
+    _UNBOUNDED = 1 << 30
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(self._UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._waiters: dict[int, int] = {}
+
+    @staticmethod
+    def _key(update) -> int:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return 0
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                # последний в очереди — не копим замки по всем когда-либо писавшим
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+
+# --------- Сервер ---------
+
+class WebhookServer:
+    """
+    Принимает апдейты Telegram по HTTP и кладёт их в application.update_queue.
+    Обработку параллелит само Application (concurrent_updates), сервер
+    лишь валидирует секрет и быстро отвечает 200.
+
+    stop() — мягкая остановка: новые соединения не принимаются, простаивающие
+    keep-alive закрываются, начатые запросы дочитываются и ставятся в очередь.
+    """
+
+    def __init__(
+        self,
+        app,
+        path: str = "/telegram",
+        secret: str | None = None,
+        host: str = "0.0.0.0",
+        port: int = 8443,
+    ):
+        self.app = app
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = port
+        self._server: asyncio.base_events.Server | None = None
+        self._conns: dict[asyncio.Task, bool] = {}   # задача -> занята запросом
+        self._closing = False
+        self.accepted = 0
+        self.rejected = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_connect, self.host, self.port)
+        if not self.port:
+            # порт 0 — взять тот, что выдала ОС (удобно для тестов)
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self, timeout: float = 30.0):
+        self._closing = True
+        if self._server:
+            self._server.close()
+
+        idle = [t for t, busy in self._conns.items() if not busy]
+        for t in idle:
+            t.cancel()
+        busy = [t for t, b in self._conns.items() if b]
+        if busy:
+            _, pending = await asyncio.wait(busy, timeout=timeout)
+            for t in pending:
+                t.cancel()
+        if self._conns:
+            await asyncio.gather(*self._conns, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+
+    async def _on_connect(self, reader, writer):
+        task = asyncio.current_task()
+        self._conns[task] = False
+        try:
+            while not self._closing:
+                try:
+                    req = await read_request(reader)
+                except OverflowError:
+                    await write_response(writer, 413, keep_alive=False)
+                    break
+                except ValueError:
+                    await write_response(writer, 400, keep_alive=False)
+                    break
+                if req is None:
+                    break
+
+                self._conns[task] = True
+                status = await self._handle(*req)
+                keep = not self._closing and req[2].get("connection", "").lower() != "close"
+                await write_response(writer, status, keep_alive=keep)
+                self._conns[task] = False
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._conns.pop(task, None)
+            writer.close()
+
+    async def _handle(self, method, path, headers, body) -> int:
+        if method == "GET" and path in ("/", "/healthz"):
+            return 200
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret.encode()
+        ):
+            self.rejected += 1
+            return 403
+
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except (ValueError, TypeError, KeyError):
+            return 400
+        if update is None:
+            return 400
+
+        await self.app.update_queue.put(update)
+        self.accepted += 1
+        return 200
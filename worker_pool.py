@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+# worker_pool.py — несколько процессов бота за одним webhook-входом
+#
+#   BOT_MODE=webhook BOT_WORKERS=4 python InventoryBot.py
+#
+# Фронт (этот процесс) принимает апдейты от Telegram, проверяет секрет и
+# пересылает апдейт одному из N процессов-обработчиков на 127.0.0.1.
+# Процесс выбирается по хешу пользователя (иначе чата) — того же ключа, что у
+# PerUserUpdateProcessor, — поэтому разговор игрока всегда живёт в одном процессе,
+# и его состояние (ConversationHandler, user_data) не нужно делить между ними.
+#
+# Общее у процессов — только файлы: шарды кампаний пишутся под блокировкой
+# (campaigns.Shard.alock), а campaigns.json и каталог каждый процесс сверяет
+# с диском (InventoryBot.sync_shared_state), так что кеши не расходятся.
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import time
+
+from webhook_server import SECRET_HEADER, WebhookServer, read_response
+
+READY_TIMEOUT = 60.0        # сколько ждать, пока обработчик загрузит каталог и поднимет порт
+FORWARD_TIMEOUT = 30.0
+RESPAWN_DELAY = 5.0         # не перезапускать падающий обработчик чаще
+MAX_IDLE_CONNS = 64         # keep-alive соединений к одному обработчику
+PARENT_CHECK = 1.0          # как часто обработчик проверяет, жив ли вход
+
+
+def update_key(raw: dict) -> int:
+    """Ключ маршрутизации из JSON апдейта: id пользователя, иначе чата, иначе 0."""
+    chat = None
+    for val in raw.values():
+        if not isinstance(val, dict):
+            continue
+        user = val.get("from") or val.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = chat or val.get("chat") or (val.get("message") or {}).get("chat")
+    if isinstance(chat, dict) and "id" in chat:
+        return int(chat["id"])
+    return 0
+
+
+def worker_for(key: int, n: int) -> int:
+    """Номер обработчика: blake2b стабилен между процессами и перезапусками (в отличие от hash)."""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % n
+
+
+async def watch_parent(on_orphan, interval: float = PARENT_CHECK):
+    """
+    В обработчике пула: вызывает on_orphan(), когда процесс-вход умер (тогда
+    родителем становится другой процесс), — иначе обработчик пережил бы вход
+    и держал порт, нужный перезапущенному пулу. Вне пула ничего не делает.
+    """
+    parent = os.getenv("WORKER_PARENT_PID")
+    if not parent:
+        return
+    while os.getppid() == int(parent):
+        await asyncio.sleep(interval)
+    on_orphan()
+
+
+class Upstream:
+    """
+    Keep-alive соединения к одному обработчику. Свой минимальный HTTP/1.1-клиент:
+    вход пересылает каждый апдейт, и на нём httpx съедал бы больше CPU,
+    чем вся остальная работа входа.
+    """
+
+    def __init__(self, host: str, port: int, max_idle: int = MAX_IDLE_CONNS):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self._idle: list[tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers: dict | None = None,
+                      timeout: float = FORWARD_TIMEOUT) -> int:
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+        head += "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+        data = (head + "\r\n").encode("latin-1") + body
+        # простаивающее соединение обработчик мог закрыть — тогда одна попытка на новом;
+        # закрывает он только между запросами, так что апдейт не обработается дважды
+        for attempt in (0, 1):
+            fresh = attempt or not self._idle
+            reader, writer = (await asyncio.open_connection(self.host, self.port)) if fresh else self._idle.pop()
+            try:
+                writer.write(data)
+                await writer.drain()
+                status, resp_headers, _ = await read_response(reader, timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if fresh:
+                    raise
+                continue
+            except BaseException:
+                writer.close()
+                raise
+            if resp_headers.get("connection", "").lower() == "close" or len(self._idle) >= self.max_idle:
+                writer.close()
+            else:
+                self._idle.append((reader, writer))
+            return status
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle.clear()
+
+
+class WorkerPool:
+    """
+    N дочерних процессов, каждый — бот в webhook-режиме на своём порту.
+    cmd — команда запуска обработчика; номер, порт и внутренний секрет
+    передаются через окружение (WORKER_INDEX, WEBHOOK_PORT, WEBHOOK_SECRET).
+    """
+
+    def __init__(self, n: int, cmd: list[str], host: str = "127.0.0.1", base_port: int = 8444,
+                 env: dict | None = None, metrics_port: int = 0, stdout=None,
+                 ports: list[int] | None = None):
+        self.n = n
+        self.cmd = cmd
+        self.host = host
+        self.ports = ports or [base_port + i for i in range(n)]
+        self.env = env or {}
+        self.metrics_port = metrics_port    # 0 — обработчики без /metrics, иначе порт+1+номер
+        self.stdout = stdout
+        self.secret = secrets.token_urlsafe(24)
+        self.procs: list[subprocess.Popen | None] = [None] * n
+        self.upstreams = [Upstream(host, p) for p in self.ports]
+        self._started = [0.0] * n
+        self.respawns = 0
+
+    def _spawn(self, i: int):
+        env = dict(os.environ, **self.env)
+        env.update(
+            BOT_MODE="webhook",
+            BOT_WORKERS="1",
+            WORKER_INDEX=str(i),
+            WORKER_PARENT_PID=str(os.getpid()),
+            WEBHOOK_HOST=self.host,
+            WEBHOOK_PORT=str(self.ports[i]),
+            WEBHOOK_PATH="/telegram",
+            WEBHOOK_SECRET=self.secret,
+            WEBHOOK_URL="",                 # адрес у Telegram регистрирует фронт
+            METRICS_PORT=str(self.metrics_port + 1 + i if self.metrics_port else 0),
+        )
+        self.procs[i] = subprocess.Popen(self.cmd, env=env, stdout=self.stdout)
+        self._started[i] = time.monotonic()
+
+    def start(self):
+        for i in range(self.n):
+            self._spawn(i)
+
+    async def wait_ready(self, timeout: float = READY_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        for i in range(self.n):
+            while True:
+                if self.procs[i].poll() is not None:
+                    raise RuntimeError(f"обработчик {i} завершился с кодом {self.procs[i].returncode}")
+                try:
+                    if await self.upstreams[i].request("GET", "/healthz", timeout=1.0) == 200:
+                        break
+                except (OSError, asyncio.TimeoutError, ValueError):
+                    pass
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"обработчик {i} не поднялся за {timeout:.0f} с")
+                await asyncio.sleep(0.1)
+
+    def check(self):
+        """Перезапускает упавшие обработчики (их пользователи ждут, пока Telegram повторит апдейт)."""
+        for i, p in enumerate(self.procs):
+            if p is not None and p.poll() is not None and time.monotonic() - self._started[i] > RESPAWN_DELAY:
+                print(f"⚠️ Обработчик {i} завершился (код {p.returncode}) — перезапускаю")
+                self.respawns += 1
+                self._spawn(i)
+
+    async def stop(self, timeout: float = 30.0) -> list[bytes]:
+        """SIGTERM всем и ожидание: обработчики дорабатывают принятые апдейты. Возвращает их stdout."""
+        for up in self.upstreams:
+            up.close()
+        for p in self.procs:
+            if p is not None and p.poll() is None:
+                p.send_signal(signal.SIGTERM)
+        out = []
+        for p in self.procs:
+            if p is None:
+                out.append(b"")
+                continue
+            try:
+                data, _ = await asyncio.to_thread(p.communicate, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                p.kill()
+                data, _ = p.communicate()
+            out.append(data or b"")
+        return out
+
+
+class FrontServer(WebhookServer):
+    """
+    Webhook-вход пула: тот же HTTP-сервер, что у одиночного бота, но апдейт
+    не разбирается в Update, а целиком пересылается нужному обработчику.
+    Если обработчик недоступен — 503, и Telegram повторит доставку.
+    """
+
+    def __init__(self, pool: WorkerPool, path: str = "/telegram", secret: str | None = None,
+                 host: str = "0.0.0.0", port: int = 8443):
+        super().__init__(None, path=path, secret=secret, host=host, port=port)
+        self.pool = pool
+        self.routed = [0] * pool.n
+        self.failed = 0
+
+    async def _handle(self, method, path, headers, body) -> int:
+        if method == "GET" and path in ("/", "/healthz"):
+            return 200
+        if path != self.path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, "").encode(), self.secret.encode()
+        ):
+            self.rejected += 1
+            return 403
+        try:
+            raw = json.loads(body)
+        except ValueError:
+            return 400
+        if not isinstance(raw, dict):
+            return 400
+
+        i = worker_for(update_key(raw), self.pool.n)
+        try:
+            status = await self.pool.upstreams[i].request(
+                "POST", "/telegram", body,
+                {SECRET_HEADER: self.pool.secret, "Content-Type": "application/json"},
+            )
+        except (OSError, asyncio.TimeoutError, ValueError):
+            self.failed += 1
+            return 503
+        if status == 200:
+            self.routed[i] += 1
+            self.accepted += 1
+        return status
+
+
+async def run_pool(n: int, path: str, secret: str | None, host: str, port: int,
+                   webhook_url: str | None = None, token: str | None = None,
+                   max_connections: int = 40, metrics_port: int = 0):
+    """Фронт + N обработчиков (InventoryBot.py) до SIGINT/SIGTERM."""
+    pool = WorkerPool(
+        n, [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "InventoryBot.py")],
+        base_port=port + 1, metrics_port=metrics_port,
+    )
+    front = FrontServer(pool, path=path, secret=secret, host=host, port=port)
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    try:
+        pool.start()
+        await pool.wait_ready()
+        await front.start()
+        if webhook_url:
+            from telegram import Bot, Update
+
+            async with Bot(token) as bot:
+                await bot.set_webhook(
+                    webhook_url.rstrip("/") + path, secret_token=secret,
+                    allowed_updates=Update.ALL_TYPES, max_connections=max_connections,
+                )
+        print(f"✅ Пул запущен: вход {host}:{port}{path}, обработчиков {n} (порты {pool.ports[0]}–{pool.ports[-1]})")
+
+        while not stop_event.is_set():
+            try:
+                await asyncio.wait_for(stop_event.wait(), RESPAWN_DELAY)
+            except asyncio.TimeoutError:
+                pool.check()
+    finally:
+        # сначала вход перестаёт принимать и дожидается начатых пересылок,
+        # затем обработчики дорабатывают свои очереди
+        await front.stop()
+        await pool.stop()
+        print(f"🛑 Пул остановлен, переслано по обработчикам: {front.routed}")